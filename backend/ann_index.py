@@ -0,0 +1,158 @@
+import logging
+import os
+from typing import Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ANN_NPROBE = int(os.getenv('ANN_NPROBE', '16'))
+# Below this many vectors the index is a single exact list
+ANN_MIN_TRAIN_SIZE = int(os.getenv('ANN_MIN_TRAIN_SIZE', '4096'))
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLES_PER_LIST = 64
+ASSIGN_CHUNK = 65536
+
+class IVFIndex:
+    """Inverted-file index for cosine top-K over unit-normalized vectors
+
+    A spherical k-means quantizer splits the vectors into about sqrt(N)
+    lists. A query scans only the `nprobe` lists whose centroids are closest.
+    Each list keeps its vectors contiguous, so probing a list takes a single
+    matrix-vector product. Inserts go to the nearest list, and the
+    quantizer is retrained once the index has doubled since the last
+    training.
+    """
+
+    def __init__(self, dim: int, nprobe: int = ANN_NPROBE, min_train_size: int = ANN_MIN_TRAIN_SIZE, seed: int = 0):
+        self.dim = dim
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self._rng = np.random.default_rng(seed)
+        self._centroids = np.zeros((1, dim), dtype=np.float32)
+        self._vectors = [np.empty((0, dim), dtype=np.float32)]
+        self._ids = [np.empty(0, dtype=np.int64)]
+        self._counts = [0]
+        self._size = 0
+        self._trained_size = 0
+        # Which non-negative ids have been added (see contains)
+        self._present = np.zeros(0, dtype=bool)
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def nlist(self) -> int:
+        return len(self._counts)
+
+    def add(self, ids: np.ndarray, vectors: np.ndarray):
+        """Insert vectors (rows of `vectors`) under the given integer ids"""
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(ids), self.dim)
+        if len(ids) == 0:
+            return
+        if ids.max() >= len(self._present):
+            present = np.zeros(max(int(ids.max()) + 1, 2 * len(self._present)), dtype=bool)
+            present[:len(self._present)] = self._present
+            self._present = present
+        self._present[ids] = True
+        self._size += len(ids)
+        if self._size >= max(self.min_train_size, 2 * self._trained_size):
+            ids, vectors = self._drain(ids, vectors)
+            self._train(vectors)
+        self._append(self._assign(vectors), ids, vectors)
+
+    def contains(self, ids: np.ndarray) -> np.ndarray:
+        """Whether each (non-negative) id has been added"""
+        ids = np.asarray(ids, dtype=np.int64)
+        known = ids < len(self._present)
+        known[known] = self._present[ids[known]]
+        return known
+
+    def search(self, query: np.ndarray, k: int, exclude: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Ids and cosine scores of the (approximately) k nearest vectors, best first"""
+        query = np.asarray(query, dtype=np.float32)
+        nprobe = min(self.nprobe, self.nlist)
+        centroid_scores = self._centroids @ query
+        probe = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe] if nprobe < self.nlist else range(self.nlist)
+
+        ids, scores = [], []
+        for lst in probe:
+            count = self._counts[lst]
+            if count:
+                ids.append(self._ids[lst][:count])
+                scores.append(self._vectors[lst][:count] @ query)
+        if not ids:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        ids = np.concatenate(ids)
+        scores = np.concatenate(scores)
+        if exclude is not None:
+            keep = ids != exclude
+            ids, scores = ids[keep], scores[keep]
+
+        k = min(k, len(ids))
+        if k <= 0:
+            return ids[:0], scores[:0]
+        top = np.argpartition(-scores, k - 1)[:k] if k < len(ids) else np.arange(len(ids))
+        top = top[np.lexsort((ids[top], -scores[top]))]
+        return ids[top], scores[top]
+
+    def _assign(self, vectors: np.ndarray) -> np.ndarray:
+        if self.nlist == 1:
+            return np.zeros(len(vectors), dtype=np.int64)
+        labels = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), ASSIGN_CHUNK):
+            chunk = vectors[start:start + ASSIGN_CHUNK]
+            labels[start:start + len(chunk)] = np.argmax(chunk @ self._centroids.T, axis=1)
+        return labels
+
+    def _append(self, labels: np.ndarray, ids: np.ndarray, vectors: np.ndarray):
+        order = np.argsort(labels, kind='stable')
+        labels, ids, vectors = labels[order], ids[order], vectors[order]
+        bounds = np.flatnonzero(np.diff(labels)) + 1
+        for group in np.split(np.arange(len(labels)), bounds):
+            if len(group) == 0:
+                continue
+            lst = labels[group[0]]
+            count = self._counts[lst]
+            needed = count + len(group)
+            if needed > len(self._ids[lst]):
+                capacity = max(needed, 2 * len(self._ids[lst]), 16)
+                grown_vectors = np.empty((capacity, self.dim), dtype=np.float32)
+                grown_vectors[:count] = self._vectors[lst][:count]
+                grown_ids = np.empty(capacity, dtype=np.int64)
+                grown_ids[:count] = self._ids[lst][:count]
+                self._vectors[lst], self._ids[lst] = grown_vectors, grown_ids
+            self._vectors[lst][count:needed] = vectors[group]
+            self._ids[lst][count:needed] = ids[group]
+            self._counts[lst] = needed
+
+    def _drain(self, ids: np.ndarray, vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Pull every stored vector out of the lists, followed by the new ones"""
+        all_ids = [self._ids[lst][:self._counts[lst]] for lst in range(self.nlist)] + [ids]
+        all_vectors = [self._vectors[lst][:self._counts[lst]] for lst in range(self.nlist)] + [vectors]
+        return np.concatenate(all_ids), np.concatenate(all_vectors)
+
+    def _train(self, vectors: np.ndarray):
+        """Spherical k-means on a sample, then reset the lists"""
+        nlist = int(np.clip(np.sqrt(len(vectors)), 1, 4096))
+        sample_size = min(len(vectors), nlist * KMEANS_SAMPLES_PER_LIST)
+        sample = vectors[self._rng.choice(len(vectors), sample_size, replace=False)]
+        centroids = sample[self._rng.choice(sample_size, nlist, replace=False)].copy()
+        for _ in range(KMEANS_ITERATIONS):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            counts = np.bincount(labels, minlength=nlist)
+            empty = counts == 0
+            # Reseed empty lists from random sample points
+            sums[empty] = sample[self._rng.choice(sample_size, int(empty.sum()))]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            centroids = sums / np.where(norms > 0, norms, 1)
+
+        self._centroids = centroids.astype(np.float32)
+        self._vectors = [np.empty((0, self.dim), dtype=np.float32) for _ in range(nlist)]
+        self._ids = [np.empty(0, dtype=np.int64) for _ in range(nlist)]
+        self._counts = [0] * nlist
+        self._trained_size = len(vectors)
+        logger.info(f"Trained IVF index with {nlist} lists over {len(vectors)} vectors")
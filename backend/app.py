@@ -1,82 +1,197 @@
 # backend/app.py - Enhanced with Authentication
 
-from flask import Flask, jsonify, request
+from flask import Blueprint, Flask, Response, jsonify, request, stream_with_context
 from flask_cors import CORS
 import json
 import uuid
 import os
-from math import radians, sin, cos, sqrt, atan2
-import openai
-import requests
-from geopy.geocoders import Nominatim
+import threading
+import time
+from math import radians, sin, cos, sqrt, atan2, isfinite
 from dotenv import load_dotenv
 from auth import (
     create_user, find_user_by_email, check_password, 
-    generate_token, token_required, update_user_profile, get_user_preferences, update_user_preferences, get_user_sustainability_goals, update_user_sustainability_goals
+    generate_token, token_required, admin_required, SELF_SERVICE_ROLES, is_admin_request, optional_token_payload, load_users, update_user_profile, get_user_preferences, update_user_preferences, get_user_sustainability_goals, update_user_sustainability_goals
 )
-from vector_engine import VectorEngine
-from matching_engine import AdvancedMatcher
 import logging
 
+import changelog
+import metrics
+import profiling
+import singleflight
+
 # Load environment variables
 load_dotenv()
 
 # --- Azure OpenAI Configuration ---
-client = None
-
-# Check for required environment variables
 AZURE_OPENAI_ENDPOINT = os.getenv('AZURE_OPENAI_ENDPOINT')
 AZURE_OPENAI_API_KEY = os.getenv('AZURE_OPENAI_API_KEY')
 AZURE_OPENAI_DEPLOYMENT_NAME = os.getenv('AZURE_OPENAI_DEPLOYMENT_NAME', 'gpt-4')
 
-if AZURE_OPENAI_ENDPOINT and AZURE_OPENAI_API_KEY:
+# Largest k accepted by the similar-entity endpoints
+MAX_SIMILAR_RESULTS = 100
+
+# Largest limit accepted by /api/search
+MAX_SEARCH_RESULTS = 50
+
+# Largest limit accepted by /api/notifications
+MAX_NOTIFICATIONS = 200
+
+# Most producer pools returned by /api/consumers/<id>/matches?pools=N
+MAX_POOLS = 10
+
+# Default time budget of a ranked-matches request in milliseconds (0 for none); clients
+# can ask for another with the X-Match-Budget-Ms header
+MATCH_BUDGET_MS = float(os.getenv('MATCH_BUDGET_MS', '2000'))
+MATCH_BUDGET_HEADER = 'X-Match-Budget-Ms'
+MATCH_PARTIAL_HEADER = 'X-Match-Partial'
+
+# Most pairs evaluated by one batch or scenario impact request
+MAX_IMPACT_PAIRS = 100
+
+# Background jobs of each type allowed to run at once (across all workers)
+JOB_CONCURRENCY = {
+    'analyze_matches': int(os.getenv('ANALYZE_JOB_CONCURRENCY', '4')),
+    'rebuild_vectors': 1,
+    'matching_stats': 1
+}
+
+# Identical concurrent requests share one in-flight computation (see singleflight.py)
+MATCH_FLIGHTS = singleflight.flight('matches')
+ANALYSIS_FLIGHTS = singleflight.flight('llm_analysis')
+GEOCODE_FLIGHTS = singleflight.flight('geocode')
+IMPACT_FLIGHTS = singleflight.flight('impact')
+
+# --- Lazily Initialized Services ---
+# openai, geopy and the numpy-based matching system are expensive to import and
+# most requests never touch them, so they are created on first use instead of
+# at import time. This keeps gunicorn worker boot (and autoscaling) fast.
+_services_lock = threading.RLock()
+_ai_client = None
+_ai_client_ready = False
+_geolocator = None
+_geocoder = None
+_vector_engine = None
+_matcher = None
+_job_runner = None
+_notification_feed = None
+
+def _create_ai_client():
+    if not (AZURE_OPENAI_ENDPOINT and AZURE_OPENAI_API_KEY):
+        print("⚠️ Azure OpenAI credentials not found in environment variables")
+        print("🔑 Set AZURE_OPENAI_ENDPOINT and AZURE_OPENAI_API_KEY environment variables")
+        print("🚀 App will continue without AI features")
+        return None
     try:
+        import openai
         client = openai.AzureOpenAI(
             azure_endpoint=AZURE_OPENAI_ENDPOINT,
             api_key=AZURE_OPENAI_API_KEY,
             api_version="2024-03-01-preview"
         )
         print("✅ Azure OpenAI client initialized successfully")
+        return client
     except Exception as e:
         print(f"⚠️  Azure OpenAI client failed to initialize: {e}")
         print("🚀 App will continue without AI features")
-        client = None
-else:
-    print("⚠️ Azure OpenAI credentials not found in environment variables")
-    print("🔑 Set AZURE_OPENAI_ENDPOINT and AZURE_OPENAI_API_KEY environment variables")
-    print("🚀 App will continue without AI features")
-    client = None
-
-# --- Flask App Initialization ---
-app = Flask(__name__)
-CORS(app)
-
-# Configuration
-JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY')
-if not JWT_SECRET_KEY:
-    print("⚠️ WARNING: JWT_SECRET_KEY environment variable not set!")
-    print("🔑 This is required for secure authentication")
-    print("🚨 Using a temporary key - NOT SECURE FOR PRODUCTION!")
-    JWT_SECRET_KEY = 'temp-key-not-secure'
-
-app.config['JWT_SECRET_KEY'] = JWT_SECRET_KEY
-
-# --- Initialize Vector Engine and Matching System ---
-print("🚀 Initializing vector-based matching system...")
-vector_engine = VectorEngine()
-matcher = AdvancedMatcher(vector_engine)
-
-# Initialize vectors on startup
-try:
-    vector_engine.rebuild_all_vectors()
-    print("✅ Vector matching system initialized successfully")
-except Exception as e:
-    print(f"⚠️  Vector system initialization failed: {e}")
-    print("🚀 App will continue with basic matching")
+        return None
+
+def get_ai_client():
+    """Return the Azure OpenAI client, creating it on first use (None if unavailable)"""
+    global _ai_client, _ai_client_ready
+    if not _ai_client_ready:
+        with _services_lock:
+            if not _ai_client_ready:
+                _ai_client = _create_ai_client()
+                _ai_client_ready = True
+    return _ai_client
+
+def get_geolocator():
+    """Return the shared Nominatim geocoder, creating it on first use"""
+    global _geolocator
+    if _geolocator is None:
+        with _services_lock:
+            if _geolocator is None:
+                from geopy.geocoders import Nominatim
+                import geocoding
+                _geolocator = Nominatim(
+                    user_agent=geocoding.NOMINATIM_USER_AGENT,
+                    domain=geocoding.NOMINATIM_DOMAIN,
+                    scheme=geocoding.NOMINATIM_SCHEME
+                )
+    return _geolocator
+
+def get_geocoder():
+    """Return the cached, rate-limited geocoder used by the geocoding endpoints"""
+    global _geocoder
+    if _geocoder is None:
+        with _services_lock:
+            if _geocoder is None:
+                import geocoding
+                _geocoder = geocoding.Geocoder(get_geolocator(), GEOCODE_FLIGHTS)
+    return _geocoder
+
+def get_matcher():
+    """Return the vector-based matcher, initializing the vector system on first use"""
+    global _vector_engine, _matcher
+    if _matcher is None:
+        with _services_lock:
+            if _matcher is None:
+                from vector_engine import VectorEngine
+                from matching_engine import AdvancedMatcher
+
+                print("🚀 Initializing vector-based matching system...")
+                # Changes logged before the rebuild below are already in the vectors
+                position = changelog.position()
+                vector_engine = VectorEngine()
+                try:
+                    vector_engine.rebuild_all_vectors()
+                    print("✅ Vector matching system initialized successfully")
+                except Exception as e:
+                    print(f"⚠️  Vector system initialization failed: {e}")
+                    print("🚀 App will continue with basic matching")
+                _vector_engine = vector_engine
+                matcher = AdvancedMatcher(vector_engine)
+                matcher.follow_changes_from(position)
+                _matcher = matcher
+    return _matcher
+
+def get_job_runner():
+    """Return the background job runner, registering the heavy operations on first use"""
+    global _job_runner
+    if _job_runner is None:
+        with _services_lock:
+            if _job_runner is None:
+                import jobs
+
+                runner = jobs.JobRunner()
+                runner.register('analyze_matches', run_match_analysis, limit=JOB_CONCURRENCY['analyze_matches'])
+                runner.register('rebuild_vectors', run_vector_rebuild, limit=JOB_CONCURRENCY['rebuild_vectors'])
+                runner.register('matching_stats', run_matching_stats, limit=JOB_CONCURRENCY['matching_stats'])
+                _job_runner = runner
+    return _job_runner
+
+def get_notification_feed():
+    """Return the shared notification feed"""
+    global _notification_feed
+    if _notification_feed is None:
+        with _services_lock:
+            if _notification_feed is None:
+                import notifications
+                _notification_feed = notifications.NotificationFeed()
+    return _notification_feed
+
+def get_vector_engine():
+    """Return the vector engine backing the matcher"""
+    get_matcher()
+    return _vector_engine
+
+api = Blueprint('api', __name__)
 
 # --- Helper Functions ---
 def load_db():
     db_file = os.getenv('DATABASE_FILE', 'database.json')
+    metrics.DB_LOADS.inc(source='app')
     try:
         with open(db_file, 'r') as f: 
             return json.load(f)
@@ -96,6 +211,25 @@ def save_db(db):
     except Exception as e:
         logging.error(f"Failed to save database: {e}")
         raise
+
+def run_profiled(label, func, *args, **kwargs):
+    """Run a matching call, sampling it when profiling is on for this request
+
+    Profiling is enabled for every request by MATCH_PROFILING=true, or for a
+    single request by an admin sending `X-Profile: 1`. The profile is stored
+    and its id is returned so it can be attached to the response.
+    """
+    requested = request.headers.get(profiling.PROFILE_HEADER) == '1' and is_admin_request()
+    if not (requested or profiling.PROFILE_ALL):
+        return func(*args, **kwargs), None
+    with profiling.profile(label) as record:
+        result = func(*args, **kwargs)
+    return result, record['id']
+
+def data_version():
+    """Latest change log version this worker has applied (part of coalescing keys)"""
+    return _matcher.data_version if _matcher is not None else 0
+
 def haversine(lat1, lon1, lat2, lon2):
     R = 6371
     lat1_rad, lon1_rad, lat2_rad, lon2_rad = map(radians, [lat1, lon1, lat2, lon2])
@@ -106,19 +240,30 @@ def haversine(lat1, lon1, lat2, lon2):
     distance = R * c
     return distance
 
+@api.before_request
+def sync_worker_state():
+    """Catch up with database changes made by other workers (a single stat when nothing changed)"""
+    if _matcher is not None:
+        try:
+            _matcher.sync_changes()
+        except Exception as e:
+            print(f"⚠️  Failed to apply database changes: {e}")
+
 # --- API Endpoints ---
 # --- Authentication Endpoints ---
-@app.route('/api/register', methods=['POST'])
+@api.route('/api/register', methods=['POST'])
 def register():
     try:
         data = request.get_json()
         email = data.get('email')
         password = data.get('password')
         name = data.get('name')
-        role = data.get('role', 'user')  # Default to 'user' if not provided
+        role = data.get('role') or 'user'  # Default to 'user' if not provided
         
         if not email or not password or not name:
             return jsonify({'message': 'Email, password, and name are required'}), 400
+        if role not in SELF_SERVICE_ROLES:
+            return jsonify({'message': f"Role must be one of: {', '.join(SELF_SERVICE_ROLES)}"}), 400
         
         # Check if user already exists
         if find_user_by_email(email):
@@ -141,7 +286,7 @@ def register():
     except Exception as e:
         return jsonify({'message': 'Registration failed', 'error': str(e)}), 500
 
-@app.route('/api/login', methods=['POST'])
+@api.route('/api/login', methods=['POST'])
 def login():
     try:
         data = request.get_json()
@@ -176,7 +321,7 @@ def login():
     except Exception as e:
         return jsonify({'message': 'Login failed', 'error': str(e)}), 500
 
-@app.route('/api/profile', methods=['GET'])
+@api.route('/api/profile', methods=['GET'])
 @token_required
 def get_profile():
     try:
@@ -193,7 +338,7 @@ def get_profile():
     except Exception as e:
         return jsonify({'message': 'Failed to get profile', 'error': str(e)}), 500
 
-@app.route('/api/profile', methods=['PUT'])
+@api.route('/api/profile', methods=['PUT'])
 @token_required
 def update_profile():
     try:
@@ -215,7 +360,7 @@ def update_profile():
     except Exception as e:
         return jsonify({'message': 'Failed to update profile', 'error': str(e)}), 500
 
-@app.route('/api/preferences', methods=['GET'])
+@api.route('/api/preferences', methods=['GET'])
 @token_required
 def get_preferences():
     try:
@@ -225,7 +370,7 @@ def get_preferences():
     except Exception as e:
         return jsonify({'message': 'Failed to get preferences', 'error': str(e)}), 500
 
-@app.route('/api/preferences', methods=['PUT'])
+@api.route('/api/preferences', methods=['PUT'])
 @token_required
 def update_preferences():
     try:
@@ -247,7 +392,7 @@ def update_preferences():
     except Exception as e:
         return jsonify({'message': 'Failed to update preferences', 'error': str(e)}), 500
 
-@app.route('/api/sustainability-goals', methods=['GET'])
+@api.route('/api/sustainability-goals', methods=['GET'])
 @token_required
 def get_sustainability_goals():
     try:
@@ -257,7 +402,7 @@ def get_sustainability_goals():
     except Exception as e:
         return jsonify({'message': 'Failed to get sustainability goals', 'error': str(e)}), 500
 
-@app.route('/api/sustainability-goals', methods=['PUT'])
+@api.route('/api/sustainability-goals', methods=['PUT'])
 @token_required
 def update_sustainability_goals():
     try:
@@ -279,69 +424,139 @@ def update_sustainability_goals():
     except Exception as e:
         return jsonify({'message': 'Failed to update sustainability goals', 'error': str(e)}), 500
 
-@app.route('/')
+@api.route('/')
 def index(): return "CarbonCapture API is running!"
 
-@app.route('/api/geocode', methods=['POST'])
+@api.route('/api/geocode', methods=['POST'])
 def geocode_address():
     data = request.get_json(); address = data.get('address')
     if not address: return jsonify({"error": "Address is required"}), 400
     try:
-        geolocator = Nominatim(user_agent="carbon_marketplace_hackathon"); location = geolocator.geocode(address)
-        if location: return jsonify({"lat": location.latitude, "lon": location.longitude})
+        # Cached per normalized address; concurrent lookups of one address share a Nominatim call
+        result = get_geocoder().resolve(address)
+        if result['lat'] is not None: return jsonify({"lat": result['lat'], "lon": result['lon']})
         else: return jsonify({"error": "Could not find coordinates for the address."}), 404
     except Exception as e: print(f"Geocoding error: {e}"); return jsonify({"error": "Geocoding service failed."}), 500
 
-@app.route('/api/producers', methods=['GET'])
+@api.route('/api/geocode/batch', methods=['POST'])
+def geocode_batch():
+    """Geocode many addresses, streaming one NDJSON line per address as it resolves"""
+    import geocoding
+    data = request.get_json(silent=True) or {}
+    addresses = data.get('addresses')
+    error = geocoding.batch_error(addresses)
+    if error:
+        return jsonify({"error": error}), 400
+    
+    geocoder = get_geocoder()
+    lines = (json.dumps(result) + '\n' for result in geocoder.resolve_batch(addresses))
+    return Response(stream_with_context(lines), mimetype='application/x-ndjson')
+
+@api.route('/api/producers', methods=['GET'])
 def get_all_producers():
     db = load_db(); return jsonify(db['producers'])
 
-@app.route('/api/producers', methods=['POST'])
+@api.route('/api/producers', methods=['POST'])
 def add_producer():
-    data = request.get_json(); db = load_db()
+    data = request.get_json()
     new_producer = {"id": f"prod_{uuid.uuid4()}", "name": data['name'], "location": data['location'], "co2_supply_tonnes_per_week": data['co2_supply_tonnes_per_week']}
-    db['producers'].append(new_producer); save_db(db)
+    set_owner(new_producer)
+    with changelog.recording('producer', 'add', [new_producer]):
+        db = load_db(); db['producers'].append(new_producer); save_db(db)
     
-    # Update vectors when new producer is added
+    # Update vectors when new producer is added (other workers pick it up from the change log)
     try:
-        vector_engine.update_producer_vectors(db['producers'])
+        get_matcher().sync_changes()
+        get_vector_engine().save_vectors()
         print(f"✅ Updated vectors after adding producer {new_producer['name']}")
     except Exception as e:
         print(f"⚠️  Failed to update vectors: {e}")
+    notify_match_changes('producer', new_producer['id'])
     
     return jsonify({"message": "Producer added successfully", "producer": new_producer}), 201
 
-@app.route('/api/consumers', methods=['POST'])
+@api.route('/api/consumers', methods=['POST'])
 def add_consumer():
-    data = request.get_json(); db = load_db()
+    data = request.get_json()
     new_consumer = {"id": f"cons_{uuid.uuid4()}", "name": data['name'], "industry": data['industry'], "location": data['location'], "co2_demand_tonnes_per_week": data['co2_demand_tonnes_per_week']}
-    db['consumers'].append(new_consumer); save_db(db)
+    set_owner(new_consumer)
+    with changelog.recording('consumer', 'add', [new_consumer]):
+        db = load_db(); db['consumers'].append(new_consumer); save_db(db)
     
-    # Update vectors when new consumer is added
+    # Update vectors when new consumer is added (other workers pick it up from the change log)
     try:
-        vector_engine.update_consumer_vectors(db['consumers'])
+        get_matcher().sync_changes()
+        get_vector_engine().save_vectors()
         print(f"✅ Updated vectors after adding consumer {new_consumer['name']}")
     except Exception as e:
         print(f"⚠️  Failed to update vectors: {e}")
+    notify_match_changes('consumer', new_consumer['id'])
     
     return jsonify({"message": "Consumer added successfully", "consumer": new_consumer}), 201
 
-@app.route('/api/matches', methods=['GET'])
+def set_owner(record):
+    """Record the signed-in user registering an entity, so its match changes can reach them"""
+    payload = optional_token_payload()
+    if payload and payload.get('user_id'):
+        record['owner_id'] = payload['user_id']
+
+def notify_match_changes(kind, entity_id):
+    """Publish a notification for every owned counterparty whose top matches the new entity entered"""
+    try:
+        changes = get_matcher().match_changes(kind, entity_id)
+        if changes:
+            import notifications
+            published = get_notification_feed().publish(changes, notifications.match_subscribers(load_users()))
+            print(f"🔔 {kind.capitalize()} {entity_id} entered {len(changes)} match lists ({published} notified)")
+    except Exception as e:
+        print(f"⚠️  Failed to publish match notifications: {e}")
+
+@api.route('/api/notifications', methods=['GET'])
+@token_required
+def get_notifications():
+    """The signed-in user's notifications; `after` is the last id already seen"""
+    after = request.args.get('after', type=int)
+    limit = request.args.get('limit', 50, type=int)
+    if limit is None or limit < 1 or limit > MAX_NOTIFICATIONS:
+        return jsonify({"error": f"limit must be between 1 and {MAX_NOTIFICATIONS}"}), 400
+    if 'after' in request.args and after is None:
+        return jsonify({"error": "after must be a notification id"}), 400
+    
+    items = get_notification_feed().for_user(request.current_user['user_id'], after, limit)
+    return jsonify({"notifications": items, "cursor": items[-1]['id'] if items else after})
+
+@api.route('/api/matches', methods=['GET'])
 def get_matches():
     """Get matches for a producer using vector-based ranking"""
     producer_id = request.args.get('producer_id')
     if not producer_id:
         return jsonify({"error": "producer_id parameter is required"}), 400
     
+    try:
+        weights = request_weights()
+        budget = request_budget()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
     try:
         # Use vector-based matching
-        matches = matcher.get_ranked_matches(producer_id, limit=20)
+        key = match_flight_key('producer', producer_id, 20, weights, budget)
+        (matches, partial), profile_id = run_profiled(
+            f"producer:{producer_id}", MATCH_FLIGHTS.do, key,
+            get_matcher().rank_matches, 'producer', producer_id, limit=20, weights=weights,
+            deadline=match_deadline(budget)
+        )
         
-        if not matches:
+        if not matches and not partial:
             return jsonify({"error": "No matches found for this producer"}), 404
         
-        print(f"🎯 Found {len(matches)} vector-based matches for producer {producer_id}")
-        return jsonify(matches)
+        print(f"🎯 Found {len(matches)} vector-based matches for producer {producer_id}" + (" (partial)" if partial else ""))
+        response = jsonify(matches)
+        if partial:
+            response.headers[MATCH_PARTIAL_HEADER] = 'true'
+        if profile_id:
+            response.headers[profiling.PROFILE_ID_HEADER] = profile_id
+        return response
     
     except Exception as e:
         print(f"❌ Error in vector matching: {e}")
@@ -375,37 +590,206 @@ def get_matches():
             print(f"❌ Fallback matching also failed: {fallback_error}")
             return jsonify({"error": "Matching service temporarily unavailable"}), 500
 
-@app.route('/api/consumers/<consumer_id>/matches', methods=['GET'])
+@api.route('/api/consumers/<consumer_id>/matches', methods=['GET'])
 def get_consumer_matches(consumer_id):
-    """Get matches for a consumer using vector-based ranking"""
+    """Get matches for a consumer using vector-based ranking
+    
+    With `?pools=N` the response is {"matches": [...], "pools": [...]}, adding up
+    to N groups of producers that can only cover the demand together.
+    """
     if not consumer_id:
         return jsonify({"error": "consumer_id parameter is required"}), 400
     
+    try:
+        weights = request_weights()
+        budget = request_budget()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    pool_limit = request.args.get('pools', 0, type=int)
+    if pool_limit is None or pool_limit < 0 or pool_limit > MAX_POOLS:
+        return jsonify({"error": f"pools must be between 0 and {MAX_POOLS}"}), 400
+    
     try:
         # Use vector-based matching
-        matches = matcher.get_ranked_matches_for_consumer(consumer_id, limit=20)
+        key = match_flight_key('consumer', consumer_id, 20, weights, budget)
+        (matches, partial), profile_id = run_profiled(
+            f"consumer:{consumer_id}", MATCH_FLIGHTS.do, key,
+            get_matcher().rank_matches, 'consumer', consumer_id, limit=20, weights=weights,
+            deadline=match_deadline(budget)
+        )
+        pools = []
+        if pool_limit:
+            key = match_flight_key('pool', consumer_id, pool_limit, weights)
+            pools = MATCH_FLIGHTS.do(key, get_matcher().get_pooled_matches, consumer_id, limit=pool_limit, weights=weights)
         
-        if not matches:
+        if not matches and not pools and not partial:
             return jsonify({"error": "No matches found for this consumer"}), 404
         
-        print(f"🎯 Found {len(matches)} vector-based matches for consumer {consumer_id}")
-        return jsonify(matches)
+        print(f"🎯 Found {len(matches)} vector-based matches and {len(pools)} pools for consumer {consumer_id}"
+              + (" (partial)" if partial else ""))
+        response = jsonify({"matches": matches, "pools": pools} if pool_limit else matches)
+        if partial:
+            response.headers[MATCH_PARTIAL_HEADER] = 'true'
+        if profile_id:
+            response.headers[profiling.PROFILE_ID_HEADER] = profile_id
+        return response
     
     except Exception as e:
         print(f"❌ Error in vector matching: {e}")
         return jsonify({"error": "Matching service temporarily unavailable"}), 500
 
+def match_flight_key(kind, entity_id, limit, weights, budget=None):
+    """Identity of a ranked-matches request; the data version keeps callers off pre-write flights"""
+    return (kind, entity_id, limit, tuple(sorted(weights.items())) if weights else None, budget, data_version())
+
+def request_budget():
+    """Matching time budget in milliseconds from the X-Match-Budget-Ms header (MATCH_BUDGET_MS without it)
+    
+    0 means no budget: the full candidate set is always scored.
+    """
+    value = request.headers.get(MATCH_BUDGET_HEADER)
+    if value is None:
+        return MATCH_BUDGET_MS
+    try:
+        budget = float(value)
+    except ValueError:
+        raise ValueError(f"{MATCH_BUDGET_HEADER} must be a number of milliseconds")
+    if not budget >= 0:
+        raise ValueError(f"{MATCH_BUDGET_HEADER} must not be negative")
+    return budget
+
+def match_deadline(budget):
+    """time.monotonic() deadline for a budget in milliseconds, None for no budget"""
+    return time.monotonic() + budget / 1000 if budget else None
+
+def request_weights():
+    """Per-request matching weights from `?weights=name:value,...`, or None for the defaults
+    
+    Unlisted weights keep their default value before the set is normalized.
+    """
+    spec = request.args.get('weights')
+    if not spec:
+        return None
+    overrides = {}
+    for item in spec.split(','):
+        name, separator, value = item.partition(':')
+        if not separator:
+            raise ValueError("weights must be a comma-separated list of name:value")
+        try:
+            overrides[name.strip()] = float(value)
+        except ValueError:
+            raise ValueError(f"Weight {name.strip()} must be a number")
+    return get_matcher().resolve_weights(overrides)
+
+@api.route('/api/producers/<producer_id>/similar', methods=['GET'])
+def get_similar_producers(producer_id):
+    """Producers whose vectors are closest to this producer (competitors, substitute suppliers)"""
+    return similar_entities('producer', producer_id)
+
+@api.route('/api/consumers/<consumer_id>/similar', methods=['GET'])
+def get_similar_consumers(consumer_id):
+    """Consumers whose vectors are closest to this consumer"""
+    return similar_entities('consumer', consumer_id)
+
+def similar_entities(kind, entity_id):
+    k = request.args.get('k', 10, type=int)
+    if k is None or k < 1 or k > MAX_SIMILAR_RESULTS:
+        return jsonify({"error": f"k must be between 1 and {MAX_SIMILAR_RESULTS}"}), 400
+    
+    try:
+        similar = get_matcher().find_similar(kind, entity_id, k)
+    except Exception as e:
+        print(f"❌ Error in similarity search: {e}")
+        return jsonify({"error": "Similarity service temporarily unavailable"}), 500
+    
+    if similar is None:
+        return jsonify({"error": f"{kind.capitalize()} not found"}), 404
+    return jsonify(similar)
+
+@api.route('/api/search', methods=['GET'])
+def search_entities():
+    """Search producers and consumers by name, industry and description (the last word autocompletes)"""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({"error": "q parameter is required"}), 400
+    role = request.args.get('role')
+    if role not in (None, 'producer', 'consumer'):
+        return jsonify({"error": "role must be producer or consumer"}), 400
+    limit = request.args.get('limit', 10, type=int)
+    if limit is None or limit < 1 or limit > MAX_SEARCH_RESULTS:
+        return jsonify({"error": f"limit must be between 1 and {MAX_SEARCH_RESULTS}"}), 400
+    
+    try:
+        results = get_matcher().search(query, role, request.args.get('industry'), limit)
+    except Exception as e:
+        print(f"❌ Error in search: {e}")
+        return jsonify({"error": "Search service temporarily unavailable"}), 500
+    return jsonify({"query": query, "results": results})
+
+@api.route('/api/map/clusters', methods=['GET'])
+def map_clusters():
+    """Clustered producers and consumers for a map viewport: ?bbox=west,south,east,north&zoom=z"""
+    try:
+        west, south, east, north = (float(v) for v in request.args.get('bbox', '').split(','))
+    except ValueError:
+        return jsonify({"error": "bbox must be west,south,east,north in degrees"}), 400
+    zoom = request.args.get('zoom', type=int)
+    if not all(isfinite(v) for v in (west, south, east, north)) or not south <= north:
+        return jsonify({"error": "bbox must be finite with south <= north"}), 400
+    if zoom is None or zoom < 0:
+        return jsonify({"error": "zoom must be a non-negative integer"}), 400
+    
+    try:
+        clusters = get_matcher().map_clusters(west, south, east, north, zoom)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"❌ Error building map clusters: {e}")
+        return jsonify({"error": "Map service temporarily unavailable"}), 500
+    return jsonify({"zoom": zoom, "clusters": clusters})
+
+# --- Profiling Endpoints (admin only) ---
+@api.route('/api/admin/profiles', methods=['GET'])
+@admin_required
+def list_match_profiles():
+    """List stored matching profiles, newest first"""
+    return jsonify({"profiles": profiling.list_profiles()})
+
+@api.route('/api/admin/profiles/<profile_id>', methods=['GET'])
+@admin_required
+def get_match_profile(profile_id):
+    """Return one stored profile with its hottest functions and sampled stacks"""
+    record = profiling.get_profile(profile_id)
+    if not record:
+        return jsonify({"error": "Profile not found"}), 404
+    return jsonify(record)
+
+@api.route('/api/admin/profiles/flamegraph', methods=['GET'])
+@admin_required
+def get_match_flamegraph():
+    """Aggregate the last N profiles as collapsed stacks for flame graph tools"""
+    last_n = request.args.get('last', type=int)
+    return profiling.collapsed_stacks(last_n), 200, {'Content-Type': 'text/plain; charset=utf-8'}
+
 # --- AI Analysis Endpoint (New, More Reliable Strategy) ---
-@app.route('/api/analyze-matches', methods=['POST'])
+@api.route('/api/analyze-matches', methods=['POST'])
 def analyze_matches():
-    """Enhanced AI analysis using vector-based matching scores"""
+    """Queue AI analysis of a producer's matches; poll /api/jobs/<id> for the report"""
     data = request.get_json()
     producer = data.get('producer')
     matches = data.get('matches')
     if not producer or not matches:
         return jsonify({"error": "Producer and matches data are required"}), 400
+    return submit_job('analyze_matches', {'producer': producer, 'matches': matches})
 
+@metrics.timed('analyze_matches')
+def run_match_analysis(params, progress):
+    """Enhanced AI analysis using vector-based matching scores (runs as a background job)"""
+    producer = params['producer']
+    matches = params['matches']
     analyzed_matches = []
+    client = get_ai_client()
     
     # Check if OpenAI client is available
     if client is None:
@@ -417,7 +801,7 @@ def analyze_matches():
             
             # Generate match explanation using our matching engine
             try:
-                explanation = matcher.get_match_explanation(producer, match)
+                explanation = get_matcher().get_match_explanation(producer, match)
             except:
                 explanation = "Partnership analysis based on distance and capacity compatibility"
             
@@ -431,12 +815,13 @@ def analyze_matches():
                 ]
             }
             analyzed_matches.append(match)
+            progress(len(analyzed_matches), len(matches), 'Analyzing matches')
         
         final_report = {
             "overall_summary": f"Found {len(analyzed_matches)} potential partners for {producer['name']}, ranked by AI-powered vector similarity. Enhanced matching algorithm considers industry compatibility, capacity fit, and logistics optimization.",
             "ranked_matches": analyzed_matches
         }
-        return jsonify(final_report)
+        return final_report
 
     # Enhanced AI analysis loop using vector-based matching scores
     for i, match in enumerate(matches):
@@ -474,19 +859,10 @@ def analyze_matches():
             - "justification": A concise paragraph explaining the partnership potential, referencing the AI scores.
             - "strategic_considerations": An array of 2-3 short bullet-point style strings highlighting key decision factors based on the scoring.
             """
-            response = client.chat.completions.create(
-                model=AZURE_OPENAI_DEPLOYMENT_NAME,
-                messages=[
-                    {"role": "system", "content": "You are an expert analyst providing data in a strict JSON format."},
-                    {"role": "user", "content": prompt_content}
-                ],
-                temperature=0.5,
-                max_tokens=500
+            # Jobs analyzing the same pair at the same time share one completion
+            analysis_json = ANALYSIS_FLIGHTS.do(
+                singleflight.request_key(prompt_content), request_llm_analysis, client, prompt_content
             )
-            analysis_text = response.choices[0].message.content
-            if not analysis_text: raise Exception("AI returned empty content")
-            
-            analysis_json = json.loads(analysis_text)
             
             # Add the analysis and rank to the match object
             match['analysis'] = {
@@ -507,63 +883,205 @@ def analyze_matches():
             }
         
         analyzed_matches.append(match)
+        progress(len(analyzed_matches), len(matches), 'Analyzing matches')
 
     final_report = {
         "overall_summary": f"Found {len(analyzed_matches)} potential partners for {producer['name']}, sorted by distance. Each has been analyzed for strategic fit.",
         "ranked_matches": analyzed_matches
     }
 
-    return jsonify(final_report)
+    return final_report
 
-@app.route('/api/rebuild-vectors', methods=['POST'])
-def rebuild_vectors():
-    """Rebuild all vectors from current database data"""
+def request_llm_analysis(client, prompt_content):
+    """One chat completion for a match analysis prompt, parsed from JSON"""
     try:
-        vector_engine.rebuild_all_vectors()
-        stats = vector_engine.get_vector_stats()
-        return jsonify({
-            "message": "Vectors rebuilt successfully",
-            "stats": stats
-        }), 200
-    except Exception as e:
-        return jsonify({"error": f"Failed to rebuild vectors: {str(e)}"}), 500
+        with metrics.span('llm_completion'):
+            response = client.chat.completions.create(
+                model=AZURE_OPENAI_DEPLOYMENT_NAME,
+                messages=[
+                    {"role": "system", "content": "You are an expert analyst providing data in a strict JSON format."},
+                    {"role": "user", "content": prompt_content}
+                ],
+                temperature=0.5,
+                max_tokens=500
+            )
+        metrics.LLM_CALLS.inc(outcome='success')
+    except Exception:
+        metrics.LLM_CALLS.inc(outcome='error')
+        raise
+    analysis_text = response.choices[0].message.content
+    if not analysis_text: raise Exception("AI returned empty content")
+    
+    return json.loads(analysis_text)
+
+@api.route('/api/rebuild-vectors', methods=['POST'])
+def rebuild_vectors():
+    """Queue a rebuild of all vectors from current database data"""
+    return submit_job('rebuild_vectors', {})
+
+def run_vector_rebuild(params, progress):
+    progress(0, 1, 'Rebuilding vectors')
+    vector_engine = get_vector_engine()
+    vector_engine.rebuild_all_vectors()
+    progress(1, 1, 'Rebuilding vectors')
+    return {
+        "message": "Vectors rebuilt successfully",
+        "stats": vector_engine.get_vector_stats()
+    }
 
-@app.route('/api/matching-stats', methods=['GET'])
+@api.route('/api/matching-stats', methods=['GET'])
 def get_matching_stats():
-    """Get statistics about the matching system"""
+    """Queue computation of statistics about the matching system"""
+    return submit_job('matching_stats', {})
+
+def run_matching_stats(params, progress):
+    stats = get_matcher().get_matching_stats(progress=progress)
+    # Work saved by request coalescing in the worker that ran this job
+    stats['coalescing'] = singleflight.stats()
+    return stats
+
+# --- Background Job Endpoints ---
+def submit_job(job_type, params):
+    """Queue a background job and answer 202 with where to poll for it"""
     try:
-        stats = matcher.get_matching_stats()
-        return jsonify(stats), 200
+        job, created = get_job_runner().submit(job_type, params)
     except Exception as e:
-        return jsonify({"error": f"Failed to get matching stats: {str(e)}"}), 500
+        print(f"❌ Failed to queue {job_type} job: {e}")
+        return jsonify({"error": "Job queue temporarily unavailable"}), 503
+    
+    status_url = f"/api/jobs/{job['id']}"
+    response = jsonify({
+        "job_id": job['id'],
+        "status": job['status'],
+        "deduplicated": not created,
+        "status_url": status_url
+    })
+    response.status_code = 202
+    response.headers['Location'] = status_url
+    return response
 
-@app.route('/api/impact-model', methods=['POST'])
+@api.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Status, progress and (once finished) result of a background job"""
+    import jobs
+    job = get_job_runner().get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(jobs.public_view(job))
+
+@api.route('/api/impact-model', methods=['POST'])
 def impact_model():
+    import impact_engine
     data = request.get_json(); producer = data.get('producer'); consumer = data.get('consumer')
     if not producer or not consumer: return jsonify({"error": "Producer and consumer data are required"}), 400
     try:
-        carbon_credit_price_per_tonne = 25.00; industrial_co2_price_per_tonne = 75.00; weeks_per_year = 52
-        estimated_delivery_emissions_per_100km = 0.05
-        tonnes_per_week = min(producer['co2_supply_tonnes_per_week'], consumer['co2_demand_tonnes_per_week'])
-        tonnes_per_year = tonnes_per_week * weeks_per_year
-        annual_revenue_for_producer = tonnes_per_year * carbon_credit_price_per_tonne
-        annual_savings_for_consumer = tonnes_per_year * industrial_co2_price_per_tonne
-        estimated_delivery_emissions = (consumer['distance_km'] / 100) * estimated_delivery_emissions_per_100km * weeks_per_year
-        net_co2_sequestered = tonnes_per_year - estimated_delivery_emissions
-        return jsonify({
-            "producer_name": producer['name'], "consumer_name": consumer['name'], "annual_tonnage": round(tonnes_per_year, 2),
-            "financials": {"producer_annual_revenue": round(annual_revenue_for_producer, 2), "consumer_annual_savings": round(annual_savings_for_consumer, 2), "carbon_credit_value": round(annual_revenue_for_producer, 2)},
-            "environmental": {"co2_diverted": round(tonnes_per_year, 2), "estimated_logistics_emissions": round(estimated_delivery_emissions, 2), "net_co2_impact": round(net_co2_sequestered, 2)}
-        })
+        assumptions = impact_engine.resolve_assumptions(data.get('assumptions'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        return jsonify(impact_engine.pair_report(producer, consumer, assumptions))
     except Exception as e:
         print(f"An error occurred in impact-model: {e}")
         return jsonify({"error": "Failed to calculate impact model."}), 500
 
+def impact_pairs(data):
+    """Aligned producer/consumer lists for a batch or scenario request
+    
+    Accepts `producer_id` or `consumer_id` (that entity's top `limit` matches)
+    or explicit `pairs` of {"producer", "consumer"} objects.
+    """
+    limit = data.get('limit', 20)
+    if isinstance(limit, bool) or not isinstance(limit, int) or not 1 <= limit <= MAX_IMPACT_PAIRS:
+        raise ValueError(f"limit must be an integer between 1 and {MAX_IMPACT_PAIRS}")
+    
+    if data.get('producer_id'):
+        producer = get_matcher().get_entity('producer', data['producer_id'])
+        if producer is None:
+            raise LookupError("Producer not found")
+        matches = get_matcher().get_ranked_matches(producer['id'], limit=limit)
+        return [producer] * len(matches), matches
+    if data.get('consumer_id'):
+        consumer = get_matcher().get_entity('consumer', data['consumer_id'])
+        if consumer is None:
+            raise LookupError("Consumer not found")
+        matches = get_matcher().get_ranked_matches_for_consumer(consumer['id'], limit=limit)
+        return matches, [consumer] * len(matches)
+    
+    pairs = data.get('pairs')
+    if not isinstance(pairs, list) or not pairs or len(pairs) > MAX_IMPACT_PAIRS:
+        raise ValueError(f"Provide producer_id, consumer_id or 1-{MAX_IMPACT_PAIRS} pairs")
+    if not all(isinstance(pair, dict) and pair.get('producer') and pair.get('consumer') for pair in pairs):
+        raise ValueError("Each pair needs producer and consumer objects")
+    return [pair['producer'] for pair in pairs], [pair['consumer'] for pair in pairs]
+
+@api.route('/api/impact-model/batch', methods=['POST'])
+def impact_model_batch():
+    """Impact of all of an entity's matches (or a list of pairs) in one vectorized pass"""
+    import impact_engine
+    data = request.get_json() or {}
+    
+    def compute():
+        producers, consumers = impact_pairs(data)
+        assumptions = impact_engine.resolve_assumptions(data.get('assumptions'))
+        return impact_engine.batch_report(producers, consumers, assumptions)
+    
+    try:
+        key = singleflight.request_key('batch', data, data_version())
+        return jsonify(IMPACT_FLIGHTS.do(key, compute))
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+    except (ValueError, KeyError, TypeError) as e:
+        return jsonify({"error": f"Invalid impact request: {e}"}), 400
+
+@api.route('/api/impact-model/scenarios', methods=['POST'])
+def impact_model_scenarios():
+    """Sweep a grid of assumptions (prices, emissions per km, horizon...) over all pairs at once"""
+    import impact_engine
+    data = request.get_json() or {}
+    grid = data.get('grid')
+    if not isinstance(grid, dict) or not grid:
+        return jsonify({"error": "grid must map assumption names to lists of values"}), 400
+    
+    def compute():
+        producers, consumers = impact_pairs(data)
+        assumptions = impact_engine.resolve_assumptions(data.get('assumptions'))
+        return impact_engine.scenario_sweep(producers, consumers, grid, assumptions)
+    
+    try:
+        key = singleflight.request_key('scenarios', data, data_version())
+        return jsonify(IMPACT_FLIGHTS.do(key, compute))
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+    except (ValueError, KeyError, TypeError) as e:
+        return jsonify({"error": f"Invalid scenario request: {e}"}), 400
+
+# --- App Factory ---
+def create_app():
+    """Create and configure the Flask application"""
+    app = Flask(__name__)
+    # Let browser clients read the partial-result and profile headers
+    CORS(app, expose_headers=[MATCH_PARTIAL_HEADER, profiling.PROFILE_ID_HEADER])
+
+    # Configuration
+    jwt_secret_key = os.getenv('JWT_SECRET_KEY')
+    if not jwt_secret_key:
+        print("⚠️ WARNING: JWT_SECRET_KEY environment variable not set!")
+        print("🔑 This is required for secure authentication")
+        print("🚨 Using a temporary key - NOT SECURE FOR PRODUCTION!")
+        jwt_secret_key = 'temp-key-not-secure'
+
+    app.config['JWT_SECRET_KEY'] = jwt_secret_key
+    app.register_blueprint(api)
+    metrics.init_app(app)
+    return app
+
 # --- Run the App ---
 if __name__ == '__main__':
+    app = create_app()
+
     # Get port from environment variable (for Railway deployment)
     port = int(os.getenv('PORT', 5001))
     debug = os.getenv('FLASK_DEBUG', 'True').lower() == 'true'
     
     print(f"🚀 Starting Flask app on port {port} with debug={debug}")
-    app.run(debug=debug, host='0.0.0.0', port=port)
\ No newline at end of file
+    app.run(debug=debug, host='0.0.0.0', port=port)
@@ -0,0 +1,252 @@
+"""ASGI entry point: the Flask app plus async geocoding, for uvicorn workers
+
+    gunicorn "asgi:app" -k uvicorn.workers.UvicornWorker --workers 2
+
+Under sync workers every request holds a worker process for as long as it
+runs. A few requests waiting on Nominatim's one-per-second budget can
+therefore block everything else. Here each worker runs an event loop:
+
+- `POST /api/geocode` and `POST /api/geocode/batch` are served natively
+  (`geocoding.AsyncGeocoder`). A request waiting on the rate budget or
+  on Nominatim is a suspended coroutine, and all of a worker's lookups share
+  one pooled `httpx.AsyncClient`.
+- Every other route is the unchanged Flask app, bridged by a small WSGI
+  runner (`WsgiBridge`). Its views, including CPU-bound matching, run on a
+  pool of `ASGI_THREADS` threads per worker, so they never block the event
+  loop. Geocoding cache and rate-limit file IO runs on the loop's default
+  executor.
+
+AI analysis is already a background job (`jobs.py`), so its Azure OpenAI
+calls never hold a request.
+"""
+
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import Dict
+
+import httpx
+
+import geocoding
+import metrics
+from app import create_app
+
+# Threads per worker running Flask views
+ASGI_THREADS = int(os.getenv('ASGI_THREADS', '16'))
+# Connections per worker kept open to upstream services
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv('UPSTREAM_MAX_CONNECTIONS', '100'))
+
+_wsgi_executor = ThreadPoolExecutor(max_workers=ASGI_THREADS, thread_name_prefix='wsgi')
+
+def wsgi_environ(scope: Dict, body: BytesIO) -> Dict:
+    """WSGI environ for an ASGI HTTP scope and its buffered request body"""
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf8').decode('latin1'),
+        'PATH_INFO': scope['path'].encode('utf8').decode('latin1'),
+        'QUERY_STRING': scope['query_string'].decode('ascii'),
+        'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+        'SERVER_NAME': scope['server'][0] if scope.get('server') else 'localhost',
+        'SERVER_PORT': str(scope['server'][1]) if scope.get('server') else '80',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': BytesIO(),
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin1')
+        if name in ('content-length', 'content-type'):
+            key = name.upper().replace('-', '_')
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+        value = value.decode('latin1')
+        environ[key] = environ[key] + ',' + value if key in environ else value
+    return environ
+
+class WsgiBridge:
+    """ASGI app serving a WSGI app, each request on the WSGI thread pool
+
+    The request body is buffered before the app runs. The response is sent
+    chunk by chunk as the app yields it, so streamed responses stay streamed.
+    """
+
+    def __init__(self, wsgi_application, executor: ThreadPoolExecutor):
+        self.wsgi_application = wsgi_application
+        self.executor = executor
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            raise ValueError(f"WSGI apps only serve HTTP, not {scope['type']!r}")
+        body = BytesIO()
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body.write(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+        body.seek(0)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self._run, wsgi_environ(scope, body), send, loop)
+
+    def _run(self, environ: Dict, send, loop):
+        """Run the WSGI app on this pool thread, handing each message to the event loop"""
+        response = {}
+
+        def emit(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and response.get('started'):
+                raise exc_info[1].with_traceback(exc_info[2])
+            response['start'] = {
+                'type': 'http.response.start',
+                'status': int(status.split(' ', 1)[0]),
+                'headers': [(name.lower().encode('latin1'), value.encode('latin1')) for name, value in headers]
+            }
+
+        def start():
+            if not response.get('started'):
+                response['started'] = True
+                emit(response['start'])
+
+        result = self.wsgi_application(environ, start_response)
+        try:
+            for chunk in result:
+                if chunk:
+                    start()
+                    emit({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            start()
+            emit({'type': 'http.response.body', 'body': b''})
+        finally:
+            close = getattr(result, 'close', None)
+            if close is not None:
+                close()
+
+flask_app = create_app()
+_bridge = WsgiBridge(flask_app, _wsgi_executor)
+_client = None
+_geocoder = None
+
+def get_async_geocoder() -> geocoding.AsyncGeocoder:
+    """This worker's async geocoder, created on first use inside its event loop"""
+    global _client, _geocoder
+    if _geocoder is None:
+        limits = httpx.Limits(max_connections=UPSTREAM_MAX_CONNECTIONS,
+                              max_keepalive_connections=UPSTREAM_MAX_CONNECTIONS)
+        _client = httpx.AsyncClient(limits=limits)
+        _geocoder = geocoding.AsyncGeocoder(_client)
+    return _geocoder
+
+async def _read_json(receive):
+    """Request body parsed as JSON, or {} if it is not a JSON object"""
+    body = b''
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return {}
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            break
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+def _headers(content_type):
+    # Same CORS answer as flask-cors gives the Flask routes
+    return [(b'content-type', content_type.encode()), (b'access-control-allow-origin', b'*')]
+
+async def _send_json(send, status, payload):
+    await send({'type': 'http.response.start', 'status': status, 'headers': _headers('application/json')})
+    await send({'type': 'http.response.body', 'body': json.dumps(payload).encode('utf-8')})
+    return status
+
+async def _wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+async def _stream_ndjson(receive, send, results):
+    """Stream an async iterator as NDJSON, closing it as soon as the client goes away"""
+    await send({'type': 'http.response.start', 'status': 200, 'headers': _headers('application/x-ndjson')})
+
+    async def pump():
+        try:
+            async for result in results:
+                await send({'type': 'http.response.body', 'body': json.dumps(result).encode('utf-8') + b'\n',
+                            'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            await results.aclose()
+
+    streaming = asyncio.ensure_future(pump())
+    watcher = asyncio.ensure_future(_wait_for_disconnect(receive))
+    await asyncio.wait({streaming, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    watcher.cancel()
+    if not streaming.done():
+        streaming.cancel()
+        print("🔌 Client disconnected mid-batch; cancelled its pending geocoding lookups")
+    else:
+        streaming.result()
+    return 200
+
+async def geocode(scope, receive, send):
+    data = await _read_json(receive)
+    address = data.get('address')
+    if not address or not isinstance(address, str):
+        return await _send_json(send, 400, {"error": "Address is required"})
+    try:
+        result = await get_async_geocoder().resolve(address)
+    except Exception as e:
+        print(f"Geocoding error: {e}")
+        return await _send_json(send, 500, {"error": "Geocoding service failed."})
+    if result['lat'] is None:
+        return await _send_json(send, 404, {"error": geocoding.NOT_FOUND_ERROR})
+    return await _send_json(send, 200, {"lat": result['lat'], "lon": result['lon']})
+
+async def geocode_batch(scope, receive, send):
+    addresses = (await _read_json(receive)).get('addresses')
+    error = geocoding.batch_error(addresses)
+    if error:
+        return await _send_json(send, 400, {"error": error})
+    return await _stream_ndjson(receive, send, get_async_geocoder().resolve_batch(addresses))
+
+# (method, path) -> handler returning the response status
+ASYNC_ROUTES = {
+    ('POST', '/api/geocode'): geocode,
+    ('POST', '/api/geocode/batch'): geocode_batch
+}
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if _client is not None:
+                await _client.aclose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await _lifespan(receive, send)
+    route = (scope.get('method'), scope.get('path')) if scope['type'] == 'http' else None
+    handler = ASYNC_ROUTES.get(route)
+    if handler is None:
+        return await _bridge(scope, receive, send)
+
+    start = time.perf_counter()
+    status = await handler(scope, receive, send)
+    if metrics.METRICS_ENABLED:
+        metrics.HTTP_REQUEST_DURATION.observe(time.perf_counter() - start,
+                                              method=route[0], route=route[1], status=status)
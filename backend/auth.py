@@ -1,12 +1,28 @@
 import bcrypt
 import jwt
 import json
+import os
 from datetime import datetime, timedelta
 from functools import wraps
 from flask import request, jsonify, current_app
 
+import changelog
+import metrics
+
+# Roles a user may pick when registering; admin rights come only from ADMIN_EMAILS
+SELF_SERVICE_ROLES = ('user', 'producer', 'consumer')
+
+def admin_emails():
+    """Lower-cased emails of admins, from the comma-separated ADMIN_EMAILS"""
+    return {email.strip().lower() for email in os.getenv('ADMIN_EMAILS', '').split(',') if email.strip()}
+
+def is_admin(user):
+    """Whether a user is an admin (whatever role their record claims)"""
+    return bool(user and str(user.get('email', '')).lower() in admin_emails())
+
 def load_users():
     """Load users from database.json"""
+    metrics.DB_LOADS.inc(source='auth')
     try:
         with open('database.json', 'r') as f:
             data = json.load(f)
@@ -16,15 +32,17 @@ def load_users():
 
 def save_users(users):
     """Save users to database.json"""
-    try:
-        with open('database.json', 'r') as f:
-            data = json.load(f)
-    except FileNotFoundError:
-        data = {"producers": [], "consumers": []}
-    
-    data['users'] = users
-    with open('database.json', 'w') as f:
-        json.dump(data, f, indent=2)
+    # Logged (and serialized with other writers) so workers' matchers know only users changed
+    with changelog.recording('users', 'update', [], db_file='database.json'):
+        try:
+            with open('database.json', 'r') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            data = {"producers": [], "consumers": []}
+        
+        data['users'] = users
+        with open('database.json', 'w') as f:
+            json.dump(data, f, indent=2)
 
 def hash_password(password):
     """Hash a password using bcrypt"""
@@ -77,6 +95,34 @@ def token_required(f):
         return f(*args, **kwargs)
     return decorated
 
+def admin_required(f):
+    """Decorator to require a valid JWT token belonging to an admin user"""
+    @wraps(f)
+    @token_required
+    def decorated(*args, **kwargs):
+        user = find_user_by_email(request.current_user['email'])
+        if not is_admin(user):
+            return jsonify({'message': 'Admin access required'}), 403
+        return f(*args, **kwargs)
+    return decorated
+
+def optional_token_payload():
+    """Payload of the request's token if it carries a valid one (for endpoints open to everyone)"""
+    token = request.headers.get('Authorization', '')
+    if token.startswith('Bearer '):
+        token = token[7:]
+    if not token:
+        return None
+    return verify_token(token)
+
+def is_admin_request():
+    """Check whether the current request carries a valid admin token"""
+    payload = optional_token_payload()
+    if not payload:
+        return False
+    user = find_user_by_email(payload.get('email'))
+    return is_admin(user)
+
 def find_user_by_email(email):
     """Find user by email"""
     users = load_users()
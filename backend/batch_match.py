@@ -0,0 +1,350 @@
+"""Offline batch matching: every entity of one side ranked against the other, file to file
+
+Usage (from the backend directory):
+
+    python batch_match.py --producers producers.ndjson --consumers consumers.csv \\
+        --output matches.csv --workers 8
+
+The counterpart side (consumers, or producers with `--rank consumers`) is
+loaded once, vectorized, and sent to every worker process, which indexes it
+for the viability and distance filters. The ranked side is streamed from
+its file in chunks of `--chunk-size` entities. Each chunk's vectors are
+generated in the parent, and a worker scores every entity against its viable
+counterparts with the columnar scorer (`score_columns`). At most two chunks
+per worker are in flight, and results are written in input order as they
+arrive. Memory therefore grows with the counterpart side only, however many
+entities are ranked.
+
+Every viable match is written unless `--limit` caps each entity's list.
+Output rows are (producer_id, consumer_id, rank, match_score, the five
+components, distance_km), as CSV or NDJSON by the output file's extension.
+A JSON summary with runtime and throughput goes to stdout.
+
+Inputs are NDJSON (one database.json record per line) or CSV with the
+record's flat fields, `lat`/`lon` columns for the location and
+`;`-separated transportation_methods. Either may be gzipped (`.gz`).
+Before any scoring, one streaming pass over both inputs counts the text
+document frequencies, as the server does when it rebuilds its vectors.
+Every chunk is then weighted with the same frequencies, so the output does
+not depend on `--chunk-size`.
+"""
+
+import argparse
+import csv
+import gzip
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+from entity_store import EntityColumns, ViabilityIndex
+from matching_engine import COMPONENTS, MAX_MATCH_DISTANCE_KM, AdvancedMatcher, rank_positions, score_columns
+from spatial_index import SpatialIndex
+from vector_engine import VectorEngine
+
+DEFAULT_CHUNK_SIZE = 512
+# Seconds between progress lines on stderr
+PROGRESS_INTERVAL = 10.0
+
+# CSV columns parsed as numbers
+NUMERIC_FIELDS = ('co2_supply_tonnes_per_week', 'co2_output_tonnes_per_year', 'co2_demand_tonnes_per_week',
+                  'co2_purity', 'lat', 'lon')
+OUTPUT_FIELDS = ('producer_id', 'consumer_id', 'rank', 'match_score') + COMPONENTS + ('distance_km',)
+
+KINDS = ('producer', 'consumer')
+
+def _open(path: str, mode: str = 'rt'):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode, encoding='utf-8', newline='')
+    return open(path, mode, encoding='utf-8', newline='')
+
+def _format(path: str) -> str:
+    name = path[:-3] if path.endswith('.gz') else path
+    return 'csv' if name.endswith('.csv') else 'ndjson'
+
+def csv_record(row: Dict[str, str]) -> Dict:
+    """A database.json record from one flat CSV row"""
+    record = {}
+    for field, value in row.items():
+        if field is None or value is None or value.strip() == '':
+            continue
+        value = value.strip()
+        if field in NUMERIC_FIELDS:
+            try:
+                value = float(value)
+            except ValueError:
+                continue
+        elif field == 'transportation_methods':
+            value = [method.strip() for method in value.split(';') if method.strip()]
+        record[field] = value
+    if 'lat' in record and 'lon' in record:
+        record['location'] = {'lat': record.pop('lat'), 'lon': record.pop('lon')}
+    record.pop('lat', None)
+    record.pop('lon', None)
+    return record
+
+def read_records(path: str) -> Iterator[Dict]:
+    """Stream records from an NDJSON or CSV file"""
+    with _open(path) as f:
+        if _format(path) == 'csv':
+            for row in csv.DictReader(f):
+                yield csv_record(row)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+def _chunks(records: Iterator[Dict], size: int) -> Iterator[List[Dict]]:
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def count_text(engine: VectorEngine, kind: str, records: Iterator[Dict], chunk_size: int = DEFAULT_CHUNK_SIZE):
+    """Count the records' additional_info into the engine's document frequencies"""
+    for chunk in _chunks(records, chunk_size):
+        engine.text_features.count(kind, [record.get('additional_info') for record in chunk])
+
+def vectorized_columns(engine: VectorEngine, kind: str, records: List[Dict]) -> EntityColumns:
+    """Columns of these records with their vectors and text rows; the engine keeps none of them
+
+    Text is weighted by the engine's current document frequencies (see count_text).
+    """
+    if kind == 'producer':
+        engine.add_producer_vectors(records, count_text=False)
+        vectors, text = engine.producer_vectors, engine.producer_text
+    else:
+        engine.add_consumer_vectors(records, count_text=False)
+        vectors, text = engine.consumer_vectors, engine.consumer_text
+    columns = EntityColumns(kind, records, engine)
+    # The server gathers both sides at the producer vector size (see EntityStore.sync_vectors)
+    columns.attach_vectors(vectors, engine.PRODUCER_VECTOR_SIZE, engine.version)
+    columns.attach_text(text)
+    vectors.clear()
+    text.clear()
+    return columns
+
+def _field(value: str, fmt: str) -> str:
+    """An id as written in the output format"""
+    if fmt == 'ndjson':
+        return json.dumps(value)
+    if any(c in value for c in ',"\r\n'):
+        return '"' + value.replace('"', '""') + '"'
+    return value
+
+def _row_template(fmt: str) -> str:
+    """%-format of one output line, filled with (producer, consumer, rank, score, components..., distance)"""
+    specs = ['%s', '%s', '%d'] + ['%.3f'] * (1 + len(COMPONENTS)) + ['%.2f']
+    if fmt == 'csv':
+        return ','.join(specs) + '\n'
+    return '{' + ','.join(f'"{name}":{spec}' for name, spec in zip(OUTPUT_FIELDS, specs)) + '}\n'
+
+# --- Worker side ---
+
+_worker = {}
+
+def _init_worker(kind: str, arrays: Dict[str, np.ndarray], ids: List[str], empty: Dict[str, np.ndarray],
+                 params: tuple, fmt: str):
+    """Index the counterpart side (`kind`); the ranked side's columns start empty"""
+    other = KINDS[1 - KINDS.index(kind)]
+    columns = {kind: EntityColumns.from_arrays(kind, arrays), other: EntityColumns.from_arrays(other, empty)}
+    _worker.update(
+        kind=kind,
+        columns=columns[kind],
+        fields=[_field(entity_id, fmt) for entity_id in ids],
+        params=params,
+        format=fmt,
+        template=_row_template(fmt),
+        viability=ViabilityIndex(columns['producer'], columns['consumer']),
+        spatial=SpatialIndex(columns['producer'], columns['consumer']),
+        near=np.zeros(len(ids), dtype=bool)
+    )
+
+def _match_chunk(kind: str, arrays: Dict[str, np.ndarray], ids: List[str], limit: int):
+    """Formatted output for a chunk of ranked entities: (text, matches, entities with matches, pairs scored)
+
+    Lines are formatted here rather than in the parent, so writing keeps up with the pool.
+    """
+    chunk = EntityColumns.from_arrays(kind, arrays)
+    others, other_fields, near, template = _worker['columns'], _worker['fields'], _worker['near'], _worker['template']
+    lines, matched, scored = [], 0, 0
+    for row in range(len(ids)):
+        if kind == 'producer':
+            candidates = _worker['viability'].consumers_for(chunk.capacity[row], chunk.servable[row])
+        else:
+            candidates = _worker['viability'].producers_for(chunk.capacity[row], chunk.industry[row])
+        if chunk.has_location[row] and len(candidates):
+            # Located pairs farther apart than MAX_MATCH_DISTANCE_KM are never viable
+            close = _worker['spatial'].rows_near(_worker['kind'], float(chunk.lat[row]), float(chunk.lon[row]),
+                                                 MAX_MATCH_DISTANCE_KM)
+            near[close] = True
+            candidates = candidates[near[candidates] | ~others.has_location[candidates]]
+            near[close] = False
+        if len(candidates) == 0:
+            continue
+        scored += len(candidates)
+        if kind == 'producer':
+            scores = score_columns(chunk.take([row]), others.take(candidates), *_worker['params'])
+        else:
+            scores = score_columns(others.take(candidates), chunk.take([row]), *_worker['params'])
+        viable = np.flatnonzero(scores['viable'])
+        if len(viable) == 0:
+            continue
+        matched += 1
+        top = viable[rank_positions(scores['overall_score'][viable], limit or len(viable))]
+        values = np.column_stack([scores['overall_score'][top]] + [scores[name][top] for name in COMPONENTS] +
+                                 [scores['distance_km'][top]]).tolist()
+        own = _field(ids[row], _worker['format'])
+        for rank, (other, row_values) in enumerate(zip(candidates[top].tolist(), values), start=1):
+            pair = (own, other_fields[other]) if kind == 'producer' else (other_fields[other], own)
+            lines.append(template % (pair + (rank,) + tuple(row_values)))
+    return ''.join(lines), len(lines), matched, scored
+
+# --- Parent side ---
+
+def _completed(task, *args) -> Future:
+    """Run a task in this process (--workers 0) as an already finished future"""
+    future = Future()
+    future.set_result(task(*args))
+    return future
+
+def run(producers_path: str, consumers_path: str, output_path: str, rank: str = 'producers',
+        limit: int = 0, workers: Optional[int] = None, chunk_size: int = DEFAULT_CHUNK_SIZE,
+        weights: Optional[Dict] = None) -> Dict:
+    """Rank every entity of one side against the other and write the matches; returns a summary"""
+    kind = 'producer' if rank == 'producers' else 'consumer'
+    other = KINDS[1 - KINDS.index(kind)]
+    ranked_path, other_path = (producers_path, consumers_path) if kind == 'producer' else (consumers_path, producers_path)
+    workers = (os.cpu_count() or 1) if workers is None else workers
+    start = time.perf_counter()
+
+    with tempfile.TemporaryDirectory() as vector_dir:
+        # A fresh engine, so neither the server's vector cache nor its files are touched
+        engine = VectorEngine(vector_dir)
+    matcher = AdvancedMatcher(engine)
+    params = (matcher.resolve_weights(weights), matcher.max_reasonable_distance, matcher.distance_penalty_factor)
+
+    other_records = list(read_records(other_path))
+    count_text(engine, other, iter(other_records), chunk_size)
+    count_text(engine, kind, read_records(ranked_path), chunk_size)
+    counterparts = vectorized_columns(engine, other, other_records)
+    del other_records
+    fmt = _format(output_path)
+    initargs = (other, counterparts.scoring_arrays(), counterparts.ids,
+                EntityColumns(kind, [], engine).scoring_arrays(), params, fmt)
+    n_counterparts = len(counterparts)
+    del counterparts
+    loaded = time.perf_counter()
+    print(f"Loaded {n_counterparts} {other}s in {loaded - start:.1f}s", file=sys.stderr)
+
+    if workers > 0:
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn'),
+                                   initializer=_init_worker, initargs=initargs)
+        submit = pool.submit
+    else:
+        pool = None
+        _init_worker(*initargs)
+        submit = _completed
+
+    output = _open(output_path, 'wt')
+    if fmt == 'csv':
+        output.write(','.join(OUTPUT_FIELDS) + '\n')
+    ranked = matched = written = scored = 0
+    in_flight = deque()
+    last_report = time.perf_counter()
+
+    def drain(keep: int):
+        nonlocal written, scored, matched, last_report
+        while len(in_flight) > keep:
+            text, matches, entities, pairs = in_flight.popleft().result()
+            output.write(text)
+            written += matches
+            matched += entities
+            scored += pairs
+            if time.perf_counter() - last_report >= PROGRESS_INTERVAL:
+                last_report = time.perf_counter()
+                print(f"Ranked {ranked} {kind}s, {written} matches written", file=sys.stderr)
+
+    try:
+        for records in _chunks(read_records(ranked_path), chunk_size):
+            columns = vectorized_columns(engine, kind, records)
+            in_flight.append(submit(_match_chunk, kind, columns.scoring_arrays(), columns.ids, limit))
+            ranked += len(columns)
+            drain(2 * max(workers, 1))
+        drain(0)
+    finally:
+        output.close()
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    secs = time.perf_counter() - start
+    match_secs = time.perf_counter() - loaded
+    return {
+        'ranked': kind,
+        'entities': ranked,
+        'counterparts': n_counterparts,
+        'entities_with_matches': matched,
+        'matches_written': written,
+        'pairs_scored': scored,
+        'workers': workers,
+        'load_secs': round(loaded - start, 3),
+        'match_secs': round(match_secs, 3),
+        'total_secs': round(secs, 3),
+        'entities_per_sec': round(ranked / match_secs, 1) if match_secs else None,
+        'pairs_per_sec': round(scored / match_secs, 1) if match_secs else None,
+        'output': output_path
+    }
+
+def _parse_weights(spec: Optional[str]) -> Optional[Dict]:
+    """`name:value,...` as accepted by the API's `weights` parameter"""
+    if not spec:
+        return None
+    overrides = {}
+    for item in spec.split(','):
+        name, _, value = item.partition(':')
+        try:
+            overrides[name.strip()] = float(value)
+        except ValueError:
+            raise ValueError("--weights must be a comma-separated list of name:value")
+    # Unknown names and invalid values are rejected up front, as the API does
+    try:
+        AdvancedMatcher(None).resolve_weights(overrides)
+    except ValueError as e:
+        raise ValueError(f"--weights: {e}")
+    return overrides
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Match every producer against every consumer from exported files")
+    parser.add_argument('--producers', required=True, help='Producers as NDJSON or CSV (optionally .gz)')
+    parser.add_argument('--consumers', required=True, help='Consumers as NDJSON or CSV (optionally .gz)')
+    parser.add_argument('--output', required=True, help='Matches as .csv or .ndjson (optionally .gz)')
+    parser.add_argument('--rank', choices=('producers', 'consumers'), default='producers',
+                        help='Side whose match lists are written (it is streamed; the other is loaded)')
+    parser.add_argument('--limit', type=int, default=0, help='Matches kept per entity (0 for all viable)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Scoring processes (default: CPU count, 0 to score in this process)')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='Entities per scoring task')
+    parser.add_argument('--weights', help='Weight overrides as name:value,... (as in GET /api/matches)')
+    args = parser.parse_args(argv)
+    try:
+        weights = _parse_weights(args.weights)
+    except ValueError as e:
+        parser.error(str(e))
+
+    summary = run(args.producers, args.consumers, args.output, args.rank, args.limit, args.workers,
+                  args.chunk_size, weights)
+    print(json.dumps(summary, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,5 @@
+"""Benchmarks for the CarbonCapture backend.
+
+Each module is runnable with ``python -m benchmarks.<name>`` from the
+``backend`` directory and prints its results as JSON.
+"""
@@ -0,0 +1,348 @@
+"""HTTP load test of the API under the production gunicorn config.
+
+Usage (from the backend directory):
+
+    python -m benchmarks.loadtest --size 2000 --concurrency 32 --duration 60 \\
+        --llm-latency-ms 800 --geocoder-latency-ms 150
+
+The harness writes a synthetic database to a temporary directory, starts the
+local Azure OpenAI / Nominatim stand-ins from `benchmarks.stubs`, boots
+gunicorn with the flags from the Procfile, and drives a weighted mix of
+read and write traffic. Throughput, error rate and latency percentiles per
+endpoint are printed as JSON.
+
+AI analysis is a background job, so it is reported twice:
+`analyze_matches_enqueue` is the POST that queues it (202), and
+`analyze_matches_completed` is the time until polling `/api/jobs/<id>`
+finds the job finished. Failed jobs and polls that time out count as
+errors of the latter, which is left out of the overall request numbers.
+"""
+
+import argparse
+import http.client
+import json
+import os
+import random
+import shlex
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List
+
+import bcrypt
+import numpy as np
+
+from benchmarks.stubs import StubConfig, start_stub_server
+from benchmarks.synthetic import generate_marketplace
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LOADTEST_PASSWORD = 'loadtest-password'
+
+DEFAULT_MIX = {
+    'matches': 0.45,
+    'producers_list': 0.20,
+    'login': 0.15,
+    'producers_create': 0.10,
+    'analyze_matches': 0.05,
+    'geocode': 0.05
+}
+
+# End-to-end job timings, reported per endpoint but left out of the overall request numbers
+JOB_COMPLETIONS = ('analyze_matches_completed',)
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def _parse_mix(spec: str) -> Dict[str, float]:
+    if not spec:
+        return dict(DEFAULT_MIX)
+    mix = {}
+    for part in spec.split(','):
+        name, weight = part.split('=')
+        if name not in DEFAULT_MIX:
+            raise SystemExit(f"Unknown endpoint in --mix: {name} (choose from {', '.join(DEFAULT_MIX)})")
+        mix[name] = float(weight)
+    return mix
+
+def production_gunicorn_args(port: int) -> List[str]:
+    """Gunicorn arguments from the Procfile, rebound to a local port"""
+    with open(os.path.join(BACKEND_DIR, 'Procfile')) as f:
+        line = next(l for l in f if l.startswith('web:'))
+    args = shlex.split(line[len('web:'):].replace('$PORT', str(port)))
+    if args[0] != 'gunicorn':
+        raise SystemExit(f"Procfile web process is not gunicorn: {line.strip()}")
+    args = args[1:]
+    if '--bind' in args:
+        args[args.index('--bind') + 1] = f'127.0.0.1:{port}'
+    return [sys.executable, '-m', 'gunicorn'] + args
+
+def prepare_database(workdir: str, size: int, users: int, seed: int) -> Dict:
+    db = generate_marketplace(size, size, seed)
+    password_hash = bcrypt.hashpw(LOADTEST_PASSWORD.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    db['users'] = [
+        {
+            'id': f'user_{i + 1}',
+            'email': f'loadtest{i}@example.com',
+            'password': password_hash,
+            'name': f'Load Test User {i}',
+            'role': 'user',
+            'created_at': '2025-01-01T00:00:00'
+        }
+        for i in range(users)
+    ]
+    with open(os.path.join(workdir, 'database.json'), 'w') as f:
+        json.dump(db, f)
+    return db
+
+class ApiClient:
+    """Minimal JSON client (one connection per request, like browsers hitting sync workers)"""
+
+    def __init__(self, port: int, timeout: float):
+        self.port = port
+        self.timeout = timeout
+
+    def request(self, method: str, path: str, payload=None):
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=self.timeout)
+        try:
+            body = json.dumps(payload) if payload is not None else None
+            headers = {'Content-Type': 'application/json'} if body else {}
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            data = response.read()
+            return response.status, data
+        finally:
+            conn.close()
+
+def wait_until_ready(client: ApiClient, timeout: float):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            status, _ = client.request('GET', '/')
+            if status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.1)
+    raise SystemExit('gunicorn did not become ready in time')
+
+class LoadTest:
+    def __init__(self, client: ApiClient, db: Dict, mix: Dict[str, float], seed: int,
+                 job_poll_interval: float = 0.1):
+        self.client = client
+        self.job_poll_interval = job_poll_interval
+        self.producers = db['producers']
+        self.users = db['users']
+        self.names = list(mix)
+        self.weights = [mix[n] for n in self.names]
+        self.rng = random.Random(seed)
+        self.analysis_payloads = []
+        self.results = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+        self.errors = Counter()
+        self._lock = threading.Lock()
+
+    def warm_up(self, samples: int = 10):
+        """Prime worker caches and collect real match payloads for analyze-matches"""
+        for producer in self.rng.sample(self.producers, min(samples, len(self.producers))):
+            status, data = self.client.request('GET', f"/api/matches?producer_id={producer['id']}")
+            if status == 200:
+                matches = json.loads(data)
+                if matches:
+                    self.analysis_payloads.append({'producer': producer, 'matches': matches[:3]})
+
+    def _build(self, name: str, rng: random.Random):
+        if name == 'matches':
+            producer = rng.choice(self.producers)
+            return 'GET', f"/api/matches?producer_id={producer['id']}", None
+        if name == 'producers_list':
+            return 'GET', '/api/producers', None
+        if name == 'login':
+            user = rng.choice(self.users)
+            return 'POST', '/api/login', {'email': user['email'], 'password': LOADTEST_PASSWORD}
+        if name == 'producers_create':
+            return 'POST', '/api/producers', {
+                'name': f'Load Test Producer {rng.randrange(10 ** 9)}',
+                'location': {'lat': rng.uniform(26, 48), 'lon': rng.uniform(-123, -70)},
+                'co2_supply_tonnes_per_week': rng.randint(50, 2000)
+            }
+        if name == 'analyze_matches':
+            if not self.analysis_payloads:
+                return None
+            return 'POST', '/api/analyze-matches', rng.choice(self.analysis_payloads)
+        if name == 'geocode':
+            return 'POST', '/api/geocode', {'address': f'{rng.randint(1, 9999)} Industrial Way, Houston TX'}
+        raise ValueError(name)
+
+    def _worker(self, worker_id: int, stop_at: float):
+        rng = random.Random(self.rng.random() + worker_id)
+        while time.time() < stop_at:
+            name = rng.choices(self.names, weights=self.weights)[0]
+            built = self._build(name, rng)
+            if built is None:
+                continue
+            method, path, payload = built
+            start = time.perf_counter()
+            data = None
+            try:
+                status, data = self.client.request(method, path, payload)
+                error = status >= 500
+            except Exception as e:
+                status, error = type(e).__name__, True
+            if name == 'analyze_matches':
+                self._record('analyze_matches_enqueue', start, status, error)
+                if status == 202:
+                    self._record(JOB_COMPLETIONS[0], start, *self._wait_for_job(json.loads(data)))
+            else:
+                self._record(name, start, status, error)
+
+    def _wait_for_job(self, queued: Dict):
+        """Poll a queued job until it finishes; returns (final status, whether it counts as an error)"""
+        deadline = time.perf_counter() + self.client.timeout
+        while time.perf_counter() < deadline:
+            try:
+                status, data = self.client.request('GET', queued['status_url'])
+            except Exception as e:
+                return type(e).__name__, True
+            if status != 200:
+                return f'poll_{status}', True
+            job_status = json.loads(data)['status']
+            if job_status == 'succeeded':
+                return job_status, False
+            if job_status not in ('queued', 'running'):
+                return job_status, True
+            time.sleep(self.job_poll_interval)
+        return 'poll_timeout', True
+
+    def _record(self, name: str, start: float, status, error: bool):
+        latency_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self.results[name].append(latency_ms)
+            self.statuses[name][str(status)] += 1
+            if error:
+                self.errors[name] += 1
+
+    def run(self, concurrency: int, duration: float) -> float:
+        stop_at = time.time() + duration
+        threads = [threading.Thread(target=self._worker, args=(i, stop_at)) for i in range(concurrency)]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return time.perf_counter() - start
+
+    def report(self, elapsed: float) -> Dict:
+        endpoints = {}
+        all_latencies = []
+        for name, latencies in sorted(self.results.items()):
+            if name not in JOB_COMPLETIONS:
+                all_latencies.extend(latencies)
+            endpoints[name] = _summarize(latencies, self.errors[name], elapsed)
+            endpoints[name]['status_codes'] = dict(self.statuses[name])
+        return {
+            'elapsed_secs': round(elapsed, 2),
+            'overall': _summarize(all_latencies, sum(self.errors.values()), elapsed),
+            'endpoints': endpoints
+        }
+
+def _summarize(latencies: List[float], errors: int, elapsed: float) -> Dict:
+    if not latencies:
+        return {'requests': 0}
+    arr = np.array(latencies)
+    return {
+        'requests': len(latencies),
+        'rps': round(len(latencies) / elapsed, 2),
+        'error_rate': round(errors / len(latencies), 4),
+        'p50_ms': round(float(np.percentile(arr, 50)), 2),
+        'p90_ms': round(float(np.percentile(arr, 90)), 2),
+        'p99_ms': round(float(np.percentile(arr, 99)), 2),
+        'max_ms': round(float(arr.max()), 2)
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the API under the production gunicorn config")
+    parser.add_argument('--size', type=int, default=500, help='Producers and consumers in the synthetic database')
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=30.0, help='Seconds of measured traffic')
+    parser.add_argument('--mix', default='', help='Endpoint weights, e.g. matches=0.6,login=0.2,producers_list=0.2')
+    parser.add_argument('--llm-latency-ms', type=float, default=800.0)
+    parser.add_argument('--geocoder-latency-ms', type=float, default=150.0)
+    parser.add_argument('--llm-error-rate', type=float, default=0.0)
+    parser.add_argument('--request-timeout', type=float, default=130.0,
+                        help='Seconds per request, and for an analysis job to finish')
+    parser.add_argument('--job-poll-ms', type=float, default=100.0,
+                        help='Interval between /api/jobs polls for queued analyses')
+    parser.add_argument('--keep-workdir', action='store_true')
+    parser.add_argument('--output', help='Write JSON results to this file instead of stdout')
+    args = parser.parse_args(argv)
+
+    mix = _parse_mix(args.mix)
+    workdir = tempfile.mkdtemp(prefix='carbonflow-loadtest-')
+    stubs = start_stub_server(StubConfig(args.llm_latency_ms, args.geocoder_latency_ms,
+                                         llm_error_rate=args.llm_error_rate))
+    stub_address = f"127.0.0.1:{stubs.server_address[1]}"
+    port = _free_port()
+    server = None
+    log = None
+    try:
+        db = prepare_database(workdir, args.size, args.users, args.seed)
+        env = os.environ.copy()
+        env.update({
+            'DATABASE_FILE': 'database.json',
+            'VECTOR_CACHE_DIR': os.path.join(workdir, 'vectors'),
+            'JWT_SECRET_KEY': 'loadtest-secret',
+            'AZURE_OPENAI_ENDPOINT': f'http://{stub_address}',
+            'AZURE_OPENAI_API_KEY': 'stub',
+            'NOMINATIM_DOMAIN': stub_address,
+            'NOMINATIM_SCHEME': 'http',
+            'FLASK_DEBUG': 'False'
+        })
+        cmd = production_gunicorn_args(port) + ['--chdir', workdir, '--pythonpath', BACKEND_DIR]
+        log = open(os.path.join(workdir, 'gunicorn.log'), 'w')
+        server = subprocess.Popen(cmd, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+        client = ApiClient(port, args.request_timeout)
+        wait_until_ready(client, timeout=120)
+        test = LoadTest(client, db, mix, args.seed, args.job_poll_ms / 1000.0)
+        test.warm_up()
+        elapsed = test.run(args.concurrency, args.duration)
+
+        report = {
+            'benchmark': 'loadtest',
+            'gunicorn': ' '.join(cmd[3:]),
+            'size': args.size,
+            'concurrency': args.concurrency,
+            'mix': mix,
+            'stub_latency_ms': {'llm': args.llm_latency_ms, 'geocoder': args.geocoder_latency_ms},
+            **test.report(elapsed)
+        }
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        if log is not None:
+            log.close()
+        stubs.shutdown()
+        if args.keep_workdir:
+            print(f"Work directory kept at {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+"""Matching-system benchmark over synthetic marketplaces.
+
+Usage (from the backend directory):
+
+    python -m benchmarks.matching --sizes 100,1000,10000 --output results.json
+
+For each size N a marketplace with N producers and N * consumer-ratio
+consumers is generated from a fixed seed and written to a temporary
+database. The benchmark then measures vector generation throughput,
+`get_ranked_matches` latency percentiles (cold, and re-ranked with other
+weights from the component cache), `find_similar` latency percentiles,
+`get_matching_stats` runtime and memory footprint, and emits everything
+as JSON.
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Dict, List
+
+import numpy as np
+
+from benchmarks.synthetic import generate_marketplace
+from matching_engine import AdvancedMatcher
+from vector_engine import VectorEngine
+
+def _percentile(samples: List[float], pct: float) -> float:
+    return float(np.percentile(samples, pct)) if samples else 0.0
+
+def _latency_summary(samples_ms: List[float]) -> Dict:
+    return {
+        'queries': len(samples_ms),
+        'mean_ms': round(statistics.fmean(samples_ms), 3) if samples_ms else 0.0,
+        'p50_ms': round(_percentile(samples_ms, 50), 3),
+        'p99_ms': round(_percentile(samples_ms, 99), 3),
+        'max_ms': round(max(samples_ms), 3) if samples_ms else 0.0
+    }
+
+def _max_rss_mb() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS and kilobytes elsewhere
+    return round(rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024, 1)
+
+def _git_revision() -> str:
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                             capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def measure_vector_throughput(engine, producers: List[Dict], consumers: List[Dict]) -> Dict:
+    """Entities per second through the per-entity and batch vector generators"""
+    start = time.perf_counter()
+    for producer in producers:
+        engine.generate_producer_vector(producer)
+    producer_secs = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for consumer in consumers:
+        engine.generate_consumer_vector(consumer)
+    consumer_secs = time.perf_counter() - start
+
+    start = time.perf_counter()
+    engine.generate_producer_vectors_batch(engine.producer_columns(producers))
+    batch_producer_secs = time.perf_counter() - start
+
+    start = time.perf_counter()
+    engine.generate_consumer_vectors_batch(engine.consumer_columns(consumers))
+    batch_consumer_secs = time.perf_counter() - start
+
+    def rate(count, secs):
+        return round(count / secs, 1) if secs else None
+
+    return {
+        'producers': len(producers),
+        'consumers': len(consumers),
+        'producer_vectors_per_sec': rate(len(producers), producer_secs),
+        'consumer_vectors_per_sec': rate(len(consumers), consumer_secs),
+        'batch_producer_vectors_per_sec': rate(len(producers), batch_producer_secs),
+        'batch_consumer_vectors_per_sec': rate(len(consumers), batch_consumer_secs)
+    }
+
+def run_size(size: int, args, workdir: str) -> Dict:
+    n_consumers = max(1, int(size * args.consumer_ratio))
+    result = {'size': size, 'producers': size, 'consumers': n_consumers}
+
+    gc.collect()
+    tracemalloc.start()
+    db = generate_marketplace(size, n_consumers, args.seed)
+    result['memory'] = {'marketplace_mb': round(tracemalloc.get_traced_memory()[0] / 1e6, 2)}
+
+    db_file = os.path.join(workdir, f'database_{size}.json')
+    with open(db_file, 'w') as f:
+        json.dump(db, f)
+    os.environ['DATABASE_FILE'] = db_file
+    result['database_file_mb'] = round(os.path.getsize(db_file) / 1e6, 2)
+
+    vector_dir = os.path.join(workdir, f'vectors_{size}')
+    os.makedirs(vector_dir, exist_ok=True)
+    os.environ['VECTOR_CACHE_DIR'] = vector_dir
+    engine = VectorEngine()
+
+    rng = np.random.default_rng(args.seed)
+    sample = min(size, args.vector_sample)
+    producer_sample = [db['producers'][i] for i in rng.choice(size, sample, replace=False)]
+    consumer_sample = [db['consumers'][i] for i in rng.choice(n_consumers, min(n_consumers, sample), replace=False)]
+    result['vector_generation'] = measure_vector_throughput(engine, producer_sample, consumer_sample)
+
+    before = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    engine.update_all_vectors(db['producers'], db['consumers'])
+    result['vector_rebuild_secs'] = round(time.perf_counter() - start, 3)
+    result['memory']['vectors_mb'] = round((tracemalloc.get_traced_memory()[0] - before) / 1e6, 2)
+
+    matcher = AdvancedMatcher(engine)
+    query_ids = [db['producers'][i]['id'] for i in rng.choice(size, min(size, args.queries), replace=False)]
+    del db
+    gc.collect()
+
+    tracemalloc.reset_peak()
+    baseline = tracemalloc.get_traced_memory()[0]
+    latencies = []
+    for producer_id in query_ids:
+        start = time.perf_counter()
+        matcher.get_ranked_matches(producer_id, limit=20)
+        latencies.append((time.perf_counter() - start) * 1000)
+    result['ranked_matches'] = _latency_summary(latencies)
+    result['memory']['ranked_matches_peak_mb'] = round((tracemalloc.get_traced_memory()[1] - baseline) / 1e6, 2)
+
+    # Same producers again with per-request weights, served from the component cache
+    weights = matcher.resolve_weights({'distance_penalty': 0.5, 'vector_similarity': 0.1})
+    latencies = []
+    for producer_id in query_ids:
+        start = time.perf_counter()
+        matcher.get_ranked_matches(producer_id, limit=20, weights=weights)
+        latencies.append((time.perf_counter() - start) * 1000)
+    result['reranked_matches'] = _latency_summary(latencies)
+
+    start = time.perf_counter()
+    matcher.find_similar('producer', query_ids[0], k=10)
+    result['similar_index_build_secs'] = round(time.perf_counter() - start, 3)
+    latencies = []
+    for producer_id in query_ids:
+        start = time.perf_counter()
+        matcher.find_similar('producer', producer_id, k=10)
+        latencies.append((time.perf_counter() - start) * 1000)
+    result['similar_producers'] = _latency_summary(latencies)
+
+    if size <= args.stats_max_size:
+        start = time.perf_counter()
+        stats = matcher.get_matching_stats()
+        result['matching_stats'] = {
+            'secs': round(time.perf_counter() - start, 3),
+            'avg_matches_per_producer': stats.get('avg_matches_per_producer')
+        }
+    else:
+        result['matching_stats'] = {'skipped': f'size > --stats-max-size ({args.stats_max_size})'}
+
+    tracemalloc.stop()
+    result['memory']['max_rss_mb'] = _max_rss_mb()
+    return result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the matching system on synthetic data")
+    parser.add_argument('--sizes', default='100,1000',
+                        help='Comma-separated producer counts (10^2 .. 10^6)')
+    parser.add_argument('--consumer-ratio', type=float, default=1.0,
+                        help='Consumers generated per producer')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--queries', type=int, default=20,
+                        help='get_ranked_matches calls per size')
+    parser.add_argument('--vector-sample', type=int, default=20000,
+                        help='Entities timed for vector throughput')
+    parser.add_argument('--stats-max-size', type=int, default=1000,
+                        help='Largest size get_matching_stats is run at (it is O(P*C))')
+    parser.add_argument('--output', help='Write JSON results to this file instead of stdout')
+    args = parser.parse_args(argv)
+
+    sizes = [int(s) for s in args.sizes.split(',') if s.strip()]
+    report = {
+        'benchmark': 'matching',
+        'revision': _git_revision(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'seed': args.seed,
+        'consumer_ratio': args.consumer_ratio,
+        'results': []
+    }
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in sizes:
+            report['results'].append(run_size(size, args, workdir))
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""Cold-start benchmark: import cost and gunicorn boot-to-first-response time.
+
+Usage (from the backend directory):
+
+    python -m benchmarks.startup --runs 5 --path / --path "/api/matches?producer_id=prod_001"
+
+For every run a fresh interpreter is used, so module caches never hide
+import cost. Gunicorn is booted with the Procfile's command (entry point,
+worker class and flags), so the boot measured is the one that ships.
+Results are printed as JSON.
+"""
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from typing import Optional
+
+from benchmarks.loadtest import production_gunicorn_args
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_PROBE = """
+import time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.create_app()
+created = time.perf_counter()
+print((imported - start) * 1000, (created - imported) * 1000)
+"""
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def _summarize(samples):
+    if not samples:
+        return {}
+    return {
+        'runs': len(samples),
+        'min_ms': round(min(samples), 2),
+        'median_ms': round(statistics.median(samples), 2),
+        'max_ms': round(max(samples), 2),
+    }
+
+def _bench_env(vector_dir: str) -> dict:
+    env = os.environ.copy()
+    # Keep the tracked vector cache untouched while benchmarking
+    env['VECTOR_CACHE_DIR'] = vector_dir
+    env.setdefault('JWT_SECRET_KEY', 'startup-benchmark')
+    return env
+
+def measure_import(runs: int, env: dict) -> dict:
+    """Time `import app` and `create_app()` in fresh interpreters"""
+    import_ms, create_ms = [], []
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, '-c', IMPORT_PROBE],
+            cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True
+        )
+        imp, create = out.stdout.strip().splitlines()[-1].split()
+        import_ms.append(float(imp))
+        create_ms.append(float(create))
+    return {'import_app': _summarize(import_ms), 'create_app': _summarize(create_ms)}
+
+def _wait_for_response(url: str, deadline: float) -> bool:
+    while time.perf_counter() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=5) as resp:
+                resp.read()
+                return True
+        except urllib.error.HTTPError:
+            # Any HTTP response means a worker served the request
+            return True
+        except (urllib.error.URLError, ConnectionError, socket.timeout):
+            time.sleep(0.01)
+    return False
+
+def measure_gunicorn(runs: int, paths, workers: Optional[int], env: dict, timeout: float) -> dict:
+    """Time from spawning gunicorn (as in the Procfile) to the first response on each path"""
+    results = {}
+    for path in paths:
+        samples = []
+        for _ in range(runs):
+            port = _free_port()
+            cmd = production_gunicorn_args(port)
+            if workers is not None:
+                if '--workers' in cmd:
+                    cmd[cmd.index('--workers') + 1] = str(workers)
+                else:
+                    cmd += ['--workers', str(workers)]
+            start = time.perf_counter()
+            proc = subprocess.Popen(cmd, cwd=BACKEND_DIR, env=env,
+                                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                ok = _wait_for_response(f'http://127.0.0.1:{port}{path}', start + timeout)
+                if ok:
+                    samples.append((time.perf_counter() - start) * 1000)
+            finally:
+                proc.terminate()
+                proc.wait()
+        results[path] = _summarize(samples)
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Gunicorn workers (default: the Procfile's)")
+    parser.add_argument('--path', action='append', dest='paths',
+                        help='Path to request after boot (repeatable, default /)')
+    parser.add_argument('--timeout', type=float, default=120.0,
+                        help='Seconds to wait for the first response')
+    parser.add_argument('--skip-gunicorn', action='store_true')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as vector_dir:
+        env = _bench_env(vector_dir)
+        report = {
+            'python': sys.version.split()[0],
+            'import': measure_import(args.runs, env),
+        }
+        if not args.skip_gunicorn:
+            report['gunicorn_first_response'] = measure_gunicorn(
+                args.runs, args.paths or ['/'], args.workers, env, args.timeout
+            )
+
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""Local stand-ins for Azure OpenAI and Nominatim with configurable latency.
+
+One threaded HTTP server answers both:
+
+- ``POST .../chat/completions`` with a chat completion whose content is the
+  JSON analysis object `analyze_matches` expects
+- ``GET /search`` with a Nominatim-style geocoding result
+
+Point the app at it with::
+
+    AZURE_OPENAI_ENDPOINT=http://127.0.0.1:<port>  AZURE_OPENAI_API_KEY=stub
+    NOMINATIM_DOMAIN=127.0.0.1:<port>  NOMINATIM_SCHEME=http
+
+Run standalone with ``python -m benchmarks.stubs --port 8089``.
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+class StubConfig:
+    """Latency profile for the stub upstreams (milliseconds)"""
+
+    def __init__(self, llm_latency_ms: float = 800.0, geocoder_latency_ms: float = 150.0,
+                 jitter: float = 0.25, llm_error_rate: float = 0.0):
+        self.llm_latency_ms = llm_latency_ms
+        self.geocoder_latency_ms = geocoder_latency_ms
+        self.jitter = jitter
+        self.llm_error_rate = llm_error_rate
+
+    def delay(self, base_ms: float):
+        if base_ms <= 0:
+            return
+        spread = base_ms * self.jitter
+        time.sleep(max(0.0, random.uniform(base_ms - spread, base_ms + spread)) / 1000.0)
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    config = StubConfig()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+        if not urlparse(self.path).path.endswith('/chat/completions'):
+            self._send_json(404, {'error': {'message': 'Unknown stub path'}})
+            return
+
+        self.config.delay(self.config.llm_latency_ms)
+        if random.random() < self.config.llm_error_rate:
+            self._send_json(500, {'error': {'message': 'Stub upstream failure'}})
+            return
+
+        analysis = {
+            'justification': 'Stub analysis: partnership scores indicate a viable supply agreement.',
+            'strategic_considerations': ['Capacity fit supports a long-term contract',
+                                         'Logistics distance is manageable']
+        }
+        self._send_json(200, {
+            'id': 'chatcmpl-stub',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': request.get('model', 'stub'),
+            'choices': [{
+                'index': 0,
+                'finish_reason': 'stop',
+                'message': {'role': 'assistant', 'content': json.dumps(analysis)}
+            }],
+            'usage': {'prompt_tokens': 300, 'completion_tokens': 80, 'total_tokens': 380}
+        })
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path.rstrip('/') != '/search':
+            self._send_json(404, {'error': 'Unknown stub path'})
+            return
+
+        self.config.delay(self.config.geocoder_latency_ms)
+        query = parse_qs(url.query).get('q', [''])[0]
+        # Deterministic pseudo-coordinates inside the continental US
+        digest = zlib.crc32(query.encode('utf-8'))
+        lat = 25.0 + (digest % 2400) / 100.0
+        lon = -124.0 + ((digest >> 12) % 5600) / 100.0
+        self._send_json(200, [{
+            'place_id': digest,
+            'lat': f'{lat:.4f}',
+            'lon': f'{lon:.4f}',
+            'display_name': query
+        }])
+
+def start_stub_server(config: StubConfig, host: str = '127.0.0.1', port: int = 0) -> ThreadingHTTPServer:
+    """Start the stub server on a background thread and return it"""
+    handler = type('StubHandler', (_StubHandler,), {'config': config})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='upstream-stubs', daemon=True).start()
+    return server
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve Azure OpenAI / Nominatim stand-ins")
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--llm-latency-ms', type=float, default=800.0)
+    parser.add_argument('--geocoder-latency-ms', type=float, default=150.0)
+    parser.add_argument('--jitter', type=float, default=0.25)
+    parser.add_argument('--llm-error-rate', type=float, default=0.0)
+    args = parser.parse_args(argv)
+
+    config = StubConfig(args.llm_latency_ms, args.geocoder_latency_ms, args.jitter, args.llm_error_rate)
+    server = start_stub_server(config, port=args.port)
+    print(f"Stub upstreams listening on http://127.0.0.1:{server.server_address[1]}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
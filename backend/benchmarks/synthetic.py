@@ -0,0 +1,132 @@
+"""Seeded synthetic marketplace generator.
+
+Producers and consumers are drawn from the same catalogs the matching system
+encodes (industries and transport methods from `VectorEngine`, purity grades
+around the industry thresholds used by `AdvancedMatcher.calculate_quality_match`),
+clustered around US industrial hubs. The same seed always yields the same
+marketplace, so benchmark results are comparable across versions.
+"""
+
+import argparse
+import json
+from typing import Dict, List
+
+import numpy as np
+
+from vector_engine import VectorEngine
+
+# Industrial hubs entities cluster around: (lat, lon, spread in degrees, weight)
+HUBS = [
+    (29.76, -95.37, 1.5, 0.16),   # Houston / Gulf Coast
+    (41.88, -87.63, 1.5, 0.12),   # Chicago
+    (34.05, -118.24, 1.2, 0.10),  # Los Angeles
+    (40.71, -74.01, 1.0, 0.08),   # New York
+    (39.74, -104.99, 1.5, 0.06),  # Denver
+    (41.26, -95.94, 2.5, 0.10),   # Corn belt ethanol
+    (33.75, -84.39, 1.5, 0.07),   # Atlanta
+    (47.61, -122.33, 1.2, 0.05),  # Seattle
+    (36.33, -119.64, 1.5, 0.08),  # Central Valley
+    (32.78, -96.80, 1.5, 0.08),   # Dallas
+    (39.95, -82.99, 2.0, 0.10),   # Ohio valley
+]
+
+# Purity grades straddling the industry thresholds (85, 88, 90, 95, 98, 99)
+PURITY_GRADES = [85, 88, 90, 92, 95, 97, 98, 99, 99.5, 99.9]
+PURITY_WEIGHTS = [0.10, 0.08, 0.14, 0.10, 0.18, 0.08, 0.10, 0.12, 0.06, 0.04]
+
+PRODUCER_NOTES = [
+    "High-grade CO₂ suitable for industrial applications",
+    "Food-grade CO₂ perfect for beverage industry",
+    "Continuous capture from process emissions",
+    "Seasonal output with storage buffer",
+    ""
+]
+CONSUMER_NOTES = [
+    "Requires steady weekly deliveries",
+    "Food-grade CO₂ required for carbonation lines",
+    "Flexible intake with on-site storage",
+    ""
+]
+
+def _locations(rng: np.random.Generator, n: int):
+    weights = np.array([h[3] for h in HUBS])
+    hub = rng.choice(len(HUBS), size=n, p=weights / weights.sum())
+    centers = np.array([(h[0], h[1]) for h in HUBS])[hub]
+    spread = np.array([h[2] for h in HUBS])[hub]
+    lat = np.clip(centers[:, 0] + rng.normal(0, 1, n) * spread, 24.5, 49.0)
+    lon = np.clip(centers[:, 1] + rng.normal(0, 1, n) * spread * 1.3, -124.5, -67.0)
+    return np.round(lat, 4), np.round(lon, 4)
+
+def generate_producers(n: int, seed: int = 42) -> List[Dict]:
+    """Generate n producer records in the database.json schema"""
+    rng = np.random.default_rng([seed, 0])
+    industries = list(VectorEngine.producer_industries)
+    methods = list(VectorEngine.transport_methods)
+    lat, lon = _locations(rng, n)
+    supply = np.clip(np.round(rng.lognormal(np.log(350), 0.7, n)), 20, 5000).astype(int)
+    utilization = rng.uniform(0.85, 1.0, n)
+    industry = rng.integers(0, len(industries), n)
+    purity = rng.choice(PURITY_GRADES, size=n, p=PURITY_WEIGHTS)
+    n_methods = rng.integers(1, 4, n)
+    notes = rng.integers(0, len(PRODUCER_NOTES), n)
+
+    producers = []
+    for i in range(n):
+        picked = rng.choice(len(methods), size=n_methods[i], replace=False)
+        producers.append({
+            "id": f"prod_{i:07d}",
+            "name": f"Synthetic Producer {i}",
+            "location": {"lat": float(lat[i]), "lon": float(lon[i])},
+            "co2_supply_tonnes_per_week": int(supply[i]),
+            "co2_output_tonnes_per_year": int(supply[i] * 52 * utilization[i]),
+            "industry_type": industries[industry[i]],
+            "co2_purity": float(purity[i]),
+            "transportation_methods": [methods[j] for j in sorted(picked)],
+            "additional_info": PRODUCER_NOTES[notes[i]]
+        })
+    return producers
+
+def generate_consumers(n: int, seed: int = 42) -> List[Dict]:
+    """Generate n consumer records in the database.json schema"""
+    rng = np.random.default_rng([seed, 1])
+    industries = list(VectorEngine.consumer_industries)
+    lat, lon = _locations(rng, n)
+    demand = np.clip(np.round(rng.lognormal(np.log(180), 0.8, n)), 5, 3000).astype(int)
+    industry = rng.integers(0, len(industries), n)
+    notes = rng.integers(0, len(CONSUMER_NOTES), n)
+
+    return [
+        {
+            "id": f"cons_{i:07d}",
+            "name": f"Synthetic Consumer {i}",
+            "industry": industries[industry[i]],
+            "location": {"lat": float(lat[i]), "lon": float(lon[i])},
+            "co2_demand_tonnes_per_week": int(demand[i]),
+            "additional_info": CONSUMER_NOTES[notes[i]]
+        }
+        for i in range(n)
+    ]
+
+def generate_marketplace(n_producers: int, n_consumers: int, seed: int = 42) -> Dict:
+    """Generate a full database.json-shaped marketplace"""
+    return {
+        "users": [],
+        "producers": generate_producers(n_producers, seed),
+        "consumers": generate_consumers(n_consumers, seed)
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write a synthetic marketplace database")
+    parser.add_argument('--producers', type=int, default=1000)
+    parser.add_argument('--consumers', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default='synthetic_database.json')
+    args = parser.parse_args(argv)
+
+    db = generate_marketplace(args.producers, args.consumers, args.seed)
+    with open(args.output, 'w') as f:
+        json.dump(db, f)
+    print(f"Wrote {args.producers} producers and {args.consumers} consumers to {args.output}")
+
+if __name__ == '__main__':
+    main()
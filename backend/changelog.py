@@ -0,0 +1,166 @@
+"""Cross-worker change log for the JSON database
+
+Each gunicorn worker keeps the marketplace in memory (vectors and the
+columnar entity store). A worker that writes the database also appends one
+JSON line per change to `<DATABASE_FILE>.changes` while holding an exclusive
+lock. Each line carries a monotonically increasing data version and the
+file signature before and after the write. Other workers compare the log
+size with how far they have read (one stat per request) and apply only the
+new entries, instead of reloading everything. A worker that has just loaded
+the database starts following the log from its end (see `position`).
+
+Once the log passes CHANGELOG_MAX_BYTES it is rotated: the old file is kept
+as `.changes.1` and a new one starts with a checkpoint entry carrying the
+version forward. Workers notice a rotation because the data at their
+offset is not the next version, and finish the old file from `.1`; one
+that falls more than a rotation behind rebuilds its store from the
+database file.
+"""
+
+import fcntl
+import json
+import os
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+CHANGELOG_SUFFIX = '.changes'
+# Log size at which it is rotated
+CHANGELOG_MAX_BYTES = int(os.getenv('CHANGELOG_MAX_BYTES', str(4 * 1024 * 1024)))
+
+def database_file() -> str:
+    return os.getenv('DATABASE_FILE', 'database.json')
+
+def file_signature(path: Optional[str] = None) -> Tuple:
+    """Identify a database file's contents by path, mtime and size"""
+    path = path or database_file()
+    try:
+        stat = os.stat(path)
+        return (path, stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        return (path, None, None)
+
+def changelog_path(db_file: Optional[str] = None) -> str:
+    return (db_file or database_file()) + CHANGELOG_SUFFIX
+
+def size(db_file: Optional[str] = None) -> int:
+    """Current log size in bytes (0 if there is no log yet)"""
+    try:
+        return os.stat(changelog_path(db_file)).st_size
+    except OSError:
+        return 0
+
+def position(db_file: Optional[str] = None) -> Tuple[int, int]:
+    """(size, last version) of the log, for following it from now on"""
+    try:
+        with open(changelog_path(db_file), 'rb') as f:
+            fcntl.flock(f, fcntl.LOCK_SH)
+            try:
+                return os.fstat(f.fileno()).st_size, _last_version(f)
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+    except OSError:
+        return 0, 0
+
+def _last_version(f) -> int:
+    f.seek(0, os.SEEK_END)
+    end = f.tell()
+    block = 4096
+    while end:
+        start = max(0, end - block)
+        f.seek(start)
+        lines = f.read(end - start).rstrip(b'\n').rsplit(b'\n', 1)
+        if len(lines) == 2 or start == 0:
+            return json.loads(lines[-1])['version']
+        block *= 2
+    return 0
+
+@contextmanager
+def recording(kind: str, op: str, records: List[Dict], db_file: Optional[str] = None):
+    """Hold the log lock around a database write and log the change once it succeeds
+
+    Writers are serialized on the lock, so the before/after signatures in an
+    entry describe exactly that write. Yields the entry; its `version` is
+    set after the block.
+    """
+    db_file = db_file or database_file()
+    path = changelog_path(db_file)
+    while True:
+        with open(path, 'ab+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                if os.fstat(f.fileno()).st_ino != os.stat(path).st_ino:
+                    # Rotated while we waited for the lock; take the new file's lock instead
+                    continue
+                entry = {'version': None, 'kind': kind, 'op': op, 'records': records,
+                         'previous': list(file_signature(db_file))}
+                yield entry
+                entry['signature'] = list(file_signature(db_file))
+                entry['version'] = _last_version(f) + 1
+                f.seek(0, os.SEEK_END)
+                f.write(json.dumps(entry, separators=(',', ':')).encode('utf-8') + b'\n')
+                f.flush()
+                if f.tell() > CHANGELOG_MAX_BYTES:
+                    _rotate(path, entry)
+                return
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+def _rotate(path: str, entry: Dict):
+    """Keep the log as `.1` and start a new one from a checkpoint (called holding the log lock)"""
+    checkpoint = {'version': entry['version'], 'kind': None, 'op': 'checkpoint', 'records': [],
+                  'previous': entry['signature'], 'signature': entry['signature']}
+    with open(path + '.tmp', 'wb') as f:
+        f.write(json.dumps(checkpoint, separators=(',', ':')).encode('utf-8') + b'\n')
+    try:
+        os.unlink(path + '.1')
+    except FileNotFoundError:
+        pass
+    os.link(path, path + '.1')
+    # The log path always exists, so writers never create a second unlocked file
+    os.replace(path + '.tmp', path)
+
+def _read(path: str, offset: int = 0) -> Tuple[List[Dict], int, int]:
+    """Complete entries after `offset`, the offset just past them and the file size"""
+    with open(path, 'rb') as f:
+        file_size = os.fstat(f.fileno()).st_size
+        f.seek(offset)
+        data = f.read()
+    complete = data[:data.rfind(b'\n') + 1]
+    return [json.loads(line) for line in complete.splitlines() if line], offset + len(complete), file_size
+
+def read_since(offset: int, version: int = 0, db_file: Optional[str] = None) -> Tuple[List[Dict], int, bool]:
+    """Entries after byte `offset`, where the entry with `version` ended: (entries, new offset, complete)
+
+    Versions are consecutive, so a log rotated since shows up as data at
+    `offset` that is not the next version. The old file (`.1`) and the new
+    log are then read in full and the entries after `version` kept.
+    `complete` is False when some were lost because the reader fell more
+    than one rotation behind.
+    """
+    path = changelog_path(db_file)
+    try:
+        entries, end, file_size = _read(path, offset)
+    except OSError:
+        return [], offset, True
+    except ValueError:
+        entries, end, file_size = None, offset, 0
+    following = entries is not None and (
+        not entries or (isinstance(entries[0], dict) and entries[0].get('version') == version + 1))
+    if following and (offset == 0 or file_size >= offset):
+        return entries, end, True
+
+    try:
+        entries, end, _ = _read(path)
+    except (OSError, ValueError):
+        return [], offset, True
+    try:
+        entries = _read(path + '.1')[0] + entries
+    except (OSError, ValueError):
+        pass
+    kept, last = [], version
+    for entry in entries:
+        if entry['version'] > last:
+            kept.append(entry)
+            last = entry['version']
+    logged = {entry['version'] for entry in kept if entry.get('op') != 'checkpoint'}
+    return kept, end, logged == set(range(version + 1, last + 1))
@@ -0,0 +1,88 @@
+"""Integer encodings for transport and industry compatibility
+
+Both encodings use the `VectorEngine` catalogs. A producer's transport
+methods are a bitmask over `transport_methods`, and the consumer industries
+its CO2 purity can serve are a bitmask over `consumer_industries`.
+Compatibility checks are then an AND plus a popcount or bit test, which work
+the same on plain ints and on NumPy arrays of candidates.
+"""
+
+from typing import List
+
+import numpy as np
+
+from vector_engine import VectorEngine
+
+# Minimum CO2 purity by consumer industry
+QUALITY_REQUIREMENTS = {
+    'Beverage Carbonation': 98,   # Food grade - very high purity
+    'Food Processing': 99,        # Food grade - highest purity
+    'Chemical Synthesis': 95,     # Industrial - high purity
+    'Biofuel Synthesis': 90,      # Industrial - medium purity
+    'Concrete Curing': 85,        # Industrial - lower purity OK
+    'Vertical Farming': 88,       # Agricultural - medium purity
+    'Manufacturing': 85,          # Industrial - lower purity OK
+}
+DEFAULT_REQUIRED_PURITY = 85
+
+def _required_purity_table() -> np.ndarray:
+    table = np.full(len(VectorEngine.consumer_industries), DEFAULT_REQUIRED_PURITY, dtype=np.float64)
+    for industry, code in VectorEngine.consumer_industries.items():
+        table[code] = QUALITY_REQUIREMENTS.get(industry, DEFAULT_REQUIRED_PURITY)
+    return table
+
+# Required purity indexed by consumer industry code
+REQUIRED_PURITY = _required_purity_table()
+INDUSTRY_BITS = (1 << np.arange(len(REQUIRED_PURITY))).astype(np.uint8)
+OTHER_INDUSTRY = VectorEngine.consumer_industries['Other']
+
+TRANSPORT_BITS = {name: 1 << code for name, code in VectorEngine.transport_methods.items()}
+OTHER_TRANSPORT = TRANSPORT_BITS['Other']
+
+# Preferred transport methods by distance band: (upper bound km, mask)
+TRANSPORT_BANDS = (
+    (50, TRANSPORT_BITS['Truck'] | TRANSPORT_BITS['Pipeline']),
+    (200, TRANSPORT_BITS['Truck'] | TRANSPORT_BITS['Rail'] | TRANSPORT_BITS['Pipeline']),
+    (500, TRANSPORT_BITS['Rail'] | TRANSPORT_BITS['Pipeline'] | TRANSPORT_BITS['Ship']),
+)
+LONG_HAUL_TRANSPORT = TRANSPORT_BITS['Rail'] | TRANSPORT_BITS['Ship'] | TRANSPORT_BITS['Pipeline']
+
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+def encode_transport(methods: List[str]) -> int:
+    """Bitmask of transport methods (unknown names count as 'Other')"""
+    mask = 0
+    for method in methods:
+        mask |= TRANSPORT_BITS.get(method, OTHER_TRANSPORT)
+    return mask
+
+def industry_code(industry: str) -> int:
+    return VectorEngine.consumer_industries.get(industry, OTHER_INDUSTRY)
+
+def required_purity(industry: str) -> float:
+    return QUALITY_REQUIREMENTS.get(industry, DEFAULT_REQUIRED_PURITY)
+
+def servable_industries(purity):
+    """Bitmask of consumer industries whose purity requirement is met"""
+    meets = np.asarray(purity, dtype=np.float64)[..., None] >= REQUIRED_PURITY
+    return np.bitwise_or.reduce(np.where(meets, INDUSTRY_BITS, np.uint8(0)), axis=-1)
+
+def serves_industry(servable, industry):
+    """1 where the servable mask covers the consumer industry code, else 0"""
+    return (np.asarray(servable, dtype=np.uint8) >> np.asarray(industry, dtype=np.uint8)) & 1
+
+def preferred_transport(distance):
+    """Preferred transport mask for a distance (scalar or array, km)"""
+    if np.ndim(distance) == 0:
+        for limit, mask in TRANSPORT_BANDS:
+            if distance < limit:
+                return mask
+        return LONG_HAUL_TRANSPORT
+    return np.select([distance < limit for limit, _ in TRANSPORT_BANDS],
+                     [mask for _, mask in TRANSPORT_BANDS], LONG_HAUL_TRANSPORT)
+
+def transport_overlap(methods, preferred):
+    """Share of preferred methods the producer offers: popcount(methods & preferred) / popcount(preferred)"""
+    methods = np.asarray(methods, dtype=np.uint8)
+    preferred = np.asarray(preferred, dtype=np.uint8)
+    return POPCOUNT[methods & preferred] / POPCOUNT[preferred]
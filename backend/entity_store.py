@@ -0,0 +1,417 @@
+import copy
+import json
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from scipy import sparse
+
+from ann_index import IVFIndex
+from search_index import SearchIndex
+from compatibility import REQUIRED_PURITY, encode_transport, industry_code, serves_industry, servable_industries
+from spatial_index import SpatialIndex
+from text_features import TEXT_HASH_FEATURES
+
+logger = logging.getLogger(__name__)
+
+# Producer purity assumed when a record has none (matches calculate_quality_match)
+DEFAULT_PURITY = 90.0
+
+def _number(value, default: float = 0.0) -> float:
+    if isinstance(value, (int, float)):
+        return float(value)
+    return default
+
+# Columns read by score_columns, in the order EntityColumns.scoring_arrays() returns them
+SCORING_COLUMNS = ('capacity', 'purity', 'lat', 'lon', 'has_location', 'industry', 'transport', 'servable',
+                   'vectors', 'has_vector', 'has_text', 'text_data', 'text_indices', 'text_indptr')
+
+class EntityColumns:
+    """Struct-of-arrays view of one side of the marketplace
+
+    Scoring reads only the compact numeric columns. The original records are
+    kept as compact JSON and decoded only for the matches that are returned.
+
+    Columns are not changed once readers can see them: the store extends a
+    copy() instead. The copy shares the append-only ids, index and records,
+    so rows past len(self) are ignored here, and every array is rebound
+    rather than written.
+    """
+
+    def __init__(self, kind: str, records: List[Dict], vector_engine):
+        self.kind = kind
+        self.ids: List[str] = []
+        self.index: Dict[str, int] = {}
+        self._records: List[str] = []
+        # Rows of entities registered by a signed-in user, and that user's id
+        self.owners: Dict[int, str] = {}
+        self.capacity = np.empty(0, dtype=np.float32)
+        self.purity = np.empty(0, dtype=np.float32)
+        self.lat = np.empty(0, dtype=np.float32)
+        self.lon = np.empty(0, dtype=np.float32)
+        self.has_location = np.empty(0, dtype=bool)
+        self.industry = np.empty(0, dtype=np.uint8)
+        self.transport = np.empty(0, dtype=np.uint8)
+        # Consumer industries each producer's purity can serve (bitmask over consumer_industries)
+        self.servable = np.empty(0, dtype=np.uint8) if kind == 'producer' else None
+
+        self.vectors = None
+        self.has_vector = None
+        self.vector_version = None
+        # Similarity index over `vectors`, built on the first similar() call
+        self.ann: Optional[IVFIndex] = None
+        # TF-IDF rows of additional_info: per-row (indices, values) or None, and the same rows as CSR
+        self._text_rows: List[Optional[Tuple[np.ndarray, np.ndarray]]] = []
+        self.text = sparse.csr_matrix((0, TEXT_HASH_FEATURES), dtype=np.float32)
+        self.has_text = np.empty(0, dtype=bool)
+        self.extend(records, vector_engine)
+
+    def extend(self, records: List[Dict], vector_engine) -> np.ndarray:
+        """Append records as new rows and return their row indices
+
+        Vectors are re-gathered on the next sync.
+        """
+        is_producer = self.kind == 'producer'
+        industries = vector_engine.producer_industries if is_producer else vector_engine.consumer_industries
+        industry_field = 'industry_type' if is_producer else 'industry'
+        capacity_field = 'co2_supply_tonnes_per_week' if is_producer else 'co2_demand_tonnes_per_week'
+
+        start = len(self.ids)
+        capacity, purity, lat, lon, has_location, industry, transport = [], [], [], [], [], [], []
+        for record in records:
+            entity_id = record.get('id')
+            if not entity_id:
+                continue
+            location = record.get('location') or {}
+            if not isinstance(location, dict):
+                location = {}
+            if record.get('owner_id'):
+                self.owners[len(self.ids)] = record['owner_id']
+            self.index[entity_id] = len(self.ids)
+            self.ids.append(entity_id)
+            self._records.append(json.dumps(record, separators=(',', ':')))
+            capacity.append(_number(record.get(capacity_field, 0)))
+            purity.append(_number(record.get('co2_purity', DEFAULT_PURITY), DEFAULT_PURITY))
+            has_location.append(bool(location))
+            lat.append(_number(location.get('lat', 0)))
+            lon.append(_number(location.get('lon', 0)))
+            if is_producer:
+                industry.append(industries.get(record.get(industry_field, 'Other'), 7))
+            else:
+                industry.append(industry_code(record.get(industry_field, 'Other')))
+            methods = record.get('transportation_methods', [])
+            transport.append(encode_transport(methods) if isinstance(methods, list) else 0)
+
+        self.capacity = np.concatenate([self.capacity, np.array(capacity, dtype=np.float32)])
+        self.purity = np.concatenate([self.purity, np.array(purity, dtype=np.float32)])
+        self.lat = np.concatenate([self.lat, np.array(lat, dtype=np.float32)])
+        self.lon = np.concatenate([self.lon, np.array(lon, dtype=np.float32)])
+        self.has_location = np.concatenate([self.has_location, np.array(has_location, dtype=bool)])
+        self.industry = np.concatenate([self.industry, np.array(industry, dtype=np.uint8)])
+        self.transport = np.concatenate([self.transport, np.array(transport, dtype=np.uint8)])
+        if is_producer:
+            self.servable = np.concatenate([self.servable, servable_industries(purity).astype(np.uint8)])
+        if self.vectors is not None:
+            # New rows start without vectors until gather_vectors fills them
+            added = len(self.ids) - start
+            self.vectors = np.concatenate([self.vectors, np.zeros((added, self.vectors.shape[1]), dtype=np.float32)])
+            self.has_vector = np.concatenate([self.has_vector, np.zeros(added, dtype=bool)])
+        # New rows start without text until gather_text fills them
+        self._text_rows.extend([None] * (len(self.ids) - start))
+        self._rebuild_text(start)
+        return np.arange(start, len(self.ids))
+
+    def copy(self, vectors: bool = False) -> 'EntityColumns':
+        """Columns to extend while readers keep using these (with `vectors`, rows can also be re-gathered)"""
+        columns = copy.copy(self)
+        # Readers iterate the owned rows, so they get a new dict
+        columns.owners = dict(self.owners)
+        if vectors:
+            columns.vectors, columns.has_vector = self.vectors.copy(), self.has_vector.copy()
+        return columns
+
+    @classmethod
+    def from_arrays(cls, kind: str, arrays: Dict[str, np.ndarray]) -> 'EntityColumns':
+        """Scoring-only columns over existing arrays (see scoring_arrays); no ids or records"""
+        columns = cls.__new__(cls)
+        columns.kind = kind
+        columns.ids, columns.index, columns._records, columns.owners = [], {}, [], {}
+        for name in SCORING_COLUMNS[:-3]:
+            setattr(columns, name, arrays.get(name))
+        columns.text = sparse.csr_matrix((arrays['text_data'], arrays['text_indices'], arrays['text_indptr']),
+                                         shape=(len(arrays['capacity']), TEXT_HASH_FEATURES), copy=False)
+        return columns
+
+    def __len__(self) -> int:
+        return len(self.capacity)
+
+    def scoring_arrays(self) -> Dict[str, np.ndarray]:
+        """The arrays behind take(), by SCORING_COLUMNS name (servable is absent for consumers)"""
+        arrays = {name: getattr(self, name) for name in SCORING_COLUMNS[:-3] if getattr(self, name) is not None}
+        arrays.update(text_data=self.text.data, text_indices=self.text.indices, text_indptr=self.text.indptr)
+        return arrays
+
+    def attach_vectors(self, vectors: Dict[str, np.ndarray], size: int, version: int):
+        """Gather unit-normalized vectors in column order (zero rows where missing)"""
+        matrix = np.zeros((len(self.ids), size), dtype=np.float32)
+        has_vector = np.zeros(len(self.ids), dtype=bool)
+        for i, entity_id in enumerate(self.ids):
+            vector = vectors.get(entity_id)
+            if vector is not None:
+                matrix[i, :len(vector)] = vector
+                has_vector[i] = True
+        norms = np.linalg.norm(matrix, axis=1)
+        nonzero = norms > 0
+        matrix[nonzero] /= norms[nonzero, None]
+        self.vectors = matrix
+        self.has_vector = has_vector & nonzero
+        self.vector_version = version
+
+    def gather_vectors(self, vectors: Dict[str, np.ndarray], rows):
+        """Copy unit-normalized vectors for a few rows (rows without one are cleared)"""
+        for row in rows:
+            vector = vectors.get(self.ids[row])
+            vector = np.zeros(0, dtype=np.float32) if vector is None else np.asarray(vector, dtype=np.float32)
+            norm = np.linalg.norm(vector)
+            self.vectors[row] = 0
+            if norm > 0:
+                self.vectors[row, :len(vector)] = vector / norm
+            self.has_vector[row] = norm > 0
+
+    def attach_text(self, text: Dict[str, Tuple[np.ndarray, np.ndarray]]):
+        """Gather TF-IDF rows in column order"""
+        self._text_rows = [text.get(entity_id) for entity_id in self.ids]
+        self._rebuild_text(0)
+
+    def gather_text(self, text: Dict[str, Tuple[np.ndarray, np.ndarray]], rows):
+        """Copy TF-IDF rows for a few rows (rows without text are cleared)"""
+        rows = list(rows)
+        if not rows:
+            return
+        for row in rows:
+            self._text_rows[row] = text.get(self.ids[row])
+        self._rebuild_text(min(rows))
+
+    def _rebuild_text(self, first: int):
+        """Rewrite the CSR rows from `first` on; new entities are appended, so this is usually a short tail"""
+        text = self.text
+        cut = text.indptr[first] if first < len(text.indptr) else text.nnz
+        tail = [row if row is not None else (np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32))
+                for row in self._text_rows[first:]]
+        lengths = np.array([len(row[0]) for row in tail], dtype=np.int64)
+        indptr = np.concatenate([text.indptr[:first + 1].astype(np.int64), cut + np.cumsum(lengths)])
+        indices = np.concatenate([text.indices[:cut]] + [row[0] for row in tail]).astype(np.int32)
+        data = np.concatenate([text.data[:cut]] + [row[1] for row in tail]).astype(np.float32)
+        self.text = sparse.csr_matrix((data, indices, indptr), shape=(len(self._text_rows), TEXT_HASH_FEATURES))
+        self.has_text = np.diff(indptr) > 0
+
+    def take(self, rows) -> Dict[str, np.ndarray]:
+        """Columns for the given row indices, as float64 for scoring"""
+        return {
+            'capacity': self.capacity[rows].astype(np.float64),
+            'purity': self.purity[rows].astype(np.float64),
+            'lat': self.lat[rows].astype(np.float64),
+            'lon': self.lon[rows].astype(np.float64),
+            'has_location': self.has_location[rows],
+            'industry': self.industry[rows],
+            'transport': self.transport[rows],
+            'servable': self.servable[rows] if self.servable is not None else None,
+            'vectors': self.vectors[rows],
+            'has_vector': self.has_vector[rows],
+            'text': self.text[np.atleast_1d(rows)],
+            'has_text': self.has_text[rows]
+        }
+
+    def similar(self, row: int, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Rows with the most similar vectors to `row` and their cosine scores
+
+        Rows whose vectors appeared since the last call are inserted into the
+        index first. Copies share the index, so it may hold rows past these
+        columns; those are left out.
+        """
+        if self.ann is None:
+            self.ann = IVFIndex(self.vectors.shape[1])
+        pending = np.flatnonzero(self.has_vector)
+        pending = pending[~self.ann.contains(pending)]
+        if len(pending):
+            self.ann.add(pending, self.vectors[pending])
+
+        if not self.has_vector[row]:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        rows, scores = self.ann.search(self.vectors[row], k, exclude=row)
+        keep = rows < len(self)
+        return rows[keep], scores[keep]
+
+    def record(self, row: int) -> Dict:
+        """Materialize the full record for one row"""
+        return json.loads(self._records[row])
+
+    def find(self, entity_id: str) -> Optional[int]:
+        row = self.index.get(entity_id)
+        return row if row is not None and row < len(self) else None
+
+class ViabilityIndex:
+    """Sorted capacity indexes behind the supply/purity viability filters
+
+    Consumers are bucketed by industry code and sorted by weekly demand.
+    Producers are bucketed by each consumer industry their purity can serve
+    and sorted by weekly supply. A query binary-searches only the buckets it
+    is compatible with. Rows are inserted into the sorted buckets as they
+    are added, so the index never has to be re-sorted. Inserts replace the
+    bucket arrays, so a copy() can be updated while readers use the original.
+    """
+
+    def __init__(self, producers: EntityColumns, consumers: EntityColumns):
+        self._consumer_demand = [np.empty(0, dtype=np.float32) for _ in range(len(REQUIRED_PURITY))]
+        self._consumer_rows = [np.empty(0, dtype=np.int64) for _ in range(len(REQUIRED_PURITY))]
+        self._producer_supply = [np.empty(0, dtype=np.float32) for _ in range(len(REQUIRED_PURITY))]
+        self._producer_rows = [np.empty(0, dtype=np.int64) for _ in range(len(REQUIRED_PURITY))]
+        self.add_producers(producers, np.arange(len(producers)))
+        self.add_consumers(consumers, np.arange(len(consumers)))
+
+    def copy(self) -> 'ViabilityIndex':
+        index = copy.copy(self)
+        index._consumer_demand, index._consumer_rows = list(self._consumer_demand), list(self._consumer_rows)
+        index._producer_supply, index._producer_rows = list(self._producer_supply), list(self._producer_rows)
+        return index
+
+    @staticmethod
+    def _insert(keys: List[np.ndarray], rows: List[np.ndarray], bucket: int,
+                new_keys: np.ndarray, new_rows: np.ndarray):
+        order = np.argsort(new_keys, kind='stable')
+        new_keys, new_rows = new_keys[order], new_rows[order]
+        positions = np.searchsorted(keys[bucket], new_keys, side='right')
+        keys[bucket] = np.insert(keys[bucket], positions, new_keys)
+        rows[bucket] = np.insert(rows[bucket], positions, new_rows)
+
+    def add_producers(self, producers: EntityColumns, rows: np.ndarray):
+        for code in range(len(REQUIRED_PURITY)):
+            selected = rows[serves_industry(producers.servable[rows], code) == 1]
+            if len(selected):
+                self._insert(self._producer_supply, self._producer_rows, code,
+                             producers.capacity[selected], selected)
+
+    def add_consumers(self, consumers: EntityColumns, rows: np.ndarray):
+        for code in range(len(REQUIRED_PURITY)):
+            selected = rows[consumers.industry[rows] == code]
+            if len(selected):
+                self._insert(self._consumer_demand, self._consumer_rows, code,
+                             consumers.capacity[selected], selected)
+
+    def consumers_for(self, supply: float, servable: int) -> np.ndarray:
+        """Consumer rows with demand <= supply in an industry the producer can serve"""
+        parts = []
+        for code in range(len(REQUIRED_PURITY)):
+            if (servable >> code) & 1:
+                end = np.searchsorted(self._consumer_demand[code], supply, side='right')
+                parts.append(self._consumer_rows[code][:end])
+        return np.sort(np.concatenate(parts)) if parts else np.empty(0, dtype=np.int64)
+
+    def producers_for(self, demand: float, industry: int) -> np.ndarray:
+        """Producer rows with supply >= demand and purity meeting the industry requirement"""
+        start = np.searchsorted(self._producer_supply[industry], demand, side='left')
+        return np.sort(self._producer_rows[industry][start:])
+
+    def producers_below(self, demand: float, industry: int) -> np.ndarray:
+        """Producer rows with 0 < supply < demand and purity meeting the industry requirement (pool members)"""
+        supply = self._producer_supply[industry]
+        start, end = np.searchsorted(supply, 0, side='right'), np.searchsorted(supply, demand, side='left')
+        return np.sort(self._producer_rows[industry][start:end])
+
+class EntityStore:
+    """Columnar producers and consumers built from one database snapshot
+
+    A store is not changed once it is shared. add(), refresh_vectors() and
+    sync_vectors() return an updated copy for the owner to publish in its
+    place, so a reader that took the store once sees consistent rows for
+    the whole request.
+    """
+
+    def __init__(self, db: Dict, vector_engine, signature=None):
+        self.signature = signature
+        # Bumped on every copy, so derived caches can tell they are stale
+        self.generation = 0
+        # Shared by a store and all of its copies
+        self.lineage = object()
+        # (kind, rows, generation) of the latest add(), for caches that can be updated instead of dropped
+        self.last_added = None
+        self.producers = EntityColumns('producer', db.get('producers', []), vector_engine)
+        self.consumers = EntityColumns('consumer', db.get('consumers', []), vector_engine)
+        self.viability = ViabilityIndex(self.producers, self.consumers)
+        self.spatial = SpatialIndex(self.producers, self.consumers)
+        self._search = None
+        self._search_lock = threading.Lock()
+        self._attach_vectors(vector_engine)
+        logger.info(f"Built entity store with {len(self.producers)} producers and {len(self.consumers)} consumers")
+
+    def _copy(self, vectors: bool = False) -> 'EntityStore':
+        store = copy.copy(self)
+        store.generation = self.generation + 1
+        store.producers = self.producers.copy(vectors)
+        store.consumers = self.consumers.copy(vectors)
+        store.viability = self.viability.copy()
+        store.spatial = self.spatial.copy(store.producers, store.consumers)
+        # The search index is shared; rows past a store's columns are skipped by its readers
+        with self._search_lock:
+            store._search = self._search
+        store._search_lock = threading.Lock()
+        return store
+
+    def add(self, kind: str, records: List[Dict], vector_engine) -> 'EntityStore':
+        """A copy with new producers or consumers appended, without rebuilding the store"""
+        store = self._copy()
+        if kind == 'producer':
+            rows = store.producers.extend(records, vector_engine)
+            store.viability.add_producers(store.producers, rows)
+            store.spatial.add_producers(store.producers, rows)
+            store.producers.gather_vectors(vector_engine.producer_vectors, rows)
+            store.producers.gather_text(vector_engine.producer_text, rows)
+        else:
+            rows = store.consumers.extend(records, vector_engine)
+            store.viability.add_consumers(store.consumers, rows)
+            store.spatial.add_consumers(store.consumers, rows)
+            store.consumers.gather_vectors(vector_engine.consumer_vectors, rows)
+            store.consumers.gather_text(vector_engine.consumer_text, rows)
+        with store._search_lock:
+            if store._search is not None:
+                store._search.add(kind, rows, records)
+        store.last_added = (kind, rows, store.generation)
+        return store
+
+    def search_index(self) -> SearchIndex:
+        """Full-text index over both sides, built on first use and kept current by add()"""
+        with self._search_lock:
+            if self._search is None:
+                index = SearchIndex()
+                for columns in (self.producers, self.consumers):
+                    index.add(columns.kind, range(len(columns)), (columns.record(row) for row in range(len(columns))))
+                self._search = index
+                logger.info(f"Built search index over {len(index)} entities")
+            return self._search
+
+    def refresh_vectors(self, kind: str, ids: List[str], vector_engine) -> 'EntityStore':
+        """A copy with vectors re-gathered for specific entities after the engine added them"""
+        store = self._copy(vectors=True)
+        columns = store.producers if kind == 'producer' else store.consumers
+        vectors = vector_engine.producer_vectors if kind == 'producer' else vector_engine.consumer_vectors
+        rows = [row for row in (columns.find(entity_id) for entity_id in ids) if row is not None]
+        columns.gather_vectors(vectors, rows)
+        columns.gather_text(vector_engine.producer_text if kind == 'producer' else vector_engine.consumer_text, rows)
+        return store
+
+    def sync_vectors(self, vector_engine) -> 'EntityStore':
+        """This store, or a copy with vectors re-gathered if the vector engine has changed since the last sync"""
+        version = vector_engine.version
+        if self.producers.vector_version == version and self.consumers.vector_version == version:
+            return self
+        store = self._copy()
+        store._attach_vectors(vector_engine)
+        return store
+
+    def _attach_vectors(self, vector_engine):
+        version = vector_engine.version
+        self.producers.attach_vectors(vector_engine.producer_vectors, vector_engine.PRODUCER_VECTOR_SIZE, version)
+        self.consumers.attach_vectors(vector_engine.consumer_vectors, vector_engine.PRODUCER_VECTOR_SIZE, version)
+        self.producers.attach_text(vector_engine.producer_text)
+        self.consumers.attach_text(vector_engine.consumer_text)
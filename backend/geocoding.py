@@ -0,0 +1,306 @@
+"""Address geocoding with a persistent cache and a shared rate budget
+
+Addresses are normalized (case and whitespace) before lookup. Resolved
+addresses, and addresses the geocoder definitively could not find, are
+appended to `<DATABASE_FILE>.geocode` (or `GEOCODE_CACHE_FILE`). The file is
+shared by all workers and survives restarts. Calls to the geocoder are
+spaced `1 / GEOCODE_RATE_PER_SEC` seconds apart across all workers, through
+a timestamp kept under a file lock. Batches resolve uncached addresses on
+`GEOCODE_CONCURRENCY` threads, so a batch of N addresses takes about
+N / rate seconds instead of N round trips.
+
+`AsyncGeocoder` is the event-loop counterpart used by the ASGI server
+(`asgi.py`). It calls Nominatim's search API over a shared, pooled
+`httpx.AsyncClient` with the same cache and rate budget, so a waiting lookup
+holds a coroutine instead of a thread.
+"""
+
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import AsyncIterator, Dict, Iterator, List, Optional
+
+import changelog
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Nominatim's usage policy allows one request per second
+GEOCODE_RATE_PER_SEC = float(os.getenv('GEOCODE_RATE_PER_SEC', '1'))
+GEOCODE_CONCURRENCY = int(os.getenv('GEOCODE_CONCURRENCY', '4'))
+MAX_GEOCODE_BATCH = int(os.getenv('MAX_GEOCODE_BATCH', '5000'))
+NOMINATIM_DOMAIN = os.getenv('NOMINATIM_DOMAIN', 'nominatim.openstreetmap.org')
+NOMINATIM_SCHEME = os.getenv('NOMINATIM_SCHEME', 'https')
+NOMINATIM_USER_AGENT = 'carbon_marketplace_hackathon'
+NOMINATIM_TIMEOUT_SECS = 10.0
+
+NOT_FOUND_ERROR = "Could not find coordinates for the address."
+
+def normalize_address(address: str) -> str:
+    """Cache and coalescing key for an address: lowercase with single spaces"""
+    return ' '.join(address.split()).lower()
+
+def cache_file() -> str:
+    return os.getenv('GEOCODE_CACHE_FILE') or changelog.database_file() + '.geocode'
+
+def batch_error(addresses) -> Optional[str]:
+    """Why a batch request body's `addresses` cannot be geocoded, or None if it can"""
+    if not isinstance(addresses, list) or not addresses or not all(isinstance(a, str) and a.strip() for a in addresses):
+        return "addresses must be a non-empty list of address strings"
+    if len(addresses) > MAX_GEOCODE_BATCH:
+        return f"At most {MAX_GEOCODE_BATCH} addresses per batch"
+    return None
+
+class GeocodeCache:
+    """Append-only JSON-lines cache of geocoded addresses, shared by all workers
+
+    Each line is {"address": <normalized>, "lat": ..., "lon": ...}, with null
+    coordinates for addresses that were not found. A worker re-reads only the
+    lines appended since it last looked.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or cache_file()
+        self._entries: Dict[str, Dict] = {}
+        self._offset = 0
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        try:
+            if os.path.getsize(self.path) == self._offset:
+                return
+            with open(self.path, 'rb') as f:
+                f.seek(self._offset)
+                data = f.read()
+        except OSError:
+            return
+        complete = data[:data.rfind(b'\n') + 1]
+        for line in complete.splitlines():
+            if line:
+                entry = json.loads(line)
+                self._entries[entry['address']] = entry
+        self._offset += len(complete)
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            self._refresh()
+            return self._entries.get(key)
+
+    def put(self, key: str, lat: Optional[float], lon: Optional[float]) -> Dict:
+        entry = {'address': key, 'lat': lat, 'lon': lon}
+        with open(self.path, 'ab') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.write(json.dumps(entry, separators=(',', ':')).encode('utf-8') + b'\n')
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        with self._lock:
+            self._entries[key] = entry
+        return entry
+
+class RateLimiter:
+    """Space calls at least `1 / rate` seconds apart across all worker processes"""
+
+    def __init__(self, path: str, rate: float = GEOCODE_RATE_PER_SEC):
+        self.path = path
+        self.rate = rate
+
+    def wait(self):
+        time.sleep(self.reserve())
+
+    def reserve(self) -> float:
+        """Claim the next free slot; returns the seconds to wait for it"""
+        if self.rate <= 0:
+            return 0.0
+        with open(self.path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                last = float(f.read() or 0)
+                now = time.time()
+                slot = max(now, last + 1.0 / self.rate)
+                f.seek(0)
+                f.truncate()
+                f.write(repr(slot))
+                # Written before the lock is released, or the next worker reads a stale slot
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        return max(0.0, slot - now)
+
+class Geocoder:
+    """Cached, rate-limited and coalesced address lookups on top of a geopy geocoder"""
+
+    def __init__(self, geolocator, flights, cache: Optional[GeocodeCache] = None,
+                 limiter: Optional[RateLimiter] = None):
+        self.geolocator = geolocator
+        self.flights = flights
+        self.cache = cache or GeocodeCache()
+        self.limiter = limiter or RateLimiter(self.cache.path + '.rate')
+
+    def _lookup(self, key: str, address: str) -> Dict:
+        self.limiter.wait()
+        location = self.geolocator.geocode(address)
+        if location is None:
+            return self.cache.put(key, None, None)
+        return self.cache.put(key, location.latitude, location.longitude)
+
+    def resolve(self, address: str) -> Dict:
+        """Cache entry for one address, geocoding it if needed; `source` is "cache" or "geocoder"
+
+        Geocoder errors propagate and are not cached.
+        """
+        key = normalize_address(address)
+        entry = self.cache.get(key)
+        if entry is not None:
+            return dict(entry, source='cache')
+        entry = self.flights.do(key, self._lookup, key, address)
+        return dict(entry, source='geocoder')
+
+    def resolve_batch(self, addresses: List[str]) -> Iterator[Dict]:
+        """Yield one result per input address, in the order they resolve
+
+        Duplicate addresses (after normalization) are looked up once. Cached
+        addresses are yielded first, then the rest as the worker threads
+        finish them.
+        """
+        groups = _group(addresses)
+        pending = []
+        for key, indices in groups.items():
+            entry = self.cache.get(key)
+            if entry is None:
+                pending.append(key)
+            else:
+                yield from _results(addresses, indices, dict(entry, source='cache'))
+        if not pending:
+            return
+
+        pool = ThreadPoolExecutor(max_workers=GEOCODE_CONCURRENCY, thread_name_prefix='geocode')
+        try:
+            futures = {pool.submit(self.resolve, addresses[groups[key][0]]): key for key in pending}
+            for future in as_completed(futures):
+                indices = groups[futures[future]]
+                try:
+                    entry = future.result()
+                except Exception as e:
+                    logger.warning(f"Geocoding failed for {addresses[indices[0]]!r}: {e}")
+                    entry = {'error': "Geocoding service failed.", 'source': 'geocoder'}
+                yield from _results(addresses, indices, entry)
+        finally:
+            # Stop queued lookups if the client went away mid-stream
+            pool.shutdown(wait=False, cancel_futures=True)
+
+class AsyncGeocoder:
+    """Cached, rate-limited and coalesced lookups on an event loop, over a pooled httpx.AsyncClient
+
+    A lookup that every waiting request has abandoned is cancelled.
+    """
+
+    def __init__(self, client, cache: Optional[GeocodeCache] = None, limiter: Optional[RateLimiter] = None):
+        self.client = client
+        self.cache = cache or GeocodeCache()
+        self.limiter = limiter or RateLimiter(self.cache.path + '.rate')
+        # Normalized address -> in-flight lookup and the number of requests waiting for it
+        self._flights: Dict[str, Dict] = {}
+
+    async def _lookup(self, key: str, address: str) -> Dict:
+        # The cache and rate-limiter files are locked with flock, so their IO stays off the event loop
+        await asyncio.sleep(await asyncio.to_thread(self.limiter.reserve))
+        response = await self.client.get(
+            f"{NOMINATIM_SCHEME}://{NOMINATIM_DOMAIN}/search",
+            params={'q': address, 'format': 'json', 'limit': 1},
+            headers={'User-Agent': NOMINATIM_USER_AGENT},
+            timeout=NOMINATIM_TIMEOUT_SECS
+        )
+        response.raise_for_status()
+        places = response.json()
+        if not places:
+            return await asyncio.to_thread(self.cache.put, key, None, None)
+        return await asyncio.to_thread(self.cache.put, key, float(places[0]['lat']), float(places[0]['lon']))
+
+    async def resolve(self, address: str) -> Dict:
+        """Same contract as Geocoder.resolve"""
+        key = normalize_address(address)
+        entry = await asyncio.to_thread(self.cache.get, key)
+        if entry is not None:
+            return dict(entry, source='cache')
+
+        flight = self._flights.get(key)
+        metrics.SINGLEFLIGHT_CALLS.inc(flight='geocode', role='follower' if flight else 'leader')
+        if flight is None:
+            flight = self._flights[key] = {'task': asyncio.ensure_future(self._lookup(key, address)), 'waiters': 0}
+            flight['task'].add_done_callback(lambda _: self._forget(key, flight))
+        flight['waiters'] += 1
+        try:
+            entry = await asyncio.shield(flight['task'])
+        finally:
+            flight['waiters'] -= 1
+            if flight['waiters'] == 0 and not flight['task'].done():
+                flight['task'].cancel()
+        return dict(entry, source='geocoder')
+
+    def _forget(self, key: str, flight: Dict):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    async def resolve_batch(self, addresses: List[str]) -> AsyncIterator[Dict]:
+        """Same contract as Geocoder.resolve_batch; closing the iterator cancels its pending lookups
+
+        Like the threaded batch, at most `GEOCODE_CONCURRENCY` of its lookups
+        hold or wait for a rate slot at once.
+        """
+        slots = asyncio.Semaphore(GEOCODE_CONCURRENCY)
+
+        async def resolve(address: str) -> Dict:
+            async with slots:
+                return await self.resolve(address)
+
+        groups = _group(addresses)
+        pending = {}
+        try:
+            for key, indices in groups.items():
+                entry = self.cache.get(key)
+                if entry is None:
+                    pending[asyncio.ensure_future(resolve(addresses[indices[0]]))] = key
+                else:
+                    for result in _results(addresses, indices, dict(entry, source='cache')):
+                        yield result
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    indices = groups[pending.pop(task)]
+                    try:
+                        entry = task.result()
+                    except Exception as e:
+                        logger.warning(f"Geocoding failed for {addresses[indices[0]]!r}: {e}")
+                        entry = {'error': "Geocoding service failed.", 'source': 'geocoder'}
+                    for result in _results(addresses, indices, entry):
+                        yield result
+        finally:
+            for task in pending:
+                task.cancel()
+
+def _group(addresses: List[str]) -> Dict[str, List[int]]:
+    """Input positions of each distinct normalized address, in first-seen order"""
+    groups: Dict[str, List[int]] = OrderedDict()
+    for index, address in enumerate(addresses):
+        groups.setdefault(normalize_address(address), []).append(index)
+    return groups
+
+def _results(addresses: List[str], indices: List[int], entry: Dict) -> Iterator[Dict]:
+    for index in indices:
+        result = {'index': index, 'address': addresses[index], 'source': entry['source']}
+        if 'error' in entry:
+            result['error'] = entry['error']
+        elif entry['lat'] is None:
+            result['error'] = NOT_FOUND_ERROR
+        else:
+            result.update(lat=entry['lat'], lon=entry['lon'])
+        yield result
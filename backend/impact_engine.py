@@ -0,0 +1,163 @@
+"""Vectorized financial and environmental impact model
+
+`compute_impact` evaluates the partnership model over NumPy arrays. Pair
+inputs (supply, demand, distance) and assumptions (prices, logistics
+emissions, horizon) broadcast against each other. One call can therefore
+cover every match of an entity, or every match under every scenario of a
+parameter grid.
+"""
+
+import itertools
+import os
+from typing import Dict, List
+
+import numpy as np
+
+DEFAULT_ASSUMPTIONS = {
+    'carbon_credit_price_per_tonne': float(os.getenv('CARBON_CREDIT_PRICE_PER_TONNE', '25.00')),
+    'industrial_co2_price_per_tonne': float(os.getenv('INDUSTRIAL_CO2_PRICE_PER_TONNE', '75.00')),
+    'delivery_emissions_per_100km': 0.05,   # tonnes CO2 per weekly delivery per 100 km
+    'weeks_per_year': 52,
+    'horizon_years': 1,
+    'discount_rate': 0.0                    # applied to financials over the horizon
+}
+
+# Limits on scenario sweeps (grid size, and grid size x matches)
+MAX_SCENARIOS = 10000
+MAX_SCENARIO_CELLS = 2_000_000
+
+def resolve_assumptions(overrides: Dict = None) -> Dict[str, float]:
+    """Default assumptions with validated per-request overrides"""
+    assumptions = dict(DEFAULT_ASSUMPTIONS)
+    for name, value in (overrides or {}).items():
+        if name not in DEFAULT_ASSUMPTIONS:
+            raise ValueError(f"Unknown assumption: {name}")
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError(f"Assumption {name} must be a number")
+        assumptions[name] = value
+    return assumptions
+
+def _horizon_factor(years, rate):
+    """Present value of 1 per year over `years` at `rate` (just `years` when rate is 0)"""
+    years = np.asarray(years, dtype=np.float64)
+    rate = np.asarray(rate, dtype=np.float64)
+    safe_rate = np.where(rate == 0, 1.0, rate)
+    return np.where(rate == 0, years, (1 - (1 + safe_rate) ** -years) / safe_rate)
+
+def compute_impact(supply, demand, distance_km, assumptions: Dict) -> Dict[str, np.ndarray]:
+    """Annual and horizon impact for broadcastable arrays of pairs and assumptions"""
+    weeks = assumptions['weeks_per_year']
+    tonnes_per_week = np.minimum(supply, demand)
+    tonnes_per_year = tonnes_per_week * weeks
+    producer_revenue = tonnes_per_year * assumptions['carbon_credit_price_per_tonne']
+    consumer_savings = tonnes_per_year * assumptions['industrial_co2_price_per_tonne']
+    logistics_emissions = (distance_km / 100) * assumptions['delivery_emissions_per_100km'] * weeks
+    net_co2 = tonnes_per_year - logistics_emissions
+
+    years = assumptions['horizon_years']
+    value_factor = _horizon_factor(years, assumptions['discount_rate'])
+    return {
+        'annual_tonnage': tonnes_per_year,
+        'producer_annual_revenue': producer_revenue,
+        'consumer_annual_savings': consumer_savings,
+        'estimated_logistics_emissions': logistics_emissions,
+        'net_co2_impact': net_co2,
+        'horizon_producer_revenue': producer_revenue * value_factor,
+        'horizon_consumer_savings': consumer_savings * value_factor,
+        'horizon_co2_diverted': tonnes_per_year * years,
+        'horizon_net_co2_impact': net_co2 * years
+    }
+
+def pair_columns(producers: List[Dict], consumers: List[Dict]):
+    """Supply, demand and distance arrays for aligned producer/consumer lists"""
+    supply = np.array([p['co2_supply_tonnes_per_week'] for p in producers], dtype=np.float64)
+    demand = np.array([c['co2_demand_tonnes_per_week'] for c in consumers], dtype=np.float64)
+    distance = np.array([
+        c.get('distance_km', p.get('distance_km', 0)) for p, c in zip(producers, consumers)
+    ], dtype=np.float64)
+    return supply, demand, distance
+
+def _pair_report(producer: Dict, consumer: Dict, impact: Dict, i: int) -> Dict:
+    revenue = round(float(impact['producer_annual_revenue'][i]), 2)
+    return {
+        "producer_name": producer['name'], "consumer_name": consumer['name'],
+        "annual_tonnage": round(float(impact['annual_tonnage'][i]), 2),
+        "financials": {"producer_annual_revenue": revenue,
+                       "consumer_annual_savings": round(float(impact['consumer_annual_savings'][i]), 2),
+                       "carbon_credit_value": revenue},
+        "environmental": {"co2_diverted": round(float(impact['annual_tonnage'][i]), 2),
+                          "estimated_logistics_emissions": round(float(impact['estimated_logistics_emissions'][i]), 2),
+                          "net_co2_impact": round(float(impact['net_co2_impact'][i]), 2)}
+    }
+
+def pair_report(producer: Dict, consumer: Dict, assumptions: Dict) -> Dict:
+    """Impact report for one producer/consumer pair (the /api/impact-model shape)"""
+    impact = compute_impact(*pair_columns([producer], [consumer]), assumptions)
+    return _pair_report(producer, consumer, impact, 0)
+
+def batch_report(producers: List[Dict], consumers: List[Dict], assumptions: Dict) -> Dict:
+    """Impact of many aligned pairs in one pass, with per-pair reports and totals"""
+    impact = compute_impact(*pair_columns(producers, consumers), assumptions)
+    pairs = []
+    for i, (producer, consumer) in enumerate(zip(producers, consumers)):
+        report = _pair_report(producer, consumer, impact, i)
+        report.update({
+            "producer_id": producer.get('id'), "consumer_id": consumer.get('id'),
+            "horizon": {"years": assumptions['horizon_years'],
+                        "producer_revenue": round(float(impact['horizon_producer_revenue'][i]), 2),
+                        "consumer_savings": round(float(impact['horizon_consumer_savings'][i]), 2),
+                        "net_co2_impact": round(float(impact['horizon_net_co2_impact'][i]), 2)}
+        })
+        pairs.append(report)
+    return {
+        "assumptions": assumptions,
+        "pairs": pairs,
+        "totals": {name: round(float(values.sum()), 2) for name, values in impact.items()}
+    }
+
+def scenario_sweep(producers: List[Dict], consumers: List[Dict], grid: Dict[str, List[float]],
+                   assumptions: Dict) -> Dict:
+    """Totals over all pairs for every combination of the grid's assumption values
+
+    Grid axes are broadcast against the pairs, giving a
+    (scenarios x pairs) evaluation in a single vectorized call.
+    """
+    axes = {}
+    for name, values in grid.items():
+        if name not in DEFAULT_ASSUMPTIONS:
+            raise ValueError(f"Unknown scenario axis: {name}")
+        if not isinstance(values, list) or not values:
+            raise ValueError(f"Scenario axis {name} must be a non-empty list")
+        for value in values:
+            resolve_assumptions({name: value})
+        axes[name] = np.asarray(values, dtype=np.float64)
+
+    scenarios = int(np.prod([len(v) for v in axes.values()])) if axes else 1
+    if scenarios > MAX_SCENARIOS:
+        raise ValueError(f"Grid has {scenarios} scenarios (max {MAX_SCENARIOS})")
+    if scenarios * max(1, len(producers)) > MAX_SCENARIO_CELLS:
+        raise ValueError(f"Grid x matches exceeds {MAX_SCENARIO_CELLS} evaluations")
+
+    # Scenario-major mesh: one column per axis, one row per scenario
+    mesh = np.array(list(itertools.product(*axes.values())), dtype=np.float64).reshape(scenarios, len(axes))
+    swept = dict(assumptions)
+    for column, name in enumerate(axes):
+        swept[name] = mesh[:, column][:, None]
+
+    supply, demand, distance = pair_columns(producers, consumers)
+    impact = compute_impact(supply[None, :], demand[None, :], distance[None, :], swept)
+    totals = {name: np.broadcast_to(values, (scenarios, len(supply))).sum(axis=1) for name, values in impact.items()}
+
+    rows = []
+    for s in range(scenarios):
+        row = {name: float(mesh[s, column]) for column, name in enumerate(axes)}
+        row.update({name: round(float(values[s]), 2) for name, values in totals.items()})
+        rows.append(row)
+    return {
+        "assumptions": assumptions,
+        "axes": {name: values.tolist() for name, values in axes.items()},
+        "pairs": len(supply),
+        "scenarios": rows,
+        "range": {name: {"min": round(float(values.min()), 2), "max": round(float(values.max()), 2)}
+                  for name, values in totals.items()}
+    }
@@ -0,0 +1,220 @@
+"""Background jobs for heavy API operations
+
+Jobs run on a small thread pool inside each worker process. Their state is
+stored as one JSON file per job in `JOBS_DIR` (next to the database by
+default), so any gunicorn worker can answer `/api/jobs/<id>`. No broker is
+involved. Two mechanisms coordinate the workers, both built on file locks:
+
+- Identical in-flight jobs (same type and parameters) are deduplicated;
+  a second submit returns the job that is already queued or running.
+- Each job type has a concurrency limit, enforced across workers with a
+  fixed number of slot lock files. The kernel releases a slot if its
+  process dies.
+"""
+
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Dict, Optional, Tuple
+
+import changelog
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '4'))
+JOB_RETENTION_SECS = int(os.getenv('JOB_RETENTION_SECS', '3600'))
+PROGRESS_WRITE_INTERVAL = 0.5
+SLOT_POLL_INTERVAL = 0.05
+
+ACTIVE_STATUSES = ('queued', 'running')
+
+def jobs_dir() -> str:
+    return os.getenv('JOBS_DIR') or changelog.database_file() + '.jobs'
+
+def _now() -> str:
+    return datetime.utcnow().isoformat()
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+class JobRunner:
+    """Submit, run and look up file-backed background jobs"""
+
+    def __init__(self, directory: Optional[str] = None, workers: int = JOB_WORKERS):
+        self.directory = directory or jobs_dir()
+        os.makedirs(os.path.join(self.directory, 'keys'), exist_ok=True)
+        os.makedirs(os.path.join(self.directory, 'slots'), exist_ok=True)
+        self._handlers: Dict[str, Tuple[Callable, int]] = {}
+        self._local_slots: Dict[str, threading.Semaphore] = {}
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+
+    def register(self, job_type: str, func: Callable, limit: int = 1):
+        """Register `func(params, progress)` for a job type
+
+        At most `limit` jobs of this type run at once across all workers.
+        `progress(done, total, message='')` reports progress.
+        """
+        self._handlers[job_type] = (func, limit)
+        self._local_slots[job_type] = threading.Semaphore(limit)
+
+    # --- Storage ---
+
+    def _path(self, job_id: str) -> str:
+        return os.path.join(self.directory, f'{job_id}.json')
+
+    def _key_path(self, key: str) -> str:
+        return os.path.join(self.directory, 'keys', key)
+
+    def _write(self, job: Dict):
+        tmp = self._path(job['id']) + f'.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(job, f)
+        os.replace(tmp, self._path(job['id']))
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """Current state of a job, or None if it is unknown or expired"""
+        if not job_id or os.path.basename(job_id) != job_id:
+            return None
+        try:
+            with open(self._path(job_id)) as f:
+                job = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if job['status'] in ACTIVE_STATUSES and not _process_alive(job['pid']):
+            job.update(status='failed', error='Worker process exited before the job finished', finished_at=_now())
+        return job
+
+    @contextmanager
+    def _locked(self):
+        with open(os.path.join(self.directory, '.lock'), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _expire_old_jobs(self):
+        cutoff = time.time() - JOB_RETENTION_SECS
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith('.json') and os.path.getmtime(path) < cutoff:
+                job = self.get(name[:-len('.json')])
+                if job is None or job['status'] not in ACTIVE_STATUSES:
+                    os.remove(path)
+
+    # --- Submission and execution ---
+
+    @staticmethod
+    def dedup_key(job_type: str, params: Dict) -> str:
+        canonical = json.dumps({'type': job_type, 'params': params}, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def submit(self, job_type: str, params: Dict) -> Tuple[Dict, bool]:
+        """Queue a job, or return the identical one already in flight
+
+        Returns (job, created).
+        """
+        if job_type not in self._handlers:
+            raise ValueError(f"Unknown job type: {job_type}")
+        key = self.dedup_key(job_type, params)
+
+        with self._locked():
+            try:
+                with open(self._key_path(key)) as f:
+                    existing = self.get(f.read().strip())
+            except FileNotFoundError:
+                existing = None
+            if existing is not None and existing['status'] in ACTIVE_STATUSES:
+                return existing, False
+
+            self._expire_old_jobs()
+            job = {
+                'id': uuid.uuid4().hex,
+                'type': job_type,
+                'status': 'queued',
+                'progress': {'done': 0, 'total': None, 'message': ''},
+                'result': None,
+                'error': None,
+                'created_at': _now(),
+                'started_at': None,
+                'finished_at': None,
+                'pid': os.getpid()
+            }
+            self._write(job)
+            with open(self._key_path(key), 'w') as f:
+                f.write(job['id'])
+
+        self._executor.submit(self._run, job, key, params)
+        return job, True
+
+    @contextmanager
+    def _slot(self, job_type: str, limit: int):
+        """Hold one of the type's `limit` slots across all worker processes"""
+        with self._local_slots[job_type]:
+            while True:
+                for i in range(limit):
+                    f = open(os.path.join(self.directory, 'slots', f'{job_type}.{i}'), 'a')
+                    try:
+                        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        f.close()
+                        continue
+                    try:
+                        yield
+                    finally:
+                        fcntl.flock(f, fcntl.LOCK_UN)
+                        f.close()
+                    return
+                time.sleep(SLOT_POLL_INTERVAL)
+
+    def _run(self, job: Dict, key: str, params: Dict):
+        func, limit = self._handlers[job['type']]
+        last_write = [0.0]
+
+        def progress(done: int, total: Optional[int] = None, message: str = ''):
+            job['progress'] = {'done': done, 'total': total, 'message': message}
+            now = time.monotonic()
+            if now - last_write[0] >= PROGRESS_WRITE_INTERVAL:
+                last_write[0] = now
+                self._write(job)
+
+        try:
+            with self._slot(job['type'], limit):
+                job.update(status='running', started_at=_now())
+                self._write(job)
+                result = func(params, progress)
+            job.update(status='succeeded', result=result)
+            if job['progress']['total'] is not None:
+                job['progress']['done'] = job['progress']['total']
+        except Exception as e:
+            logger.exception(f"Job {job['id']} ({job['type']}) failed")
+            job.update(status='failed', error=str(e))
+        job['finished_at'] = _now()
+
+        with self._locked():
+            self._write(job)
+            try:
+                with open(self._key_path(key)) as f:
+                    if f.read().strip() == job['id']:
+                        os.remove(self._key_path(key))
+            except FileNotFoundError:
+                pass
+
+def public_view(job: Dict) -> Dict:
+    """Job fields returned by the API"""
+    return {k: job[k] for k in ('id', 'type', 'status', 'progress', 'result', 'error',
+                                'created_at', 'started_at', 'finished_at')}
@@ -1,14 +1,136 @@
 import numpy as np
 import json
 import os
+import threading
+import time
+from collections import OrderedDict
 from typing import Dict, List, Tuple, Optional
 from geopy.distance import geodesic
 import logging
 
+import changelog
+import metrics
+from compatibility import (
+    encode_transport, preferred_transport, required_purity, serves_industry, transport_overlap
+)
+from entity_store import EntityColumns, EntityStore
+from text_features import blend
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+MAX_MATCH_DISTANCE_KM = 1000
+EARTH_RADIUS_KM = 6371.0088
+
+# Score components, in the column order of the cached component matrix, and the weight for each
+COMPONENTS = ('vector_similarity', 'capacity_fit', 'distance_score', 'quality_match', 'transport_compatibility')
+COMPONENT_WEIGHTS = ('vector_similarity', 'capacity_compatibility', 'distance_penalty', 'quality_match',
+                     'transport_compatibility')
+# Entities whose viable candidates and component scores are kept for re-ranking
+MATCH_CACHE_SIZE = int(os.getenv('MATCH_CACHE_SIZE', '256'))
+# Deadline-aware scoring: candidates scored between deadline checks, and the distance rings (km)
+# they are scored in, nearest first (the last ring must reach MAX_MATCH_DISTANCE_KM)
+ANYTIME_CHUNK = 8192
+ANYTIME_RINGS_KM = (50, 150, 400, MAX_MATCH_DISTANCE_KM)
+
+def haversine_km(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """Vectorized great-circle distance in kilometers"""
+    lat1, lon1, lat2, lon2 = (np.radians(x) for x in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(1.0, a)))
+
+def _row_dot(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    if len(a) == 1:
+        return b @ a[0]
+    if len(b) == 1:
+        return a @ b[0]
+    return np.einsum('ij,ij->i', a, b)
+
+def _sparse_row_dot(a, b) -> np.ndarray:
+    """_row_dot for CSR rows: one row is densified and multiplied against the other side's matrix"""
+    if a.shape[0] == 1:
+        return b @ a.toarray()[0]
+    if b.shape[0] == 1:
+        return a @ b.toarray()[0]
+    return np.asarray(a.multiply(b).sum(axis=1)).ravel()
+
+def capacity_fit(supply, demand) -> np.ndarray:
+    """Capacity fit: prefer 30-80% utilization, zero if demand cannot be met"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = demand / supply
+    capacity = np.where(
+        (ratio >= 0.3) & (ratio <= 0.8), 1.0,
+        np.where(ratio > 0.8, 0.8 + (1.0 - ratio) * 0.2, ratio / 0.3 * 0.8)
+    )
+    return np.where((supply == 0) | (demand == 0) | (supply < demand), 0.0, capacity)
+
+def rank_positions(overall: np.ndarray, limit: int) -> np.ndarray:
+    """Positions of the top `limit` scores in rank order
+
+    Scores are compared rounded to three decimals (as reported). Ties keep
+    candidate order, as a stable sort would.
+    """
+    rounded = np.rint(overall * 1000).astype(np.int64)
+    keys = -rounded * (len(overall) + 1) + np.arange(len(overall))
+    k = min(limit, len(overall))
+    top = np.argpartition(keys, k - 1)[:k] if k < len(overall) else np.arange(len(overall))
+    return top[np.argsort(keys[top])]
+
+def score_columns(producers: Dict[str, np.ndarray], consumers: Dict[str, np.ndarray], weights: Dict,
+                  max_reasonable_distance: float = 500, distance_penalty_factor: float = 2.0) -> Dict[str, np.ndarray]:
+    """Score producer/consumer pairs given as columns (see EntityColumns.take)
+
+    Either side may hold a single row, which is broadcast against the other.
+    Mirrors calculate_comprehensive_score and is_viable_match, with
+    great-circle (haversine) distances in place of geodesics.
+    """
+    supply = producers['capacity']
+    demand = consumers['capacity']
+    located = producers['has_location'] & consumers['has_location']
+    distance = np.where(
+        located, haversine_km(producers['lat'], producers['lon'], consumers['lat'], consumers['lon']), 0.0
+    )
+    distance = np.broadcast_to(distance, np.broadcast(supply, demand).shape)
+
+    capacity = capacity_fit(supply, demand)
+
+    distance_score = np.where(
+        located, np.clip(np.exp(-distance / max_reasonable_distance * distance_penalty_factor), 0.0, 1.0), 0.0
+    )
+
+    quality = serves_industry(producers['servable'], consumers['industry']).astype(np.float64)
+
+    methods = producers['transport']
+    overlap = transport_overlap(methods, preferred_transport(distance))
+    transport = np.where((methods == 0) | ~located, 0.5, overlap)
+
+    vector = np.maximum(0.0, _row_dot(producers['vectors'], consumers['vectors']).astype(np.float64))
+    vector = np.where(producers['has_vector'] & consumers['has_vector'], vector, 0.0)
+    if producers.get('text') is not None and consumers.get('text') is not None:
+        text = _sparse_row_dot(producers['text'], consumers['text']).astype(np.float64)
+        vector = np.where(producers['has_text'] & consumers['has_text'], blend(vector, text), vector)
+
+    overall = (
+        vector * weights['vector_similarity'] +
+        capacity * weights['capacity_compatibility'] +
+        distance_score * weights['distance_penalty'] +
+        quality * weights['quality_match'] +
+        transport * weights['transport_compatibility']
+    )
+    viable = (supply >= demand) & (quality > 0) & ~(located & (distance > MAX_MATCH_DISTANCE_KM))
+
+    return {
+        'overall_score': overall,
+        'vector_similarity': vector,
+        'capacity_fit': capacity,
+        'distance_score': distance_score,
+        'quality_match': quality,
+        'transport_compatibility': transport,
+        'distance_km': distance,
+        'viable': viable
+    }
+
 class AdvancedMatcher:
     def __init__(self, vector_engine):
         self.vector_engine = vector_engine
@@ -26,9 +148,31 @@ class AdvancedMatcher:
         self.max_reasonable_distance = 500  # km
         self.distance_penalty_factor = 2.0
         
+        # Columnar snapshot of the database, rebuilt when the file changes; changes publish a new copy
+        self._store = None
+        self._store_lock = threading.Lock()
+        self._ann_lock = threading.Lock()
+        
+        # Position in the shared change log and the last data version applied
+        self._changes_offset = 0
+        self.data_version = 0
+        
+        # (kind, entity id) -> (store, generation, components); see match_components
+        self._component_cache = OrderedDict()
+        self._component_cache_lock = threading.Lock()
+        
+        # Owned entities' top-K lists, for match notifications (reverse_topk imports this module)
+        from reverse_topk import ReverseTopK
+        self._reverse_topk = ReverseTopK(self)
+        
+        # Region-sharded process pool, started on first use when MATCH_SHARDS is set (see sharding.py)
+        self._shards = None
+        self._shards_lock = threading.Lock()
+        
     def load_database(self) -> Dict:
         """Load the database"""
         db_file = os.getenv('DATABASE_FILE', 'database.json')
+        metrics.DB_LOADS.inc(source='matcher')
         try:
             with open(db_file, 'r') as f:
                 return json.load(f)
@@ -39,8 +183,262 @@ class AdvancedMatcher:
             logger.error(f"Invalid JSON in database file {db_file}")
             return {"producers": [], "consumers": []}
     
+    def database_signature(self) -> Tuple:
+        """Identify the current database file contents by path, mtime and size"""
+        return changelog.file_signature()
+    
+    def get_store(self) -> EntityStore:
+        """Return the columnar entity store, rebuilding it if the database changed"""
+        signature = self.database_signature()
+        
+        with self._store_lock:
+            store = self._store
+            if store is None or store.signature != signature:
+                store = EntityStore(self.load_database(), self.vector_engine, signature)
+            store = store.sync_vectors(self.vector_engine)
+            self._store = store
+        return store
+    
+    def sync_changes(self):
+        """Apply database changes logged (by any worker) since this worker last looked
+        
+        New producers and consumers get vectors and are appended to a copy of
+        the entity store, which replaces it for later queries. The store follows the log only while each entry's
+        `previous` signature matches the snapshot it was built from. Otherwise
+        it is rebuilt from the file on the next query.
+        """
+        if changelog.size() == self._changes_offset:
+            return
+        
+        with self._store_lock:
+            entries, self._changes_offset, complete = changelog.read_since(self._changes_offset, self.data_version)
+            if not complete:
+                # Fell more than one log rotation behind; rebuild the store from the file
+                self._store = None
+            for entry in entries:
+                self._apply_change(entry)
+    
+    def follow_changes_from(self, position: Tuple):
+        """Skip log entries already reflected in the loaded data (a changelog.position() taken before loading)"""
+        with self._store_lock:
+            self._changes_offset, version = position
+            self.data_version = max(self.data_version, version)
+    
+    def _apply_change(self, entry: Dict):
+        if entry.get('op') == 'checkpoint':
+            # First entry of a rotated log, carrying the version forward
+            self.data_version = max(self.data_version, entry.get('version', 0))
+            return
+        kind = entry.get('kind')
+        records = entry.get('records') or []
+        adds_entities = entry.get('op') == 'add' and kind in ('producer', 'consumer')
+        
+        added_ids = []
+        if adds_entities:
+            known = self.vector_engine.producer_vectors if kind == 'producer' else self.vector_engine.consumer_vectors
+            missing = [record for record in records if record.get('id') not in known]
+            if missing:
+                if kind == 'producer':
+                    added_ids = self.vector_engine.add_producer_vectors(missing)
+                else:
+                    added_ids = self.vector_engine.add_consumer_vectors(missing)
+        
+        store = self._store
+        if store is not None and store.signature == tuple(entry.get('previous', ())):
+            if adds_entities:
+                columns = store.producers if kind == 'producer' else store.consumers
+                new_records = [record for record in records if columns.find(record.get('id')) is None]
+                if new_records:
+                    store = store.add(kind, new_records, self.vector_engine)
+            store.signature = tuple(entry['signature'])
+        elif store is not None and added_ids:
+            # Built from a later snapshot that may already hold these rows
+            store = store.refresh_vectors(kind, added_ids, self.vector_engine)
+        self._store = store
+        
+        self.data_version = max(self.data_version, entry.get('version', 0))
+        metrics.DATA_CHANGES.inc(kind=kind)
+    
+    def shard_pool(self):
+        """The sharded scoring pool, or None when MATCH_SHARDS is 0"""
+        from sharding import MATCH_SHARDS, ShardPool
+        if MATCH_SHARDS <= 0:
+            return None
+        with self._shards_lock:
+            if self._shards is None:
+                self._shards = ShardPool(self, MATCH_SHARDS)
+            return self._shards
+    
+    @metrics.timed('score_columns')
+    def score_columns(self, producers: Dict[str, np.ndarray], consumers: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        """Vectorized comprehensive scores for columnar pairs using this matcher's weights"""
+        metrics.PAIRS_SCORED.inc(np.broadcast(producers['capacity'], consumers['capacity']).size, where='local')
+        return score_columns(producers, consumers, self.weights,
+                             self.max_reasonable_distance, self.distance_penalty_factor)
+    
+    def resolve_weights(self, overrides: Optional[Dict] = None) -> Dict[str, float]:
+        """This matcher's weights with per-request overrides, normalized to sum to 1"""
+        if not overrides:
+            return self.weights
+        weights = dict(self.weights)
+        for key, value in overrides.items():
+            if key not in weights:
+                raise ValueError(f"Unknown weight: {key}")
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or not np.isfinite(value) or value < 0:
+                raise ValueError(f"Weight {key} must be a non-negative number")
+            weights[key] = float(value)
+        total = sum(weights.values())
+        if total <= 0:
+            raise ValueError("At least one weight must be positive")
+        return {key: value / total for key, value in weights.items()}
+    
+    def match_components(self, kind: str, row: int, store: EntityStore,
+                         deadline: Optional[float] = None) -> Dict[str, np.ndarray]:
+        """Viable candidates of a producer or consumer with their five component scores
+        
+        Components do not depend on the weights, so they are cached per entity
+        and stay valid until the store changes (new rows or vectors). Any
+        weighting is then one product of the (candidates x 5) matrix with the
+        weight vector. Returns `candidates` (rows of the other side),
+        `components` and `distance_km`.
+        
+        With a `deadline` (time.monotonic() value), candidates are scored
+        nearest first in chunks, and scoring stops once the deadline passes.
+        The entry then covers only the candidates scored so far and has
+        `partial` set; partial entries are not cached.
+        
+        Large candidate sets are scored on the region shards when
+        MATCH_SHARDS is set (see sharding.py).
+        """
+        columns = store.producers if kind == 'producer' else store.consumers
+        key = (kind, columns.ids[row])
+        with self._component_cache_lock:
+            cached = self._component_cache.get(key)
+            if cached is not None and cached[0] is store and cached[1] == store.generation:
+                self._component_cache.move_to_end(key)
+                metrics.cache_hit('match_components')
+                return cached[2]
+        metrics.cache_miss('match_components')
+        
+        generation = store.generation
+        if kind == 'producer':
+            # Score only the consumers that pass the capacity and purity filters
+            candidates = store.viability.consumers_for(store.producers.capacity[row], store.producers.servable[row])
+        else:
+            # Score only producers with enough supply and purity
+            candidates = store.viability.producers_for(store.consumers.capacity[row], store.consumers.industry[row])
+        
+        pool = self.shard_pool()
+        entry = pool.components(kind, row, store, candidates, deadline) if pool is not None else None
+        if entry is not None:
+            partial = entry.get('partial', False)
+        elif deadline is None:
+            entry, partial = self._score_components(kind, row, store, candidates), False
+        else:
+            parts, partial = [], False
+            for chunk in self._nearest_first(kind, row, store, candidates):
+                if parts and time.monotonic() >= deadline:
+                    partial = True
+                    break
+                parts.append(self._score_components(kind, row, store, chunk))
+            if not parts:
+                parts.append(self._score_components(kind, row, store, candidates[:0]))
+            # Back in candidate order, so ties rank exactly as in a full scan
+            order = np.argsort(np.concatenate([part['candidates'] for part in parts]), kind='stable')
+            entry = {name: np.concatenate([part[name] for part in parts])[order]
+                     for name in ('candidates', 'components', 'distance_km')}
+        if partial:
+            metrics.PARTIAL_MATCHES.inc(kind=kind)
+            entry['partial'] = True
+            return entry
+        
+        with self._component_cache_lock:
+            self._component_cache[key] = (store, generation, entry)
+            self._component_cache.move_to_end(key)
+            while len(self._component_cache) > MATCH_CACHE_SIZE:
+                self._component_cache.popitem(last=False)
+        return entry
+    
+    def _score_components(self, kind: str, row: int, store: EntityStore, candidates: np.ndarray) -> Dict[str, np.ndarray]:
+        """Component scores of the viable pairs among these candidates"""
+        if kind == 'producer':
+            scores = self.score_columns(store.producers.take([row]), store.consumers.take(candidates))
+        else:
+            # The producer stays the first argument
+            scores = self.score_columns(store.producers.take(candidates), store.consumers.take([row]))
+        viable = np.flatnonzero(scores['viable'])
+        return {
+            'candidates': candidates[viable],
+            'components': np.column_stack([scores[name][viable] for name in COMPONENTS]),
+            'distance_km': scores['distance_km'][viable]
+        }
+    
+    def _nearest_first(self, kind: str, row: int, store: EntityStore, candidates: np.ndarray):
+        """Candidates in chunks of ANYTIME_CHUNK, in rings of growing distance from the spatial index
+        
+        Located candidates beyond the last ring are never viable and are
+        skipped; candidates without a location come last.
+        """
+        columns = store.producers if kind == 'producer' else store.consumers
+        others = store.consumers if kind == 'producer' else store.producers
+        if len(candidates) <= ANYTIME_CHUNK or not columns.has_location[row]:
+            for start in range(0, len(candidates), ANYTIME_CHUNK):
+                yield candidates[start:start + ANYTIME_CHUNK]
+            return
+        
+        wanted = np.zeros(len(others), dtype=bool)
+        wanted[candidates] = True
+        lat, lon = float(columns.lat[row]), float(columns.lon[row])
+        for radius in ANYTIME_RINGS_KM:
+            ring = store.spatial.rows_near(others.kind, lat, lon, radius)
+            ring = np.sort(ring[wanted[ring]])
+            wanted[ring] = False
+            for start in range(0, len(ring), ANYTIME_CHUNK):
+                yield ring[start:start + ANYTIME_CHUNK]
+        rest = candidates[wanted[candidates] & ~others.has_location[candidates]]
+        for start in range(0, len(rest), ANYTIME_CHUNK):
+            yield rest[start:start + ANYTIME_CHUNK]
+    
+    def _rank_components(self, columns: EntityColumns, entry: Dict[str, np.ndarray],
+                         weights: Dict, limit: int) -> Tuple[List[Dict], int]:
+        """Weight cached components and materialize the top `limit` matches"""
+        components = entry['components']
+        scores = {name: components[:, i] for i, name in enumerate(COMPONENTS)}
+        scores.update({
+            'overall_score': components @ np.array([weights[name] for name in COMPONENT_WEIGHTS]),
+            'distance_km': entry['distance_km'],
+            'viable': np.ones(len(components), dtype=bool)
+        })
+        return self._materialize_matches(columns, entry['candidates'], scores, limit)
+    
+    def _materialize_matches(self, columns: EntityColumns, candidates: np.ndarray,
+                             scores: Dict[str, np.ndarray], limit: int) -> Tuple[List[Dict], int]:
+        """Rank viable candidates and build result dicts for the top `limit` only"""
+        viable = np.flatnonzero(scores['viable'])
+        if len(viable) == 0:
+            return [], 0
+        
+        top = rank_positions(scores['overall_score'][viable], limit)
+        matches = []
+        for rank, position in enumerate(top, start=1):
+            i = viable[position]
+            match_data = columns.record(int(candidates[i]))
+            match_data.update({
+                'distance_km': round(float(scores['distance_km'][i]), 2),
+                'match_score': round(float(scores['overall_score'][i]), 3),
+                'vector_similarity': round(float(scores['vector_similarity'][i]), 3),
+                'capacity_fit': round(float(scores['capacity_fit'][i]), 3),
+                'distance_score': round(float(scores['distance_score'][i]), 3),
+                'quality_match': round(float(scores['quality_match'][i]), 3),
+                'transport_compatibility': round(float(scores['transport_compatibility'][i]), 3),
+                'rank': rank
+            })
+            matches.append(match_data)
+        return matches, len(viable)
+    
     def haversine_distance(self, lat1: float, lon1: float, lat2: float, lon2: float) -> float:
         """Calculate distance between two points using Haversine formula"""
+        metrics.GEODESIC_CALLS.inc()
         try:
             point1 = (lat1, lon1)
             point2 = (lat2, lon2)
@@ -101,24 +499,13 @@ class AdvancedMatcher:
         producer_purity = producer_data.get('co2_purity', 90)
         consumer_industry = consumer_data.get('industry', 'Other')
         
-        # Define quality requirements by industry
-        quality_requirements = {
-            'Beverage Carbonation': 98,   # Food grade - very high purity
-            'Food Processing': 99,        # Food grade - highest purity
-            'Chemical Synthesis': 95,     # Industrial - high purity
-            'Biofuel Synthesis': 90,      # Industrial - medium purity
-            'Concrete Curing': 85,        # Industrial - lower purity OK
-            'Vertical Farming': 88,       # Agricultural - medium purity
-            'Manufacturing': 85,          # Industrial - lower purity OK
-        }
-        
-        required_purity = quality_requirements.get(consumer_industry, 85)
+        required = required_purity(consumer_industry)
         
-        if producer_purity < required_purity:
+        if producer_purity < required:
             return 0.0  # Does not meet minimum requirements
         
         # Calculate bonus for exceeding requirements
-        excess_purity = producer_purity - required_purity
+        excess_purity = producer_purity - required
         max_bonus = 15  # Max 15% above requirement for full bonus
         
         if excess_purity <= 0:
@@ -129,7 +516,7 @@ class AdvancedMatcher:
     
     def calculate_transport_compatibility(self, producer_data: Dict, consumer_data: Dict) -> float:
         """Calculate transportation method compatibility"""
-        producer_methods = set(producer_data.get('transportation_methods', []))
+        producer_methods = encode_transport(producer_data.get('transportation_methods', []))
         
         if not producer_methods:
             return 0.5  # Default score if no transport info
@@ -148,21 +535,8 @@ class AdvancedMatcher:
             consumer_loc.get('lon', 0)
         )
         
-        # Preferred methods by distance
-        if distance < 50:
-            preferred = {'Truck', 'Pipeline'}
-        elif distance < 200:
-            preferred = {'Truck', 'Rail', 'Pipeline'}
-        elif distance < 500:
-            preferred = {'Rail', 'Pipeline', 'Ship'}
-        else:
-            preferred = {'Rail', 'Ship', 'Pipeline'}
-        
-        # Calculate overlap
-        overlap = len(producer_methods.intersection(preferred))
-        max_overlap = len(preferred)
-        
-        return overlap / max_overlap if max_overlap > 0 else 0.5
+        # Share of the distance band's preferred methods the producer offers
+        return float(transport_overlap(producer_methods, preferred_transport(distance)))
     
     def is_viable_match(self, producer_data: Dict, consumer_data: Dict) -> bool:
         """Check if a match is viable (basic compatibility)"""
@@ -194,8 +568,12 @@ class AdvancedMatcher:
         
         return True
     
+    @metrics.timed('calculate_comprehensive_score')
     def calculate_comprehensive_score(self, producer_data: Dict, consumer_data: Dict) -> Dict:
-        """Calculate comprehensive match score with breakdown"""
+        """Calculate comprehensive match score with breakdown
+        
+        Scores one pair, for match explanations; ranking goes through score_columns.
+        """
         # Vector similarity
         vector_sim = self.vector_engine.get_vector_similarity(
             producer_data.get('id'), 
@@ -226,140 +604,155 @@ class AdvancedMatcher:
             'transport_compatibility': transport_score
         }
     
-    def get_ranked_matches(self, producer_id: str, limit: int = 20) -> List[Dict]:
-        """Get top matches for a producer with vector-based ranking"""
-        db = self.load_database()
-        
-        # Find producer
-        producer = None
-        for p in db.get('producers', []):
-            if p.get('id') == producer_id:
-                producer = p
-                break
-        
-        if not producer:
-            logger.error(f"Producer {producer_id} not found")
-            return []
-        
-        matches = []
-        
-        # Evaluate all consumers
-        for consumer in db.get('consumers', []):
-            if self.is_viable_match(producer, consumer):
-                try:
-                    # Calculate comprehensive score
-                    score_breakdown = self.calculate_comprehensive_score(producer, consumer)
-                    
-                    # Calculate distance for display
-                    producer_loc = producer.get('location', {})
-                    consumer_loc = consumer.get('location', {})
-                    
-                    distance_km = 0
-                    if producer_loc and consumer_loc:
-                        distance_km = self.haversine_distance(
-                            producer_loc.get('lat', 0),
-                            producer_loc.get('lon', 0),
-                            consumer_loc.get('lat', 0),
-                            consumer_loc.get('lon', 0)
-                        )
-                    
-                    # Create match object
-                    match_data = consumer.copy()
-                    match_data.update({
-                        'distance_km': round(distance_km, 2),
-                        'match_score': round(score_breakdown['overall_score'], 3),
-                        'vector_similarity': round(score_breakdown['vector_similarity'], 3),
-                        'capacity_fit': round(score_breakdown['capacity_fit'], 3),
-                        'distance_score': round(score_breakdown['distance_score'], 3),
-                        'quality_match': round(score_breakdown['quality_match'], 3),
-                        'transport_compatibility': round(score_breakdown['transport_compatibility'], 3)
-                    })
-                    
-                    matches.append(match_data)
-                    
-                except Exception as e:
-                    logger.error(f"Error calculating match for consumer {consumer.get('id', 'unknown')}: {e}")
-                    continue
-        
-        # Sort by overall match score (descending)
-        matches.sort(key=lambda x: x['match_score'], reverse=True)
+    def rank_matches(self, kind: str, entity_id: str, limit: int = 20, weights: Optional[Dict] = None,
+                     deadline: Optional[float] = None) -> Tuple[List[Dict], bool]:
+        """Top matches of a producer or consumer, and whether they are partial
+        
+        With a `deadline` (time.monotonic() value), the best matches among the
+        candidates scored by then are returned and flagged partial (see
+        match_components).
+        """
+        with metrics.span('get_ranked_matches' if kind == 'producer' else 'get_ranked_matches_for_consumer'):
+            store = self.get_store()
+            columns, others = (store.producers, store.consumers) if kind == 'producer' else (store.consumers, store.producers)
+            
+            row = columns.find(entity_id)
+            if row is None:
+                logger.error(f"{kind.capitalize()} {entity_id} not found")
+                return [], False
+            
+            entry = self.match_components(kind, row, store, deadline)
+            matches, viable_count = self._rank_components(others, entry, weights or self.weights, limit)
         
-        # Add ranks
-        for i, match in enumerate(matches[:limit]):
-            match['rank'] = i + 1
+        partial = entry.get('partial', False)
+        logger.info(f"Found {viable_count} viable matches for {kind} {entity_id}" + (" (partial)" if partial else ""))
+        return matches, partial
+    
+    def get_ranked_matches(self, producer_id: str, limit: int = 20, weights: Optional[Dict] = None) -> List[Dict]:
+        """Get top matches for a producer with vector-based ranking
         
-        logger.info(f"Found {len(matches)} viable matches for producer {producer_id}")
-        return matches[:limit]
+        `weights` (see resolve_weights) re-ranks with per-request priorities.
+        """
+        return self.rank_matches('producer', producer_id, limit, weights)[0]
     
-    def get_ranked_matches_for_consumer(self, consumer_id: str, limit: int = 20) -> List[Dict]:
+    def get_ranked_matches_for_consumer(self, consumer_id: str, limit: int = 20,
+                                        weights: Optional[Dict] = None) -> List[Dict]:
         """Get top matches for a consumer with vector-based ranking"""
-        db = self.load_database()
-        
-        # Find consumer
-        consumer = None
-        for c in db.get('consumers', []):
-            if c.get('id') == consumer_id:
-                consumer = c
-                break
+        return self.rank_matches('consumer', consumer_id, limit, weights)[0]
+    
+    def get_pooled_matches(self, consumer_id: str, limit: int = 3, weights: Optional[Dict] = None) -> List[Dict]:
+        """Top groups of producers that can jointly cover a consumer's demand (see pooling.py)"""
+        from pooling import MEMBER_COMPONENTS, find_pools
         
-        if not consumer:
+        store = self.get_store()
+        row = store.consumers.find(consumer_id)
+        if row is None:
             logger.error(f"Consumer {consumer_id} not found")
             return []
         
-        matches = []
-        
-        # Evaluate all producers
-        for producer in db.get('producers', []):
-            # Note: is_viable_match and calculate_comprehensive_score are designed
-            # to work with producer as first arg and consumer as second.
-            # We need to ensure the logic correctly handles finding producers for a consumer.
-            # For now, we'll assume the existing functions can be used by swapping args.
-            # A more robust solution might involve dedicated consumer-centric scoring.
-            if self.is_viable_match(producer, consumer):
-                try:
-                    # Calculate comprehensive score
-                    score_breakdown = self.calculate_comprehensive_score(producer, consumer)
-                    
-                    # Calculate distance for display
-                    producer_loc = producer.get('location', {})
-                    consumer_loc = consumer.get('location', {})
-                    
-                    distance_km = 0
-                    if producer_loc and consumer_loc:
-                        distance_km = self.haversine_distance(
-                            producer_loc.get('lat', 0),
-                            producer_loc.get('lon', 0),
-                            consumer_loc.get('lat', 0),
-                            consumer_loc.get('lon', 0)
-                        )
-                    
-                    # Create match object (producer is the match here)
-                    match_data = producer.copy()
-                    match_data.update({
-                        'distance_km': round(distance_km, 2),
-                        'match_score': round(score_breakdown['overall_score'], 3),
-                        'vector_similarity': round(score_breakdown['vector_similarity'], 3),
-                        'capacity_fit': round(score_breakdown['capacity_fit'], 3),
-                        'distance_score': round(score_breakdown['distance_score'], 3),
-                        'quality_match': round(score_breakdown['quality_match'], 3),
-                        'transport_compatibility': round(score_breakdown['transport_compatibility'], 3)
-                    })
-                    
-                    matches.append(match_data)
-                    
-                except Exception as e:
-                    logger.error(f"Error calculating match for producer {producer.get('id', 'unknown')}: {e}")
-                    continue
-        
-        # Sort by overall match score (descending)
-        matches.sort(key=lambda x: x['match_score'], reverse=True)
-        
-        # Add ranks
-        for i, match in enumerate(matches[:limit]):
-            match['rank'] = i + 1
+        pools = []
+        for rank, pool in enumerate(find_pools(self, store, row, weights or self.weights, limit), start=1):
+            producers = []
+            for i, producer_row in enumerate(pool['members']):
+                member = store.producers.record(int(producer_row))
+                member.update({name: round(float(pool['components'][i, j]), 3) for j, name in enumerate(MEMBER_COMPONENTS)})
+                member.update({
+                    'allocated_tonnes_per_week': round(float(pool['allocated'][i]), 2),
+                    'distance_km': round(float(pool['distance_km'][i]), 2)
+                })
+                producers.append(member)
+            pools.append({
+                'producers': producers,
+                'total_supply_tonnes_per_week': round(pool['total_supply'], 2),
+                'match_score': pool['match_score'],
+                'capacity_fit': round(pool['capacity_fit'], 3),
+                'logistics_distance_km': round(pool['logistics_distance_km'], 2),
+                'rank': rank
+            })
+        logger.info(f"Found {len(pools)} producer pools for consumer {consumer_id}")
+        return pools
+    
+    def get_entity(self, kind: str, entity_id: str) -> Optional[Dict]:
+        """Full producer or consumer record from the store, or None if unknown"""
+        store = self.get_store()
+        columns = store.producers if kind == 'producer' else store.consumers
+        row = columns.find(entity_id)
+        return None if row is None else columns.record(row)
+    
+    def find_similar(self, kind: str, entity_id: str, k: int = 10) -> Optional[List[Dict]]:
+        """Producers similar to a producer, or consumers similar to a consumer, by vector cosine
+        
+        Returns None if the entity does not exist.
+        """
+        store = self.get_store()
+        columns = store.producers if kind == 'producer' else store.consumers
+        
+        row = columns.find(entity_id)
+        if row is None:
+            logger.error(f"{kind.capitalize()} {entity_id} not found")
+            return None
+        
+        with self._ann_lock:
+            rows, scores = columns.similar(row, k)
+        
+        results = []
+        for rank, (similar_row, score) in enumerate(zip(rows, scores), start=1):
+            entity = columns.record(int(similar_row))
+            entity.update({
+                'similarity': round(float(score), 3),
+                'rank': rank
+            })
+            results.append(entity)
+        return results
+    
+    def search(self, query: str, kind: Optional[str] = None, industry: Optional[str] = None,
+               limit: int = 10) -> List[Dict]:
+        """Producers and consumers matching a text query, best first (see search_index.py)"""
+        store = self.get_store()
+        results = []
+        for result_kind, row, score in store.search_index().search(query, kind, industry, limit):
+            columns = store.producers if result_kind == 'producer' else store.consumers
+            if row >= len(columns):
+                # Added to the shared index after this store was taken
+                continue
+            record = columns.record(row)
+            results.append({
+                'kind': result_kind,
+                'id': record.get('id'),
+                'name': record.get('name'),
+                'industry': record.get('industry_type') or record.get('industry'),
+                'location': record.get('location'),
+                'score': round(score, 3)
+            })
+        return results
+    
+    def map_clusters(self, west: float, south: float, east: float, north: float, zoom: int) -> List[Dict]:
+        """Producer and consumer clusters for a map viewport (see spatial_index.py)"""
+        return self.get_store().spatial.clusters(west, south, east, north, zoom)
+    
+    def match_changes(self, kind: str, entity_id: str) -> List[Dict]:
+        """Owned counterparties whose top matches a just-added entity entered, with its rank there
+        
+        Call it right after the entity was synced into the store.
+        """
+        store = self.get_store()
+        columns = store.producers if kind == 'producer' else store.consumers
+        others = store.consumers if kind == 'producer' else store.producers
+        row = columns.find(entity_id)
+        if row is None:
+            return []
         
-        logger.info(f"Found {len(matches)} viable matches for consumer {consumer_id}")
-        return matches[:limit}
+        record = columns.record(row)
+        changes = []
+        for other_row, rank, score in self._reverse_topk.entered(store, kind, row):
+            other = others.record(other_row)
+            changes.append({
+                'user_id': others.owners[other_row],
+                'entity': {'kind': others.kind, 'id': other.get('id'), 'name': other.get('name')},
+                'match': {'kind': kind, 'id': entity_id, 'name': record.get('name'),
+                          'rank': rank, 'match_score': round(score, 3)}
+            })
+        return changes
     
     def get_match_explanation(self, producer_data: Dict, consumer_data: Dict) -> str:
         """Generate human-readable explanation of match quality"""
@@ -418,8 +811,11 @@ class AdvancedMatcher:
         
         logger.info(f"Updated matching weights: {self.weights}")
     
-    def get_matching_stats(self) -> Dict:
-        """Get statistics about matching performance"""
+    def get_matching_stats(self, progress=None) -> Dict:
+        """Get statistics about matching performance
+        
+        `progress(done, total, message)` is called as producers are counted.
+        """
         db = self.load_database()
         
         total_producers = len(db.get('producers', []))
@@ -433,11 +829,21 @@ class AdvancedMatcher:
                 'weights': self.weights
             }
         
-        # Calculate average matches per producer
-        total_matches = 0
-        for producer in db.get('producers', []):
-            matches = self.get_ranked_matches(producer.get('id'), limit=100)
-            total_matches += len(matches)
+        # Calculate average matches per producer (capped at 100 each, as ranked lists are)
+        store = self.get_store()
+        pool = self.shard_pool()
+        if pool is not None:
+            total_matches = pool.count_matches(store, progress)
+        else:
+            total_matches = 0
+            for row in range(len(store.producers)):
+                if progress is not None:
+                    progress(row, len(store.producers), 'Counting matches')
+                candidates = store.viability.consumers_for(store.producers.capacity[row], store.producers.servable[row])
+                if len(candidates) == 0:
+                    continue
+                viable = self.score_columns(store.producers.take([row]), store.consumers.take(candidates))['viable']
+                total_matches += min(100, int(np.count_nonzero(viable)))
         
         avg_matches = total_matches / total_producers if total_producers > 0 else 0
         
@@ -446,5 +852,6 @@ class AdvancedMatcher:
             'total_consumers': total_consumers,
             'avg_matches_per_producer': round(avg_matches, 2),
             'weights': self.weights,
+            'data_version': self.data_version,
             'vector_engine_stats': self.vector_engine.get_vector_stats()
         } 
\ No newline at end of file
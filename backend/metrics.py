@@ -0,0 +1,218 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from typing import Dict, List, Optional, Tuple
+
+# Metrics are opt-in. When disabled every recording call returns immediately
+# and `timed` leaves the decorated function untouched, so the hot path pays
+# nothing for instrumentation it does not use.
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'false').lower() == 'true'
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SPAN_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+_registry: Dict[str, '_Metric'] = {}
+_registry_lock = threading.Lock()
+
+def _label_key(labels: Dict) -> Tuple:
+    return tuple(sorted(labels.items()))
+
+def _format_labels(key: Tuple, extra: Optional[Tuple] = None) -> str:
+    items = list(key) + ([extra] if extra else [])
+    if not items:
+        return ''
+    parts = []
+    for name, value in items:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{name}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._lock = threading.Lock()
+
+    def render(self) -> List[str]:
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+class Counter(_Metric):
+    """Monotonically increasing counter with optional labels"""
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str):
+        super().__init__(name, documentation)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(labels), 0)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.append(f'{self.name}{_format_labels(key)} {_format_value(value)}')
+        return lines
+
+class Histogram(_Metric):
+    """Cumulative-bucket histogram with optional labels"""
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple, List] = {}
+
+    def observe(self, value: float, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = _label_key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # [per-bucket counts (+Inf last), sum, count]
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        with self._lock:
+            items = [(key, (list(s[0]), s[1], s[2])) for key, s in self._series.items()]
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = ('le', _format_value(bound))
+                lines.append(f'{self.name}_bucket{_format_labels(key, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(key)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(key)} {count}')
+        return lines
+
+def _register(metric: _Metric) -> _Metric:
+    with _registry_lock:
+        existing = _registry.get(metric.name)
+        if existing is not None:
+            return existing
+        _registry[metric.name] = metric
+        return metric
+
+def counter(name: str, documentation: str) -> Counter:
+    """Get or create a registered counter"""
+    return _register(Counter(name, documentation))
+
+def histogram(name: str, documentation: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+    """Get or create a registered histogram"""
+    return _register(Histogram(name, documentation, buckets))
+
+# --- Shared Metrics ---
+HTTP_REQUEST_DURATION = histogram(
+    'carbonflow_http_request_duration_seconds', 'HTTP request latency by route')
+SPAN_DURATION = histogram(
+    'carbonflow_span_duration_seconds', 'Latency of instrumented hot-path functions', SPAN_BUCKETS)
+DB_LOADS = counter('carbonflow_db_loads_total', 'Database file loads')
+VECTOR_REBUILDS = counter('carbonflow_vector_rebuilds_total', 'Vector set rebuilds')
+GEODESIC_CALLS = counter('carbonflow_geodesic_calls_total',
+                         'Geodesic distance computations (per-pair scores behind match explanations)')
+PAIRS_SCORED = counter('carbonflow_pairs_scored_total',
+                       'Producer/consumer pairs scored by score_columns, by where they were scored (local or shards)')
+LLM_CALLS = counter('carbonflow_llm_calls_total', 'Azure OpenAI completion calls')
+DATA_CHANGES = counter('carbonflow_data_changes_applied_total', 'Change log entries applied from the shared log')
+CACHE_REQUESTS = counter('carbonflow_cache_requests_total', 'Cache lookups by cache and result')
+SINGLEFLIGHT_CALLS = counter('carbonflow_singleflight_calls_total',
+                             'Single-flight calls by flight and role (leader ran it, follower shared its result)')
+MATCH_NOTIFICATIONS = counter('carbonflow_match_notifications_total',
+                              'Match list changes by outcome (published, or muted by the owner\'s preferences)')
+PARTIAL_MATCHES = counter('carbonflow_partial_matches_total',
+                          'Match requests answered from the candidates scored before their deadline')
+
+def cache_hit(cache: str):
+    CACHE_REQUESTS.inc(cache=cache, result='hit')
+
+def cache_miss(cache: str):
+    CACHE_REQUESTS.inc(cache=cache, result='miss')
+
+def timed(span: str):
+    """Decorator recording the wrapped function's latency as a named span"""
+    def decorator(func):
+        if not METRICS_ENABLED:
+            return func
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                SPAN_DURATION.observe(time.perf_counter() - start, span=span)
+        return wrapper
+    return decorator
+
+def span(name: str):
+    """Context manager recording the latency of a block as a named span"""
+    if not METRICS_ENABLED:
+        return nullcontext()
+    return SPAN_DURATION.time(span=name)
+
+def render() -> str:
+    """Render all registered metrics in the Prometheus text exposition format"""
+    with _registry_lock:
+        metrics = list(_registry.values())
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+def init_app(app):
+    """Attach per-route latency tracking and the /metrics endpoint to a Flask app"""
+    if not METRICS_ENABLED:
+        return
+
+    from flask import Response, g, request
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _record_latency(response):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            HTTP_REQUEST_DURATION.observe(
+                time.perf_counter() - start,
+                method=request.method, route=route, status=response.status_code
+            )
+        return response
+
+    @app.route('/metrics')
+    def prometheus_metrics():
+        return Response(render(), content_type='text/plain; version=0.0.4; charset=utf-8')
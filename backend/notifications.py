@@ -0,0 +1,96 @@
+"""Per-user notification feed shared by all workers
+
+Notifications are appended as JSON lines to `<DATABASE_FILE>.notifications`
+(or `NOTIFICATIONS_FILE`) under a file lock. A notification's id is its byte
+offset in the file, so ids increase and clients page with `after=<last id>`.
+Each worker keeps an in-memory index of each user's latest
+NOTIFICATIONS_PER_USER notifications and reads only the lines appended
+since it last looked.
+"""
+
+import fcntl
+import json
+import os
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set
+
+import changelog
+import metrics
+
+# Latest notifications kept per user in each worker's index; older ones can no longer be paged
+NOTIFICATIONS_PER_USER = int(os.getenv('NOTIFICATIONS_PER_USER', '200'))
+
+def feed_file() -> str:
+    return os.getenv('NOTIFICATIONS_FILE') or changelog.database_file() + '.notifications'
+
+def match_subscribers(users: Iterable[Dict]) -> Set[str]:
+    """Ids of users who want match notifications (on unless preferences.notifications.matches is false)"""
+    subscribed = set()
+    for user in users:
+        notifications = (user.get('preferences') or {}).get('notifications') or {}
+        if notifications.get('matches', True):
+            subscribed.add(user.get('id'))
+    return subscribed
+
+class NotificationFeed:
+    """Append-only JSON-lines notifications, indexed by user"""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or feed_file()
+        self._by_user: Dict[str, deque] = {}
+        self._offset = 0
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        try:
+            if os.path.getsize(self.path) == self._offset:
+                return
+            with open(self.path, 'rb') as f:
+                f.seek(self._offset)
+                data = f.read()
+        except OSError:
+            return
+        complete = data[:data.rfind(b'\n') + 1]
+        offset = self._offset
+        for line in complete.splitlines(keepends=True):
+            if line.strip():
+                notification = json.loads(line)
+                notification['id'] = offset
+                user_id = notification['user_id']
+                if user_id not in self._by_user:
+                    self._by_user[user_id] = deque(maxlen=NOTIFICATIONS_PER_USER)
+                self._by_user[user_id].append(notification)
+            offset += len(line)
+        self._offset += len(complete)
+
+    def publish(self, notifications: List[Dict], subscribers: Set[str]) -> int:
+        """Append the notifications addressed to subscribers; returns how many were published"""
+        lines = []
+        created_at = datetime.utcnow().isoformat()
+        for notification in notifications:
+            if notification['user_id'] not in subscribers:
+                metrics.MATCH_NOTIFICATIONS.inc(outcome='muted')
+                continue
+            metrics.MATCH_NOTIFICATIONS.inc(outcome='published')
+            line = dict(notification, type=notification.get('type', 'match'), created_at=created_at)
+            lines.append(json.dumps(line, separators=(',', ':')).encode('utf-8') + b'\n')
+        if lines:
+            with open(self.path, 'ab') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.write(b''.join(lines))
+                    f.flush()
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+        return len(lines)
+
+    def for_user(self, user_id: str, after: Optional[int] = None, limit: int = 50) -> List[Dict]:
+        """A user's next notifications after id `after` (their latest without it), oldest first"""
+        with self._lock:
+            self._refresh()
+            notifications = list(self._by_user.get(user_id, ()))
+            if after is None:
+                return notifications[-limit:]
+            return [n for n in notifications if n['id'] > after][:limit]
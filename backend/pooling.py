@@ -0,0 +1,127 @@
+"""Supply pooling: small sets of producers that jointly serve one consumer
+
+A consumer whose demand exceeds every single producer's supply has no
+viable matches, but a few nearby producers may cover it together. Pool
+members are compatible producers with 0 < supply < demand. The viability
+index finds them, and the spatial index keeps only those within
+MAX_MATCH_DISTANCE_KM. Half of the `POOL_CANDIDATES` searched are the best
+by capacity-independent score, and the other half the largest by supply, so
+large demands stay coverable. They go into a beam search. Each step
+extends the best `POOL_BEAM_WIDTH` partial pools by one more producer, up to
+`MAX_POOL_SIZE`. A pool is complete once its combined supply covers
+demand, and is kept only if no member can be dropped.
+
+Demand is split across members in proportion to supply. A pool's score is
+the comprehensive score with every component except capacity fit averaged
+over the members, weighted by the tonnes each delivers, and capacity fit
+computed for the combined supply. Pools are ranked by that score, then by
+logistics distance (tonne-weighted average distance).
+"""
+
+import os
+from typing import Dict, List
+
+import numpy as np
+
+from matching_engine import COMPONENTS, COMPONENT_WEIGHTS, MAX_MATCH_DISTANCE_KM, capacity_fit
+
+MAX_POOL_SIZE = int(os.getenv('MAX_POOL_SIZE', '3'))
+POOL_CANDIDATES = int(os.getenv('POOL_CANDIDATES', '48'))
+POOL_BEAM_WIDTH = int(os.getenv('POOL_BEAM_WIDTH', '256'))
+
+# Components averaged over a pool's members (capacity fit is scored for the pool as a whole)
+MEMBER_COMPONENTS = tuple(name for name in COMPONENTS if name != 'capacity_fit')
+
+def pool_candidates(matcher, store, row: int, weights: Dict) -> Dict[str, np.ndarray]:
+    """Producers that could join a pool for consumer `row`, best first, with their scores"""
+    producers, consumers = store.producers, store.consumers
+    demand = float(consumers.capacity[row])
+    candidates = store.viability.producers_below(demand, int(consumers.industry[row]))
+    if consumers.has_location[row] and len(candidates):
+        near = np.zeros(len(producers), dtype=bool)
+        near[store.spatial.rows_near('producer', float(consumers.lat[row]), float(consumers.lon[row]),
+                                     MAX_MATCH_DISTANCE_KM)] = True
+        candidates = candidates[near[candidates] | ~producers.has_location[candidates]]
+    if len(candidates) == 0:
+        return {'rows': candidates}
+
+    scores = matcher.score_columns(producers.take(candidates), consumers.take([row]))
+    # Pairs that fail only the supply check
+    usable = np.flatnonzero((scores['quality_match'] > 0) & (scores['distance_km'] <= MAX_MATCH_DISTANCE_KM))
+    member_weights = np.array([weights[weight] for name, weight in zip(COMPONENTS, COMPONENT_WEIGHTS)
+                               if name != 'capacity_fit'])
+    components = np.column_stack([scores[name][usable] for name in MEMBER_COMPONENTS])
+    partial = components @ member_weights
+    distance = scores['distance_km'][usable]
+
+    supply = producers.capacity[candidates[usable]]
+    by_score = np.lexsort((distance, -partial))
+    by_supply = np.lexsort((by_score.argsort(), -supply))[:POOL_CANDIDATES // 2]
+    chosen = np.zeros(len(usable), dtype=bool)
+    chosen[by_supply] = True
+    chosen[by_score[~chosen[by_score]][:POOL_CANDIDATES - len(by_supply)]] = True
+    best = by_score[chosen[by_score]]
+    return {
+        'rows': candidates[usable][best],
+        'supply': producers.capacity[candidates[usable][best]].astype(np.float64),
+        'partial': partial[best],
+        'components': components[best],
+        'distance_km': distance[best]
+    }
+
+def find_pools(matcher, store, row: int, weights: Dict, limit: int) -> List[Dict]:
+    """Best pools for consumer `row`: member positions into pool_candidates(), score and logistics distance"""
+    demand = float(store.consumers.capacity[row])
+    if demand <= 0:
+        return []
+    pool = pool_candidates(matcher, store, row, weights)
+    if len(pool['rows']) < 2:
+        return []
+    supply, partial, distance = pool['supply'], pool['partial'], pool['distance_km']
+    capacity_weight = weights['capacity_compatibility']
+    n = len(supply)
+
+    # Partial pools as member positions plus running sums of supply, supply * score and supply * distance
+    members = np.arange(n)[:, None]
+    total, scored, hauled = supply.copy(), supply * partial, supply * distance
+    complete = []
+    for _ in range(2, MAX_POOL_SIZE + 1):
+        if len(members) == 0:
+            break
+        # Extend every partial pool with each later candidate (so each set is built once)
+        pool_index, joining = np.nonzero(np.arange(n)[None, :] > members[:, -1:])
+        new_members = np.column_stack([members[pool_index], joining])
+        new_total = total[pool_index] + supply[joining]
+        new_scored = scored[pool_index] + supply[joining] * partial[joining]
+        new_hauled = hauled[pool_index] + supply[joining] * distance[joining]
+
+        covered = new_total >= demand
+        # Minimal pools only: without its smallest member the pool must fall short
+        minimal = new_total - supply[new_members].min(axis=1) < demand
+        done = np.flatnonzero(covered & minimal)
+        if len(done):
+            score = new_scored[done] / new_total[done] + capacity_weight * capacity_fit(new_total[done], demand)
+            complete.append((new_members[done], new_total[done], score, new_hauled[done] / new_total[done]))
+
+        # Keep the most promising uncovered pools: member score plus the capacity share covered so far
+        open_pools = np.flatnonzero(~covered)
+        promise = new_scored[open_pools] / new_total[open_pools] + capacity_weight * new_total[open_pools] / demand
+        keep = open_pools[np.argsort(-promise, kind='stable')[:POOL_BEAM_WIDTH]]
+        members, total, scored, hauled = new_members[keep], new_total[keep], new_scored[keep], new_hauled[keep]
+
+    pools = []
+    for pool_members, pool_total, pool_score, logistics in complete:
+        for i in range(len(pool_members)):
+            pools.append((round(float(pool_score[i]), 3), float(logistics[i]), pool_members[i], float(pool_total[i])))
+    pools.sort(key=lambda p: (-p[0], p[1], len(p[2])))
+
+    return [{
+        'members': pool['rows'][positions],
+        'allocated': demand * supply[positions] / pool_total,
+        'components': pool['components'][positions],
+        'distance_km': distance[positions],
+        'total_supply': pool_total,
+        'match_score': score,
+        'capacity_fit': float(capacity_fit(pool_total, demand)),
+        'logistics_distance_km': logistics
+    } for score, logistics, positions, pool_total in pools[:limit]]
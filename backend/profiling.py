@@ -0,0 +1,174 @@
+import fcntl
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import changelog
+
+# Profile every matching request (results are only stored, never returned inline)
+PROFILE_ALL = os.getenv('MATCH_PROFILING', 'false').lower() == 'true'
+# Seconds between stack samples; the effective floor is the interpreter switch interval
+SAMPLE_INTERVAL = float(os.getenv('PROFILE_SAMPLE_INTERVAL_MS', '1')) / 1000.0
+# Number of recent profiles kept for inspection and aggregation (shared by all workers)
+PROFILE_HISTORY = int(os.getenv('PROFILE_HISTORY', '50'))
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_ID_HEADER = 'X-Profile-Id'
+
+# Profiles this worker has appended since it last trimmed the shared file
+_appended = 0
+_appended_lock = threading.Lock()
+
+def profiles_file() -> str:
+    return os.getenv('PROFILES_FILE') or changelog.database_file() + '.profiles'
+
+def _store(record: Dict):
+    """Append a profile to the file shared by all workers, trimming it to the history now and then"""
+    global _appended
+    line = json.dumps(record, separators=(',', ':')).encode('utf-8') + b'\n'
+    with _appended_lock:
+        _appended += 1
+        trim = _appended >= PROFILE_HISTORY
+        if trim:
+            _appended = 0
+    with open(profiles_file(), 'a+b') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            f.write(line)
+            f.flush()
+            if trim:
+                f.seek(0)
+                lines = [l for l in f.read().splitlines(keepends=True) if l.strip()]
+                f.truncate(0)
+                f.write(b''.join(lines[-PROFILE_HISTORY:] if PROFILE_HISTORY > 0 else []))
+                f.flush()
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def _load() -> List[Dict]:
+    """The last PROFILE_HISTORY profiles recorded by any worker, oldest first"""
+    if PROFILE_HISTORY <= 0:
+        return []
+    try:
+        with open(profiles_file(), 'rb') as f:
+            fcntl.flock(f, fcntl.LOCK_SH)
+            try:
+                data = f.read()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+    except OSError:
+        return []
+    lines = [l for l in data.splitlines() if l.strip()]
+    return [json.loads(l) for l in lines[-PROFILE_HISTORY:]]
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+class StackSampler:
+    """Statistical profiler sampling one thread's stack from a background thread"""
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self._target_id = None
+        self._root = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, root_frame):
+        """Start sampling the calling thread; stacks are recorded relative to root_frame"""
+        self._target_id = threading.get_ident()
+        self._root = root_frame
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> Counter:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self.stacks
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target_id)
+            stack = []
+            while frame is not None and frame is not self._root:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            if stack:
+                stack.reverse()
+                self.stacks[';'.join(stack)] += 1
+
+def _top_functions(stacks: Counter, limit: int = 15) -> List[Dict]:
+    """Rank functions by self samples (leaf frames) with inclusive totals"""
+    total = sum(stacks.values())
+    self_samples = Counter()
+    inclusive = Counter()
+    for stack, count in stacks.items():
+        frames = stack.split(';')
+        self_samples[frames[-1]] += count
+        for frame in set(frames):
+            inclusive[frame] += count
+    ranked = []
+    for function, count in self_samples.most_common(limit):
+        ranked.append({
+            'function': function,
+            'self_samples': count,
+            'total_samples': inclusive[function],
+            'self_pct': round(100.0 * count / total, 1) if total else 0.0
+        })
+    return ranked
+
+@contextmanager
+def profile(label: str):
+    """Sample the enclosed block and store the result; yields the profile record"""
+    record = {
+        'id': uuid.uuid4().hex[:12],
+        'label': label,
+        'started_at': datetime.utcnow().isoformat()
+    }
+    sampler = StackSampler()
+    # Stacks are cut at this frame so request-handling frames above it are omitted
+    sampler.start(sys._getframe(2))
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        stacks = sampler.stop()
+        record.update({
+            'wall_ms': round((time.perf_counter() - start) * 1000, 3),
+            'interval_ms': round(sampler.interval * 1000, 3),
+            'samples': sum(stacks.values()),
+            'top_functions': _top_functions(stacks),
+            'stacks': dict(stacks)
+        })
+        _store(record)
+
+def get_profile(profile_id: str) -> Optional[Dict]:
+    return next((p for p in _load() if p['id'] == profile_id), None)
+
+def list_profiles() -> List[Dict]:
+    """Summaries of the stored profiles, newest first"""
+    profiles = _load()
+    return [
+        {key: p[key] for key in ('id', 'label', 'started_at', 'wall_ms', 'samples')}
+        for p in reversed(profiles)
+    ]
+
+def collapsed_stacks(last_n: Optional[int] = None) -> str:
+    """Aggregate the last N profiles in collapsed-stack format (flamegraph.pl / speedscope)"""
+    profiles = _load()
+    if last_n is not None:
+        profiles = profiles[-last_n:] if last_n > 0 else []
+    merged = Counter()
+    for p in profiles:
+        merged.update(p['stacks'])
+    return ''.join(f"{stack} {count}\n" for stack, count in merged.most_common())
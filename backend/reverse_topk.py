@@ -0,0 +1,118 @@
+"""Reverse top-K: whose match lists a newly added entity enters
+
+A new consumer can only change the ranked matches of producers that it is
+viable with. Those producers have the supply and purity the viability index
+asks for, and they are within MAX_MATCH_DISTANCE_KM (or unlocated). Only
+entities registered by a signed-in user (`owner_id`) can be notified, so only
+their lists are checked. Each checked entity's top `NOTIFY_TOP_K` scores are
+cached. A new entity enters a list when it beats the last cached score, and
+one insert keeps the list current. Lists are ranked the first time they are
+needed, and again when a tie makes the rank depend on candidate order. The
+cache is valid only while every change to the store passes through here; it
+is dropped whenever anything else changed.
+"""
+
+import os
+import threading
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from matching_engine import COMPONENTS, COMPONENT_WEIGHTS, MAX_MATCH_DISTANCE_KM, rank_positions
+
+# Length of the match lists watched for changes (what /api/matches returns)
+NOTIFY_TOP_K = int(os.getenv('NOTIFY_TOP_K', '20'))
+
+KINDS = ('producer', 'consumer')
+
+def _rounded(scores: np.ndarray) -> np.ndarray:
+    """Scores as ranked (see rank_positions)"""
+    return np.rint(scores * 1000).astype(np.int64)
+
+class ReverseTopK:
+    """Owned counterparties whose top-K matches a new entity enters"""
+
+    def __init__(self, matcher, k: int = NOTIFY_TOP_K):
+        self.matcher = matcher
+        self.k = k
+        self._lock = threading.Lock()
+        self._lineage = None
+        self._generation = None
+        # (kind, row) -> rounded scores of its top-k matches, best first
+        self._lists: Dict[Tuple[str, int], np.ndarray] = {}
+
+    def entered(self, store, kind: str, row: int) -> List[Tuple[int, int, float]]:
+        """(counterparty row, rank, score) for every owned counterparty whose top-k now includes `row`"""
+        other = KINDS[1 - KINDS.index(kind)]
+        with self._lock:
+            added = store.last_added
+            if not (self._lineage is store.lineage and added is not None and self._generation is not None
+                    and added[2] == store.generation == self._generation + 1
+                    and added[0] == kind and list(added[1]) == [row]):
+                self._lists = {}
+            self._lineage = store.lineage
+            self._generation = store.generation
+
+            candidates = self._candidates(store, kind, row)
+            if len(candidates) == 0:
+                return []
+            if kind == 'producer':
+                scores = self.matcher.score_columns(store.producers.take([row]), store.consumers.take(candidates))
+            else:
+                scores = self.matcher.score_columns(store.producers.take(candidates), store.consumers.take([row]))
+            viable = np.flatnonzero(scores['viable'])
+            overall = np.column_stack([scores[name][viable] for name in COMPONENTS]) @ self._weights()
+
+            entered = []
+            for candidate, score, key in zip(candidates[viable], overall, _rounded(overall)):
+                candidate = int(candidate)
+                top = self._lists.get((other, candidate))
+                if top is None or key in top:
+                    # Unknown list, or tied with a listed match (then candidate order decides)
+                    rank = self._rank(store, other, candidate, row)
+                else:
+                    position = int(np.searchsorted(-top, -key))
+                    self._lists[(other, candidate)] = np.insert(top, position, key)[:self.k]
+                    rank = position + 1 if position < self.k else None
+                if rank is not None:
+                    entered.append((candidate, rank, float(score)))
+            return entered
+
+    def _weights(self) -> np.ndarray:
+        return np.array([self.matcher.weights[name] for name in COMPONENT_WEIGHTS])
+
+    def _candidates(self, store, kind: str, row: int) -> np.ndarray:
+        """Owned counterparties that pass the viability index and lie within matching distance"""
+        columns = store.producers if kind == 'producer' else store.consumers
+        others = store.consumers if kind == 'producer' else store.producers
+        owned = np.fromiter(others.owners, dtype=np.int64, count=len(others.owners))
+        if len(owned) == 0:
+            return owned
+
+        if kind == 'producer':
+            viable = store.viability.consumers_for(columns.capacity[row], columns.servable[row])
+        else:
+            viable = store.viability.producers_for(columns.capacity[row], columns.industry[row])
+        keep = np.zeros(len(others), dtype=bool)
+        keep[viable] = True
+        candidates = owned[keep[owned]]
+
+        if columns.has_location[row] and len(candidates):
+            near = np.zeros(len(others), dtype=bool)
+            other = KINDS[1 - KINDS.index(kind)]
+            near[store.spatial.rows_near(other, float(columns.lat[row]), float(columns.lon[row]),
+                                         MAX_MATCH_DISTANCE_KM)] = True
+            candidates = candidates[near[candidates] | ~others.has_location[candidates]]
+        return np.sort(candidates)
+
+    def _rank(self, store, kind: str, row: int, target: int):
+        """Rank the matches of (kind, row), cache its top-k scores and return target's rank (or None)"""
+        entry = self.matcher.match_components(kind, row, store)
+        if len(entry['candidates']) == 0:
+            self._lists[(kind, row)] = np.empty(0, dtype=np.int64)
+            return None
+        overall = entry['components'] @ self._weights()
+        top = rank_positions(overall, self.k)
+        self._lists[(kind, row)] = _rounded(overall[top])
+        hits = np.flatnonzero(entry['candidates'][top] == target)
+        return int(hits[0]) + 1 if len(hits) else None
@@ -0,0 +1,195 @@
+"""In-process inverted index for producer and consumer search
+
+Documents are the `name`, industry and `additional_info` of every entity,
+tokenized into lowercase words. Postings are held as one token-sorted
+array pair (document ids and weights). Entities added later go to small
+per-token tails, which are merged back once they grow. A query scores every
+term with BM25-style idf times field-weighted term frequency, using one
+`bincount` per term. The last term also matches as a prefix, for
+autocomplete. Documents must contain every term.
+"""
+
+import re
+import threading
+from array import array
+from bisect import bisect_left, insort
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+# Field weights: a word in the name counts more than one in the description
+FIELD_WEIGHTS = (('name', 3.0), ('industry', 2.0), ('additional_info', 1.0))
+TF_SATURATION = 1.2
+# Completions of the last term considered per query (most frequent first) and their weight vs. exact words
+MAX_PREFIX_EXPANSIONS = 64
+PREFIX_SCAN_LIMIT = 4096
+PREFIX_WEIGHT = 0.6
+# Tail postings merged into the sorted arrays once they hold this many entries
+MERGE_THRESHOLD = 65536
+
+KINDS = ('producer', 'consumer')
+
+def tokenize(text) -> List[str]:
+    return TOKEN_PATTERN.findall(text.lower()) if isinstance(text, str) else []
+
+def entity_industry(record: Dict) -> str:
+    """Producers carry `industry_type`, consumers `industry`"""
+    return record.get('industry_type') or record.get('industry') or ''
+
+class SearchIndex:
+    """Token -> (document, weight) postings with prefix lookup over a sorted vocabulary"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._vocab: Dict[str, int] = {}
+        self._sorted_tokens: List[str] = []
+        # Merged postings: token t owns _docs/_weights[_offsets[t]:_offsets[t + 1]]
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._docs = np.empty(0, dtype=np.int64)
+        self._weights = np.empty(0, dtype=np.float32)
+        self._tails: Dict[int, Tuple[array, array]] = {}
+        self._tail_size = 0
+        self._df = np.empty(0, dtype=np.int64)
+        # Per-document kind, row in its EntityColumns and industry id
+        self._doc_kind = array('b')
+        self._doc_row = array('q')
+        self._doc_industry = array('q')
+        self._industries: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._doc_kind)
+
+    def _token_id(self, token: str, new_tokens: List[str]) -> int:
+        token_id = self._vocab.get(token)
+        if token_id is None:
+            token_id = self._vocab[token] = len(self._vocab)
+            new_tokens.append(token)
+        return token_id
+
+    def add(self, kind: str, rows, records: List[Dict]):
+        """Index records of one kind stored at the given EntityColumns rows"""
+        with self._lock:
+            tokens, docs, weights = array('q'), array('q'), array('f')
+            new_tokens: List[str] = []
+            for row, record in zip(rows, records):
+                doc = len(self._doc_kind)
+                industry = entity_industry(record).strip().lower()
+                self._doc_kind.append(KINDS.index(kind))
+                self._doc_row.append(int(row))
+                self._doc_industry.append(self._industries.setdefault(industry, len(self._industries)))
+
+                counts: Dict[str, float] = {}
+                for field, weight in FIELD_WEIGHTS:
+                    value = entity_industry(record) if field == 'industry' else record.get(field)
+                    for token in tokenize(value):
+                        counts[token] = counts.get(token, 0.0) + weight
+                for token, tf in counts.items():
+                    tokens.append(self._token_id(token, new_tokens))
+                    docs.append(doc)
+                    weights.append(tf * (1 + TF_SATURATION) / (tf + TF_SATURATION))
+
+            if len(new_tokens) > 64:
+                self._sorted_tokens = sorted(self._sorted_tokens + new_tokens)
+            else:
+                for token in new_tokens:
+                    insort(self._sorted_tokens, token)
+            self._df = np.concatenate([self._df, np.zeros(len(self._vocab) - len(self._df), dtype=np.int64)])
+            token_ids = np.frombuffer(tokens, dtype=np.int64)
+            self._df += np.bincount(token_ids, minlength=len(self._vocab))
+            if self._tail_size + len(tokens) >= MERGE_THRESHOLD:
+                self._merge(token_ids, np.frombuffer(docs, dtype=np.int64), np.frombuffer(weights, dtype=np.float32))
+            else:
+                for token_id, doc, weight in zip(tokens, docs, weights):
+                    tail = self._tails.setdefault(token_id, (array('q'), array('f')))
+                    tail[0].append(doc)
+                    tail[1].append(weight)
+                self._tail_size += len(tokens)
+
+    def _merge(self, token_ids: np.ndarray, docs: np.ndarray, weights: np.ndarray):
+        """Fold the tails and a new batch into the token-sorted arrays"""
+        counts = np.diff(self._offsets)
+        parts = [(np.repeat(np.arange(len(counts)), counts), self._docs, self._weights), (token_ids, docs, weights)]
+        for token_id, (tail_docs, tail_weights) in self._tails.items():
+            parts.append((np.full(len(tail_docs), token_id, dtype=np.int64),
+                          np.frombuffer(tail_docs, dtype=np.int64), np.frombuffer(tail_weights, dtype=np.float32)))
+        all_tokens = np.concatenate([p[0] for p in parts])
+        order = np.lexsort((np.concatenate([p[1] for p in parts]), all_tokens))
+        self._docs = np.concatenate([p[1] for p in parts])[order]
+        self._weights = np.concatenate([p[2] for p in parts])[order]
+        self._offsets = np.concatenate(([0], np.cumsum(np.bincount(all_tokens, minlength=len(self._vocab)))))
+        self._tails = {}
+        self._tail_size = 0
+
+    def _postings(self, token_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        if token_id + 1 < len(self._offsets):
+            start, end = self._offsets[token_id], self._offsets[token_id + 1]
+            docs, weights = self._docs[start:end], self._weights[start:end]
+        else:
+            docs, weights = self._docs[:0], self._weights[:0]
+        tail = self._tails.get(token_id)
+        if tail is not None:
+            docs = np.concatenate([docs, np.frombuffer(tail[0], dtype=np.int64)])
+            weights = np.concatenate([weights, np.frombuffer(tail[1], dtype=np.float32)])
+        return docs, weights
+
+    def _expansions(self, term: str, prefix: bool) -> List[Tuple[int, float]]:
+        """(token id, weight) pairs a query term matches"""
+        matches = []
+        if term in self._vocab:
+            matches.append((self._vocab[term], 1.0))
+        if prefix:
+            start = bisect_left(self._sorted_tokens, term)
+            completions = []
+            for token in self._sorted_tokens[start:start + PREFIX_SCAN_LIMIT]:
+                if not token.startswith(term):
+                    break
+                if token != term:
+                    completions.append(self._vocab[token])
+            if completions:
+                completions = np.array(completions, dtype=np.int64)
+                top = completions[np.argsort(-self._df[completions], kind='stable')[:MAX_PREFIX_EXPANSIONS]]
+                matches.extend((int(token_id), PREFIX_WEIGHT) for token_id in top)
+        return matches
+
+    def search(self, query: str, kind: Optional[str] = None, industry: Optional[str] = None,
+               limit: int = 10) -> List[Tuple[str, int, float]]:
+        """Best (kind, row, score) matches for a query, optionally filtered by kind and industry"""
+        terms = tokenize(query)
+        with self._lock:
+            n = len(self._doc_kind)
+            if not terms or n == 0:
+                return []
+            scores = np.zeros(n, dtype=np.float64)
+            matched = np.zeros(n, dtype=np.int64)
+            for i, term in enumerate(terms):
+                hit = np.zeros(n, dtype=bool)
+                for token_id, weight in self._expansions(term, prefix=i == len(terms) - 1):
+                    docs, weights = self._postings(token_id)
+                    df = self._df[token_id]
+                    idf = np.log(1 + (n - df + 0.5) / (df + 0.5))
+                    scores += np.bincount(docs, weights=weights * (idf * weight), minlength=n)
+                    hit[docs] = True
+                matched += hit
+
+            keep = matched == len(terms)
+            if kind is not None:
+                keep &= np.frombuffer(self._doc_kind, dtype=np.int8) == KINDS.index(kind)
+            if industry is not None:
+                industry_id = self._industries.get(industry.strip().lower())
+                if industry_id is None:
+                    return []
+                keep &= np.frombuffer(self._doc_industry, dtype=np.int64) == industry_id
+            candidates = np.flatnonzero(keep)
+            if len(candidates) == 0:
+                return []
+
+            if limit < len(candidates):
+                # Keep everything tied with the limit-th score so the tie-break below decides
+                kth = np.partition(scores[candidates], len(candidates) - limit)[len(candidates) - limit]
+                candidates = candidates[scores[candidates] >= kth]
+            # Ties go to producers first, then the lower row, whatever order entities were indexed in
+            kinds = np.frombuffer(self._doc_kind, dtype=np.int8)[candidates]
+            rows = np.frombuffer(self._doc_row, dtype=np.int64)[candidates]
+            top = candidates[np.lexsort((rows, kinds, -scores[candidates]))[:limit]]
+            return [(KINDS[self._doc_kind[doc]], self._doc_row[doc], float(scores[doc])) for doc in top]
@@ -0,0 +1,377 @@
+"""Region-sharded scoring on a process pool
+
+Set `MATCH_SHARDS` to spread large match queries and the full-matrix match
+count over that many worker processes per server worker. Entities are
+partitioned into regions along the Morton order of the spatial index: the
+located producers and consumers together are split into `MATCH_SHARDS`
+contiguous code ranges of equal size (each a union of quadtree cells), and
+entities without a location form one extra shard.
+
+The scoring columns of both sides are copied once per store generation into
+one shared-memory block. Workers attach it by name, so a query ships only
+the entity row and its shard. Each worker builds its own viability index over
+the block and scores the viable candidates of one shard. A located query
+goes only to the shards whose bounding box meets the MAX_MATCH_DISTANCE_KM
+cap around it (nearest first), plus the unlocated shard. The parent merges
+the shards' component scores in candidate order, so the result and the
+component cache are exactly those of a local scan.
+
+Queries with fewer than `SHARD_MIN_CANDIDATES` viable-by-index candidates,
+or arriving while the snapshot is being re-exported after a change, are
+scored locally.
+"""
+
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+from typing import Dict, List, Optional
+
+import numpy as np
+
+import metrics
+from entity_store import EntityColumns, ViabilityIndex
+from matching_engine import COMPONENTS, MAX_MATCH_DISTANCE_KM, haversine_km, score_columns
+from spatial_index import cap_bbox, codes_for
+
+logger = logging.getLogger(__name__)
+
+# Worker processes per server worker (0 scores everything in-process)
+MATCH_SHARDS = int(os.getenv('MATCH_SHARDS', '0'))
+# Smallest candidate set worth sending to the pool
+SHARD_MIN_CANDIDATES = int(os.getenv('SHARD_MIN_CANDIDATES', '20000'))
+# Producers per task when counting matches for stats
+STATS_CHUNK = 2048
+# Byte alignment of each array in the shared block
+ALIGNMENT = 64
+
+KINDS = ('producer', 'consumer')
+
+def partition(store, shards: int) -> Dict[str, np.ndarray]:
+    """Shard of every row per kind: equal ranges of both sides' Morton codes, `shards` for unlocated rows"""
+    codes = {}
+    for columns in (store.producers, store.consumers):
+        located = columns.has_location
+        codes[columns.kind] = codes_for(columns.lat[located].astype(np.float64), columns.lon[located].astype(np.float64))
+    merged = np.sort(np.concatenate([codes['producer'], codes['consumer']]))
+    cuts = merged[(np.arange(1, shards) * len(merged)) // shards] if len(merged) else np.empty(0, dtype=np.uint64)
+
+    shard_of = {}
+    for columns in (store.producers, store.consumers):
+        shard = np.full(len(columns), shards, dtype=np.int16)
+        shard[columns.has_location] = np.searchsorted(cuts, codes[columns.kind], side='right')
+        shard_of[columns.kind] = shard
+    return shard_of
+
+def _bounds(columns, shard_of: np.ndarray, shards: int) -> List[Optional[tuple]]:
+    """(west, south, east, north) of each located shard's rows, None when it has none"""
+    bounds = []
+    for shard in range(shards):
+        rows = np.flatnonzero(shard_of == shard)
+        if len(rows) == 0:
+            bounds.append(None)
+            continue
+        lat, lon = columns.lat[rows], columns.lon[rows]
+        bounds.append((float(lon.min()), float(lat.min()), float(lon.max()), float(lat.max())))
+    return bounds
+
+def _meets(box: tuple, cap: tuple) -> bool:
+    west, south, east, north = cap
+    if box[1] > north or box[3] < south:
+        return False
+    # The cap may extend past the antimeridian
+    return any(west + shift <= box[2] and east + shift >= box[0] for shift in (-360.0, 0.0, 360.0))
+
+class Snapshot:
+    """Both sides' scoring columns for one store generation, in one shared-memory block"""
+
+    def __init__(self, store, shards: int):
+        self.store = store
+        self.generation = store.generation
+        self.shard_of = partition(store, shards)
+        self.bounds = {}
+        self.unlocated = {}
+        arrays = {}
+        for columns in (store.producers, store.consumers):
+            arrays[columns.kind] = dict(columns.scoring_arrays(), shard_of=self.shard_of[columns.kind])
+            self.bounds[columns.kind] = _bounds(columns, self.shard_of[columns.kind], shards)
+            self.unlocated[columns.kind] = bool(np.any(~columns.has_location))
+
+        layout, size = {}, 0
+        for kind, named in arrays.items():
+            for name, array in named.items():
+                size = -(-size // ALIGNMENT) * ALIGNMENT
+                layout[(kind, name)] = (size, array.dtype.str, array.shape)
+                size += array.nbytes
+        self.shm = SharedMemory(create=True, size=size + ALIGNMENT)
+        for (kind, name), (offset, dtype, shape) in layout.items():
+            np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=offset)[...] = arrays[kind][name]
+        self.spec = {'name': self.shm.name, 'layout': layout, 'shards': shards}
+        # Tasks submitted and not yet finished; a retired snapshot is unlinked when this reaches zero
+        self.pending = 0
+        self.retired = False
+
+    def fresh(self, store) -> bool:
+        return self.store is store and self.generation == store.generation
+
+    def release(self):
+        try:
+            self.shm.close()
+            self.shm.unlink()
+        except (BufferError, FileNotFoundError):
+            pass
+
+# --- Worker side ---
+
+# Shared blocks attached by this worker, by name (at most two: current and retiring)
+_attached = OrderedDict()
+_thread_limits = None
+
+def _init_worker():
+    global _thread_limits
+    from threadpoolctl import threadpool_limits
+    # One BLAS thread per shard process; the pool provides the parallelism
+    _thread_limits = threadpool_limits(1)
+
+def _attach(spec: Dict) -> Dict:
+    state = _attached.get(spec['name'])
+    if state is not None:
+        return state
+    shm = SharedMemory(name=spec['name'])
+    arrays = {kind: {} for kind in KINDS}
+    for (kind, name), (offset, dtype, shape) in spec['layout'].items():
+        array = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+        array.flags.writeable = False
+        arrays[kind][name] = array
+    columns = {kind: EntityColumns.from_arrays(kind, arrays[kind]) for kind in KINDS}
+    state = {
+        'shm': shm,
+        'columns': columns,
+        'shard_of': {kind: arrays[kind]['shard_of'] for kind in KINDS},
+        'viability': ViabilityIndex(columns['producer'], columns['consumer'])
+    }
+    _attached[spec['name']] = state
+    while len(_attached) > 2:
+        _, old = _attached.popitem(last=False)
+        shm = old.pop('shm')
+        old.clear()
+        try:
+            shm.close()
+        except BufferError:
+            pass
+    return state
+
+def _candidates(state: Dict, kind: str, row: int) -> np.ndarray:
+    columns = state['columns'][kind]
+    if kind == 'producer':
+        return state['viability'].consumers_for(columns.capacity[row], columns.servable[row])
+    return state['viability'].producers_for(columns.capacity[row], columns.industry[row])
+
+def _score(state: Dict, kind: str, row: int, candidates: np.ndarray, params: tuple) -> Dict[str, np.ndarray]:
+    producers, consumers = state['columns']['producer'], state['columns']['consumer']
+    if kind == 'producer':
+        return score_columns(producers.take([row]), consumers.take(candidates), *params)
+    return score_columns(producers.take(candidates), consumers.take([row]), *params)
+
+def _score_shard(spec: Dict, kind: str, row: int, shard: int, params: tuple) -> Dict[str, np.ndarray]:
+    """Viable candidates of (kind, row) in one shard with their component scores"""
+    state = _attach(spec)
+    other = KINDS[1 - KINDS.index(kind)]
+    candidates = _candidates(state, kind, row)
+    candidates = candidates[state['shard_of'][other][candidates] == shard]
+    scores = _score(state, kind, row, candidates, params)
+    viable = np.flatnonzero(scores['viable'])
+    return {
+        'candidates': candidates[viable],
+        'components': np.column_stack([scores[name][viable] for name in COMPONENTS]),
+        'distance_km': scores['distance_km'][viable],
+        'scored': len(candidates)
+    }
+
+def _count_matches(spec: Dict, rows: np.ndarray, params: tuple) -> int:
+    """Viable consumers per producer, capped at 100 each, summed over rows"""
+    state = _attach(spec)
+    total = 0
+    for row in rows:
+        candidates = _candidates(state, 'producer', int(row))
+        if len(candidates):
+            total += min(100, int(np.count_nonzero(_score(state, 'producer', int(row), candidates, params)['viable'])))
+    return total
+
+# --- Parent side ---
+
+class ShardPool:
+    """Worker processes scoring one matcher's store by region"""
+
+    def __init__(self, matcher, shards: int = MATCH_SHARDS):
+        self.matcher = matcher
+        self.shards = shards
+        self._lock = threading.Lock()
+        self._snapshot: Optional[Snapshot] = None
+        self._live: List[Snapshot] = []
+        self._exporting = False
+        self._executor = self._start()
+        atexit.register(self.close)
+        logger.info(f"Started {shards} matching shard processes")
+
+    def _start(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.shards, mp_context=get_context('spawn'),
+                                   initializer=_init_worker)
+
+    def _params(self) -> tuple:
+        return (self.matcher.weights, self.matcher.max_reasonable_distance, self.matcher.distance_penalty_factor)
+
+    def _export(self, store) -> Optional[Snapshot]:
+        # Stores are not changed once published (see EntityStore), so no lock is needed to copy one
+        snapshot = Snapshot(store, self.shards)
+        with self._lock:
+            current = self._snapshot
+            if current is not None and current.fresh(store):
+                snapshot.release()
+                return current
+            self._snapshot = snapshot
+            self._live.append(snapshot)
+            if current is not None:
+                current.retired = True
+                self._unlink_idle(current)
+        logger.info(f"Exported generation {snapshot.generation} to {self.shards} matching shards")
+        return snapshot
+
+    def _export_in_background(self, store):
+        try:
+            self._export(store)
+        except Exception as e:
+            logger.error(f"Shard export failed: {e}")
+        finally:
+            with self._lock:
+                self._exporting = False
+
+    def _fresh_snapshot(self, store) -> Optional[Snapshot]:
+        """The snapshot of this store generation, or None while a new one is exported"""
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is not None and snapshot.fresh(store):
+                return snapshot
+            if not self._exporting:
+                self._exporting = True
+                threading.Thread(target=self._export_in_background, args=(store,), daemon=True).start()
+        return None
+
+    def _unlink_idle(self, snapshot: Snapshot):
+        # Caller holds self._lock
+        if snapshot.retired and snapshot.pending == 0 and snapshot in self._live:
+            self._live.remove(snapshot)
+            snapshot.release()
+
+    def _submit(self, snapshot: Snapshot, task, *args):
+        with self._lock:
+            snapshot.pending += 1
+        try:
+            future = self._executor.submit(task, snapshot.spec, *args)
+        except BaseException:
+            self._done(snapshot)
+            raise
+        future.add_done_callback(lambda _: self._done(snapshot))
+        return future
+
+    def _done(self, snapshot: Snapshot):
+        with self._lock:
+            snapshot.pending -= 1
+            self._unlink_idle(snapshot)
+
+    def _restart(self):
+        logger.error("Matching shard pool broke; restarting it")
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = self._start()
+
+    def _shards_for(self, snapshot: Snapshot, other: str, columns, row: int) -> List[int]:
+        """Shards of the other side that can hold matches for this row, nearest first"""
+        bounds = snapshot.bounds[other]
+        located = [shard for shard, box in enumerate(bounds) if box is not None]
+        if columns.has_location[row]:
+            lat, lon = float(columns.lat[row]), float(columns.lon[row])
+            cap = cap_bbox(lat, lon, MAX_MATCH_DISTANCE_KM)
+            located = [shard for shard in located if _meets(bounds[shard], cap)]
+            gap = [float(haversine_km(lat, lon, np.clip(lat, bounds[shard][1], bounds[shard][3]),
+                                      np.clip(lon, bounds[shard][0], bounds[shard][2]))) for shard in located]
+            located = [located[i] for i in np.argsort(gap, kind='stable')]
+        return located + ([self.shards] if snapshot.unlocated[other] else [])
+
+    def components(self, kind: str, row: int, store, candidates: np.ndarray,
+                   deadline: Optional[float] = None) -> Optional[Dict[str, np.ndarray]]:
+        """match_components' entry computed on the shards, or None to score locally
+
+        With a `deadline`, shards not finished by then are cancelled and the
+        entry is marked `partial` (at least one shard is always waited for).
+        """
+        if len(candidates) < SHARD_MIN_CANDIDATES:
+            return None
+        snapshot = self._fresh_snapshot(store)
+        if snapshot is None:
+            return None
+        columns = store.producers if kind == 'producer' else store.consumers
+        other = KINDS[1 - KINDS.index(kind)]
+        params = self._params()
+        try:
+            futures = [self._submit(snapshot, _score_shard, kind, row, shard, params)
+                       for shard in self._shards_for(snapshot, other, columns, row)]
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            done, pending = wait(futures, timeout=timeout)
+            if futures and not done:
+                done, pending = wait(futures, return_when=FIRST_COMPLETED)
+            for future in pending:
+                future.cancel()
+            parts = [future.result() for future in done]
+        except BrokenProcessPool:
+            self._restart()
+            return None
+        # Shard processes keep no metrics, so their pairs are counted here
+        metrics.PAIRS_SCORED.inc(sum(part['scored'] for part in parts), where='shards')
+
+        if not parts:
+            return {'candidates': np.empty(0, dtype=np.int64), 'components': np.empty((0, len(COMPONENTS))),
+                    'distance_km': np.empty(0)}
+        # Back in candidate order, so ties rank exactly as in a local scan
+        order = np.argsort(np.concatenate([part['candidates'] for part in parts]), kind='stable')
+        entry = {name: np.concatenate([part[name] for part in parts])[order]
+                 for name in ('candidates', 'components', 'distance_km')}
+        if pending:
+            entry['partial'] = True
+        return entry
+
+    def count_matches(self, store, progress=None) -> int:
+        """Viable matches per producer (capped at 100 each) summed over all producers, by region"""
+        with self._lock:
+            snapshot = self._snapshot
+        if snapshot is None or not snapshot.fresh(store):
+            snapshot = self._export(store)
+        n = len(store.producers)
+        rows = np.argsort(snapshot.shard_of['producer'], kind='stable')
+        chunks = np.array_split(rows, max(1, -(-n // STATS_CHUNK)))
+        params = self._params()
+        try:
+            futures = {self._submit(snapshot, _count_matches, chunk, params): len(chunk) for chunk in chunks}
+            total, counted = 0, 0
+            for future in as_completed(futures):
+                total += future.result()
+                counted += futures[future]
+                if progress is not None:
+                    progress(counted, n, 'Counting matches')
+        except BrokenProcessPool:
+            self._restart()
+            raise
+        return total
+
+    def close(self):
+        """Unlink the shared blocks (concurrent.futures stops the workers itself at exit)"""
+        with self._lock:
+            for snapshot in self._live:
+                snapshot.release()
+            self._live = []
+            self._snapshot = None
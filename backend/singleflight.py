@@ -0,0 +1,91 @@
+"""Single-flight execution of identical concurrent requests
+
+When several threads ask for the same expensive computation at once, the
+first caller (the leader) runs it. The others (followers) wait and share its
+result, or its exception. Nothing is cached: once the leader finishes, the
+next call with that key runs again. Followers receive the leader's object, so
+results must be treated as read-only.
+
+Flights coalesce the threads of one worker process. Across gunicorn workers,
+job-backed endpoints are already deduplicated by `jobs.py`.
+"""
+
+import hashlib
+import json
+import threading
+from typing import Callable, Dict, Hashable
+
+import metrics
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """Coalesce concurrent calls that share a key"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    def do(self, key: Hashable, func: Callable, *args, **kwargs):
+        """Run `func(*args, **kwargs)`, or wait for the in-flight call with the same key"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                self.followers += 1
+        metrics.SINGLEFLIGHT_CALLS.inc(flight=self.name, role='leader' if leader else 'follower')
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            in_flight = len(self._calls)
+        return {'executed': self.leaders, 'coalesced': self.followers, 'in_flight': in_flight}
+
+_flights: Dict[str, SingleFlight] = {}
+_flights_lock = threading.Lock()
+
+def flight(name: str) -> SingleFlight:
+    """The process-wide flight group with this name"""
+    with _flights_lock:
+        if name not in _flights:
+            _flights[name] = SingleFlight(name)
+        return _flights[name]
+
+def stats() -> Dict[str, Dict[str, int]]:
+    """Executed and coalesced call counts for every flight group in this process"""
+    with _flights_lock:
+        groups = list(_flights.values())
+    return {group.name: group.stats() for group in groups}
+
+def request_key(*parts) -> str:
+    """Stable key for JSON-serializable request parts (dict key order does not matter)"""
+    canonical = json.dumps(parts, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
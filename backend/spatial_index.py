@@ -0,0 +1,246 @@
+"""Quadtree (Morton-order) spatial index for map clustering
+
+Every located producer and consumer gets a Web Mercator Morton code at
+`LEVELS` bits per axis. The code's leading 2*z bits are the quadkey of its
+zoom-z map tile, so the entities of a tile, and of each cell inside it, are
+contiguous ranges of the sorted codes. Clustering a tile is then two binary
+searches plus one `reduceat` per aggregate. Each tile holds at most
+4**CLUSTER_LEVELS clusters, so a viewport's payload is bounded by its tile
+count. Tiles are cached until an entity is inserted into them.
+"""
+
+import copy
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+LEVELS = 24
+# Each tile is split into 2**CLUSTER_LEVELS x 2**CLUSTER_LEVELS cluster cells (64px on a 256px tile)
+CLUSTER_LEVELS = 2
+MAX_ZOOM = 20
+MAX_LATITUDE = 85.05112878
+EARTH_RADIUS_KM = 6371.0088
+# Largest number of tiles one viewport query may cover
+MAX_MAP_TILES = int(os.getenv('MAX_MAP_TILES', '64'))
+MAP_TILE_CACHE_SIZE = int(os.getenv('MAP_TILE_CACHE_SIZE', '4096'))
+
+KINDS = ('producer', 'consumer')
+
+def _spread_bits(v: np.ndarray) -> np.ndarray:
+    """Move the low 32 bits of each value to the even bit positions"""
+    v = v.astype(np.uint64)
+    for shift, mask in ((16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF), (4, 0x0F0F0F0F0F0F0F0F),
+                        (2, 0x3333333333333333), (1, 0x5555555555555555)):
+        v = (v | (v << np.uint64(shift))) & np.uint64(mask)
+    return v
+
+def morton(x, y) -> np.ndarray:
+    """Interleave integer tile/cell coordinates (x on even bits, y on odd bits)"""
+    return _spread_bits(np.asarray(x)) | (_spread_bits(np.asarray(y)) << np.uint64(1))
+
+def mercator(lat, lon) -> Tuple[np.ndarray, np.ndarray]:
+    """Web Mercator coordinates in [0, 1) (y grows southwards, as in map tiles)"""
+    lat = np.radians(np.clip(np.asarray(lat, dtype=np.float64), -MAX_LATITUDE, MAX_LATITUDE))
+    x = (np.asarray(lon, dtype=np.float64) + 180.0) / 360.0
+    y = (1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / np.pi) / 2.0
+    return x, y
+
+def _grid(value: np.ndarray, level: int) -> np.ndarray:
+    size = 1 << level
+    return np.clip(np.floor(value * size), 0, size - 1).astype(np.int64)
+
+def tiles_for_bbox(west: float, south: float, east: float, north: float, zoom: int) -> List[Tuple[int, int]]:
+    """(x, y) of the zoom-level tiles covering a lon/lat box (west > east crosses the antimeridian)"""
+    if east - west >= 360:
+        spans = [(-180.0, 180.0)]
+    else:
+        west = (west + 180.0) % 360.0 - 180.0
+        east = (east + 180.0) % 360.0 - 180.0
+        spans = [(west, east)] if west <= east else [(west, 180.0), (-180.0, east)]
+
+    _, top = mercator(north, 0.0)
+    _, bottom = mercator(south, 0.0)
+    y0, y1 = sorted((int(_grid(top, zoom)), int(_grid(bottom, zoom))))
+    columns = []
+    for span_west, span_east in spans:
+        x0 = int(_grid(mercator(0.0, span_west)[0], zoom))
+        x1 = int(_grid(mercator(0.0, np.nextafter(span_east, -np.inf))[0], zoom))
+        columns.extend(x for x in range(x0, x1 + 1) if x not in columns)
+
+    count = len(columns) * (y1 - y0 + 1)
+    if count > MAX_MAP_TILES:
+        raise ValueError(f"Viewport covers {count} tiles at zoom {zoom} (max {MAX_MAP_TILES}); zoom in")
+    return [(x, y) for y in range(y0, y1 + 1) for x in columns]
+
+def cap_bbox(lat: float, lon: float, radius_km: float) -> Tuple[float, float, float, float]:
+    """(west, south, east, north) box containing a circle; west/east may extend past +-180"""
+    angle = radius_km / EARTH_RADIUS_KM
+    south, north = lat - np.degrees(angle), lat + np.degrees(angle)
+    if south <= -90 or north >= 90 or angle >= np.pi / 2:
+        # The circle contains a pole: every longitude
+        west, east = -180.0, 180.0
+    else:
+        # Widest longitude span of the circle (reached poleward of its center)
+        span = np.degrees(np.arcsin(min(1.0, np.sin(angle) / np.cos(np.radians(lat)))))
+        west, east = (-180.0, 180.0) if span >= 180 else (lon - span, lon + span)
+    return west, max(south, -90.0), east, min(north, 90.0)
+
+def codes_for(lat, lon) -> np.ndarray:
+    """Morton codes of points at full depth (the sort key of the index)"""
+    x, y = mercator(lat, lon)
+    return morton(_grid(x, LEVELS), _grid(y, LEVELS))
+
+class SpatialIndex:
+    """Producers and consumers sorted by Morton code, with per-tile cluster aggregates"""
+
+    def __init__(self, producers, consumers):
+        self._columns = {'producer': producers, 'consumer': consumers}
+        # Parallel arrays sorted by code, swapped as one dict so readers never see a partial insert
+        self._data = {
+            'codes': np.empty(0, dtype=np.uint64),
+            'kind': np.empty(0, dtype=np.int8),
+            'rows': np.empty(0, dtype=np.int64),
+            'lat': np.empty(0, dtype=np.float64),
+            'lon': np.empty(0, dtype=np.float64),
+            'supply': np.empty(0, dtype=np.float64),
+            'demand': np.empty(0, dtype=np.float64)
+        }
+        self._tiles = OrderedDict()
+        self._tiles_lock = threading.Lock()
+        self.add_producers(producers, np.arange(len(producers)))
+        self.add_consumers(consumers, np.arange(len(consumers)))
+
+    def __len__(self) -> int:
+        return len(self._data['codes'])
+
+    def copy(self, producers, consumers) -> 'SpatialIndex':
+        """An index over extended copies of the columns, to insert into while readers use this one"""
+        index = copy.copy(self)
+        index._columns = {'producer': producers, 'consumer': consumers}
+        with self._tiles_lock:
+            index._tiles = OrderedDict(self._tiles)
+        index._tiles_lock = threading.Lock()
+        return index
+
+    def add_producers(self, producers, rows: np.ndarray):
+        self._insert(0, producers, rows)
+
+    def add_consumers(self, consumers, rows: np.ndarray):
+        self._insert(1, consumers, rows)
+
+    def _insert(self, kind: int, columns, rows: np.ndarray):
+        rows = np.asarray(rows, dtype=np.int64)
+        rows = rows[columns.has_location[rows]]
+        if len(rows) == 0:
+            return
+        lat = columns.lat[rows].astype(np.float64)
+        lon = columns.lon[rows].astype(np.float64)
+        codes = codes_for(lat, lon)
+        capacity = columns.capacity[rows].astype(np.float64)
+        new = {
+            'codes': codes,
+            'kind': np.full(len(rows), kind, dtype=np.int8),
+            'rows': rows,
+            'lat': lat,
+            'lon': lon,
+            'supply': capacity if kind == 0 else np.zeros(len(rows)),
+            'demand': capacity if kind == 1 else np.zeros(len(rows))
+        }
+
+        order = np.argsort(codes, kind='stable')
+        data = self._data
+        positions = np.searchsorted(data['codes'], codes[order], side='right')
+        self._data = {name: np.insert(data[name], positions, new[name][order]) for name in data}
+
+        # Drop cached tiles that now contain new entities (one per zoom level per entity)
+        with self._tiles_lock:
+            if self._tiles:
+                for zoom in range(MAX_ZOOM + 1):
+                    for quadkey in np.unique(codes >> np.uint64(2 * (LEVELS - zoom))):
+                        self._tiles.pop((zoom, int(quadkey)), None)
+
+    def clusters(self, west: float, south: float, east: float, north: float, zoom: int) -> List[Dict]:
+        """Clusters of every tile covering the box at this zoom level"""
+        zoom = int(np.clip(zoom, 0, MAX_ZOOM))
+        clusters = []
+        for x, y in tiles_for_bbox(west, south, east, north, zoom):
+            clusters.extend(self.tile_clusters(zoom, x, y))
+        return clusters
+
+    def rows_near(self, kind: str, lat: float, lon: float, radius_km: float) -> np.ndarray:
+        """Rows of one kind located in the lat/lon box around a circle (a superset of the circle)"""
+        west, south, east, north = cap_bbox(lat, lon, radius_km)
+        zoom = int(np.clip(np.log2(360.0 / max(east - west, 1e-9)) + 1, 0, MAX_ZOOM))
+        while True:
+            try:
+                tiles = tiles_for_bbox(west, south, east, north, zoom)
+                break
+            except ValueError:
+                zoom -= 1
+
+        data = self._data
+        shift = 2 * (LEVELS - zoom)
+        ranges = []
+        for x, y in tiles:
+            quadkey = int(morton(x, y))
+            start, end = np.searchsorted(data['codes'], [np.uint64(quadkey << shift), np.uint64((quadkey + 1) << shift)])
+            ranges.append(np.arange(start, end))
+        positions = np.concatenate(ranges) if ranges else np.empty(0, dtype=np.int64)
+        positions = positions[data['kind'][positions] == KINDS.index(kind)]
+        return data['rows'][positions]
+
+    def tile_clusters(self, zoom: int, x: int, y: int) -> List[Dict]:
+        key = (zoom, int(morton(x, y)))
+        with self._tiles_lock:
+            cached = self._tiles.get(key)
+            if cached is not None:
+                self._tiles.move_to_end(key)
+                return cached
+
+        clusters = self._aggregate(zoom, key[1])
+        with self._tiles_lock:
+            self._tiles[key] = clusters
+            while len(self._tiles) > MAP_TILE_CACHE_SIZE:
+                self._tiles.popitem(last=False)
+        return clusters
+
+    def _aggregate(self, zoom: int, quadkey: int) -> List[Dict]:
+        data = self._data
+        shift = 2 * (LEVELS - zoom)
+        start, end = np.searchsorted(data['codes'], [np.uint64(quadkey << shift), np.uint64((quadkey + 1) << shift)])
+        if start == end:
+            return []
+
+        cell_shift = np.uint64(2 * (LEVELS - zoom - CLUSTER_LEVELS))
+        cells = data['codes'][start:end] >> cell_shift
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(cells)) + 1))
+        counts = np.diff(np.append(starts, len(cells)))
+
+        def total(name):
+            return np.add.reduceat(data[name][start:end], starts)
+
+        lat, lon = total('lat') / counts, total('lon') / counts
+        producers = np.add.reduceat((data['kind'][start:end] == 0).astype(np.int64), starts)
+        supply, demand = total('supply'), total('demand')
+
+        clusters = []
+        for i, first in enumerate(starts):
+            cluster = {
+                'key': f"{zoom + CLUSTER_LEVELS}/{int(cells[first])}",
+                'lat': round(float(lat[i]), 6),
+                'lon': round(float(lon[i]), 6),
+                'count': int(counts[i]),
+                'producers': int(producers[i]),
+                'consumers': int(counts[i] - producers[i]),
+                'total_supply_tonnes_per_week': round(float(supply[i]), 2),
+                'total_demand_tonnes_per_week': round(float(demand[i]), 2)
+            }
+            if counts[i] == 1:
+                kind = KINDS[data['kind'][start + first]]
+                record = self._columns[kind].record(int(data['rows'][start + first]))
+                cluster['entity'] = {'kind': kind, 'id': record.get('id'), 'name': record.get('name')}
+            clusters.append(cluster)
+        return clusters
@@ -0,0 +1,104 @@
+"""Hashed TF-IDF features from entities' free-text `additional_info`
+
+Text is hashed into `TEXT_HASH_FEATURES` columns (unigrams and bigrams,
+English stop words removed) by scikit-learn's stateless HashingVectorizer.
+New entities can therefore be featurized without refitting a vocabulary.
+Document frequencies are counted per side (producers, consumers), and idf
+is taken over both. A full vector rebuild counts both sides before
+weighting any row, so all rows share one idf table. Entities added later
+are counted in and weighted with the idf current at that time. Rows are
+L2-normalized, so the dot product of a producer row and a consumer row is
+their cosine similarity.
+"""
+
+import os
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.preprocessing import normalize
+
+TEXT_HASH_FEATURES = 2 ** 18
+# Share of the vector similarity component taken by text similarity when both entities have text
+TEXT_SIMILARITY_WEIGHT = float(os.getenv('TEXT_SIMILARITY_WEIGHT', '0.3'))
+
+# One entity's sparse row: (column indices, values)
+TextRow = Tuple[np.ndarray, np.ndarray]
+
+class TextFeatures:
+    """Hashing featurizer with per-side document frequencies"""
+
+    def __init__(self, n_features: int = TEXT_HASH_FEATURES):
+        self.n_features = n_features
+        self._hasher = HashingVectorizer(n_features=n_features, alternate_sign=False, norm=None,
+                                         stop_words='english', ngram_range=(1, 2))
+        self.doc_freq = {kind: np.zeros(n_features, dtype=np.int64) for kind in ('producer', 'consumer')}
+        self.n_docs = {'producer': 0, 'consumer': 0}
+
+    def reset(self):
+        """Forget both sides' document frequencies"""
+        for kind in self.doc_freq:
+            self.doc_freq[kind][:] = 0
+            self.n_docs[kind] = 0
+
+    def rebuild(self, kind: str, texts: List[str]) -> sparse.csr_matrix:
+        """Features for a side's full corpus, replacing its document frequencies"""
+        self.doc_freq[kind][:] = 0
+        self.n_docs[kind] = 0
+        return self.add(kind, texts)
+
+    def add(self, kind: str, texts: List[str]) -> sparse.csr_matrix:
+        """Features for new documents, counting them into the side's document frequencies"""
+        counts = self._counts(texts)
+        self._count(kind, counts)
+        return self._weigh(counts)
+
+    def count(self, kind: str, texts: List[str]):
+        """Count documents into the side's document frequencies without featurizing them"""
+        self._count(kind, self._counts(texts))
+
+    def transform(self, texts: List[str]) -> sparse.csr_matrix:
+        """Features weighted by the current document frequencies, which are left as they are"""
+        return self._weigh(self._counts(texts))
+
+    def _counts(self, texts: List[str]) -> sparse.csr_matrix:
+        return self._hasher.transform([text if isinstance(text, str) else '' for text in texts]).tocsr()
+
+    def _count(self, kind: str, counts: sparse.csr_matrix):
+        self.doc_freq[kind] += np.bincount(counts.indices, minlength=self.n_features)
+        self.n_docs[kind] += counts.shape[0]
+
+    def _weigh(self, counts: sparse.csr_matrix) -> sparse.csr_matrix:
+        n_docs = sum(self.n_docs.values())
+        doc_freq = self.doc_freq['producer'] + self.doc_freq['consumer']
+        idf = np.log((1 + n_docs) / (1 + doc_freq[counts.indices])) + 1
+        counts.data = (1 + np.log(counts.data)) * idf
+        return normalize(counts).astype(np.float32)
+
+    def state(self) -> Dict:
+        return {'n_features': self.n_features, 'doc_freq': self.doc_freq, 'n_docs': self.n_docs}
+
+    def load_state(self, state: Dict):
+        if state.get('n_features') == self.n_features:
+            self.doc_freq = state['doc_freq']
+            self.n_docs = state['n_docs']
+
+def split_rows(matrix: sparse.csr_matrix) -> List[Optional[TextRow]]:
+    """Per-row (indices, values) of a CSR matrix, None for rows without text"""
+    rows = []
+    for i in range(matrix.shape[0]):
+        start, end = matrix.indptr[i], matrix.indptr[i + 1]
+        rows.append((matrix.indices[start:end].copy(), matrix.data[start:end].copy()) if end > start else None)
+    return rows
+
+def row_cosine(a: Optional[TextRow], b: Optional[TextRow]) -> Optional[float]:
+    """Cosine of two normalized rows, or None unless both have text"""
+    if a is None or b is None:
+        return None
+    _, ia, ib = np.intersect1d(a[0], b[0], assume_unique=True, return_indices=True)
+    return float(np.dot(a[1][ia], b[1][ib]))
+
+def blend(vector_similarity, text_similarity):
+    """Vector similarity with the text share mixed in"""
+    return (1 - TEXT_SIMILARITY_WEIGHT) * vector_similarity + TEXT_SIMILARITY_WEIGHT * text_similarity
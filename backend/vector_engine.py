@@ -3,68 +3,121 @@ import json
 import pickle
 import os
 from pathlib import Path
+from functools import lru_cache
 from typing import Dict, List, Tuple, Optional
 import logging
 
+import metrics
+from text_features import TEXT_HASH_FEATURES, TextFeatures, blend, row_cosine, split_rows
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def _number(value) -> float:
+    """Coerce a numeric field the way the per-entity generators accept it"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    raise TypeError(f"expected a number, got {type(value).__name__}")
+
+@lru_cache(maxsize=None)
+def _center_array(center_type: str) -> np.ndarray:
+    return np.array(VectorEngine.major_centers[center_type])
+
 class VectorEngine:
-    def __init__(self):
-        # Use environment variable for vector directory or default
-        vector_dir_path = os.getenv('VECTOR_CACHE_DIR', './vectors')
+    # Industry mappings
+    producer_industries = {
+        'Cement Manufacturing': 0,
+        'Ethanol Production': 1,
+        'Petrochemical': 2,
+        'Power Generation': 3,
+        'Chemical': 4,
+        'Steel': 5,
+        'Manufacturing': 6,
+        'Other': 7
+    }
+    
+    consumer_industries = {
+        'Concrete Curing': 0,
+        'Vertical Farming': 1,
+        'Biofuel Synthesis': 2,
+        'Beverage Carbonation': 3,
+        'Chemical Synthesis': 4,
+        'Food Processing': 5,
+        'Manufacturing': 6,
+        'Other': 7
+    }
+    
+    # Transportation methods
+    transport_methods = {
+        'Truck': 0,
+        'Rail': 1,
+        'Pipeline': 2,
+        'Ship': 3,
+        'Tank Truck': 4,
+        'Other': 5
+    }
+    
+    # Geographic regions (simplified US regions)
+    regions = {
+        'West': 0,
+        'East': 1,
+        'South': 2,
+        'Central': 3
+    }
+    
+    # Capacity tier upper bounds (tonnes per week), mirroring normalize_capacity
+    producer_capacity_tiers = (200, 500, 1000)
+    consumer_capacity_tiers = (100, 300, 600)
+    
+    # Quality requirement profiles by consumer industry
+    # [food_grade, industrial, premium, standard]
+    quality_profiles = {
+        'Beverage Carbonation': [1.0, 0.0, 1.0, 0.0],  # Food grade, premium
+        'Food Processing': [1.0, 0.0, 1.0, 0.0],       # Food grade, premium
+        'Chemical Synthesis': [0.0, 1.0, 1.0, 0.0],    # Industrial, premium
+        'Concrete Curing': [0.0, 1.0, 0.0, 1.0],       # Industrial, standard
+        'Vertical Farming': [0.0, 1.0, 0.5, 0.5],      # Industrial, mixed
+        'Biofuel Synthesis': [0.0, 1.0, 0.0, 1.0],     # Industrial, standard
+        'Manufacturing': [0.0, 1.0, 0.0, 1.0],         # Industrial, standard
+    }
+    default_quality_profile = [0.0, 1.0, 0.0, 1.0]
+    
+    # Major centers coordinates (simplified)
+    major_centers = {
+        'industrial': [
+            (34.0522, -118.2437),  # Los Angeles
+            (41.8781, -87.6298),   # Chicago
+            (29.7604, -95.3698),   # Houston
+            (40.7128, -74.0060),   # New York
+        ],
+        'transport': [
+            (33.7490, -84.3880),   # Atlanta
+            (39.7392, -104.9903),  # Denver
+            (47.6062, -122.3321),  # Seattle
+            (25.7617, -80.1918),   # Miami
+        ]
+    }
+    
+    # Vector dimensions
+    PRODUCER_VECTOR_SIZE = 32
+    CONSUMER_VECTOR_SIZE = 28
+    
+    def __init__(self, vector_dir: Optional[str] = None):
+        # Use the given directory, else the environment variable or default
+        vector_dir_path = vector_dir or os.getenv('VECTOR_CACHE_DIR', './vectors')
         self.vector_dir = Path(vector_dir_path)
         self.vector_dir.mkdir(exist_ok=True)
         
-        # Industry mappings
-        self.producer_industries = {
-            'Cement Manufacturing': 0,
-            'Ethanol Production': 1,
-            'Petrochemical': 2,
-            'Power Generation': 3,
-            'Chemical': 4,
-            'Steel': 5,
-            'Manufacturing': 6,
-            'Other': 7
-        }
-        
-        self.consumer_industries = {
-            'Concrete Curing': 0,
-            'Vertical Farming': 1,
-            'Biofuel Synthesis': 2,
-            'Beverage Carbonation': 3,
-            'Chemical Synthesis': 4,
-            'Food Processing': 5,
-            'Manufacturing': 6,
-            'Other': 7
-        }
-        
-        # Transportation methods
-        self.transport_methods = {
-            'Truck': 0,
-            'Rail': 1,
-            'Pipeline': 2,
-            'Ship': 3,
-            'Tank Truck': 4,
-            'Other': 5
-        }
-        
-        # Geographic regions (simplified US regions)
-        self.regions = {
-            'West': 0,
-            'East': 1,
-            'South': 2,
-            'Central': 3
-        }
-        
-        # Vector dimensions
-        self.PRODUCER_VECTOR_SIZE = 32
-        self.CONSUMER_VECTOR_SIZE = 28
-        
         # Cache for vectors
         self.producer_vectors = {}
         self.consumer_vectors = {}
+        # Sparse TF-IDF rows of additional_info, (indices, values) by id; entities without text are absent
+        self.text_features = TextFeatures()
+        self.producer_text = {}
+        self.consumer_text = {}
+        # Bumped whenever the vector sets change so dependent caches can resync
+        self.version = 0
         
         # Load existing vectors if available
         self.load_vectors()
@@ -224,38 +277,12 @@ class VectorEngine:
     
     def _infer_quality_requirements(self, industry: str) -> np.ndarray:
         """Infer quality requirements based on industry"""
-        # [food_grade, industrial, premium, standard]
-        quality_map = {
-            'Beverage Carbonation': [1.0, 0.0, 1.0, 0.0],  # Food grade, premium
-            'Food Processing': [1.0, 0.0, 1.0, 0.0],       # Food grade, premium
-            'Chemical Synthesis': [0.0, 1.0, 1.0, 0.0],    # Industrial, premium
-            'Concrete Curing': [0.0, 1.0, 0.0, 1.0],       # Industrial, standard
-            'Vertical Farming': [0.0, 1.0, 0.5, 0.5],      # Industrial, mixed
-            'Biofuel Synthesis': [0.0, 1.0, 0.0, 1.0],     # Industrial, standard
-            'Manufacturing': [0.0, 1.0, 0.0, 1.0],         # Industrial, standard
-        }
-        return np.array(quality_map.get(industry, [0.0, 1.0, 0.0, 1.0]))
+        return np.array(self.quality_profiles.get(industry, self.default_quality_profile))
     
     def _distance_to_major_center(self, lat: float, lon: float, center_type: str) -> float:
         """Calculate normalized distance to major industrial/transport centers"""
-        # Major centers coordinates (simplified)
-        centers = {
-            'industrial': [
-                (34.0522, -118.2437),  # Los Angeles
-                (41.8781, -87.6298),   # Chicago
-                (29.7604, -95.3698),   # Houston
-                (40.7128, -74.0060),   # New York
-            ],
-            'transport': [
-                (33.7490, -84.3880),   # Atlanta
-                (39.7392, -104.9903),  # Denver
-                (47.6062, -122.3321),  # Seattle
-                (25.7617, -80.1918),   # Miami
-            ]
-        }
-        
         min_distance = float('inf')
-        for center_lat, center_lon in centers[center_type]:
+        for center_lat, center_lon in self.major_centers[center_type]:
             # Simple distance calculation
             distance = np.sqrt((lat - center_lat)**2 + (lon - center_lon)**2)
             min_distance = min(min_distance, distance)
@@ -263,19 +290,201 @@ class VectorEngine:
         # Normalize to 0-1 (assuming max distance of ~50 degrees)
         return min(1.0, min_distance / 50.0)
     
+    # --- Batch (columnar) vector generation ---
+    # These produce exactly the same vectors as generate_producer_vector /
+    # generate_consumer_vector, but for a whole entity set at once.
+    
+    def transport_mask(self, methods: List[str]) -> int:
+        """Encode transportation methods as a bitmask over transport_methods"""
+        mask = 0
+        for method in methods:
+            mask |= 1 << self.transport_methods.get(method, 5)
+        return mask
+    
+    def producer_columns(self, producers: List[Dict]) -> Dict[str, np.ndarray]:
+        """Extract the columns vector generation needs from producer records
+        
+        Records the per-entity generator would reject (missing id, malformed
+        numbers or location) are logged and left out.
+        """
+        ids, supply, annual, industry, purity = [], [], [], [], []
+        has_location, lat, lon, transport = [], [], [], []
+        for producer in producers:
+            producer_id = producer.get('id')
+            if not producer_id:
+                continue
+            try:
+                location = producer.get('location', {})
+                row = (
+                    _number(producer.get('co2_supply_tonnes_per_week', 0)),
+                    _number(producer.get('co2_output_tonnes_per_year', 0)),
+                    self.producer_industries.get(producer.get('industry_type', 'Other'), 7),
+                    _number(producer.get('co2_purity', 90)),
+                    bool(location),
+                    _number(location.get('lat', 0)) if location else 0.0,
+                    _number(location.get('lon', 0)) if location else 0.0,
+                    self.transport_mask(producer.get('transportation_methods', []))
+                )
+            except Exception as e:
+                logger.error(f"Error generating vector for producer {producer_id}: {e}")
+                continue
+            ids.append(producer_id)
+            for column, value in zip((supply, annual, industry, purity, has_location, lat, lon, transport), row):
+                column.append(value)
+        
+        return {
+            'ids': ids,
+            'supply': np.array(supply, dtype=np.float64),
+            'annual': np.array(annual, dtype=np.float64),
+            'industry': np.array(industry, dtype=np.int64),
+            'purity': np.array(purity, dtype=np.float64),
+            'has_location': np.array(has_location, dtype=bool),
+            'lat': np.array(lat, dtype=np.float64),
+            'lon': np.array(lon, dtype=np.float64),
+            'transport': np.array(transport, dtype=np.int64)
+        }
+    
+    def consumer_columns(self, consumers: List[Dict]) -> Dict[str, np.ndarray]:
+        """Extract the columns vector generation needs from consumer records"""
+        ids, demand, industry, has_location, lat, lon = [], [], [], [], [], []
+        for consumer in consumers:
+            consumer_id = consumer.get('id')
+            if not consumer_id:
+                continue
+            try:
+                location = consumer.get('location', {})
+                row = (
+                    _number(consumer.get('co2_demand_tonnes_per_week', 0)),
+                    self.consumer_industries.get(consumer.get('industry', 'Other'), 7),
+                    bool(location),
+                    _number(location.get('lat', 0)) if location else 0.0,
+                    _number(location.get('lon', 0)) if location else 0.0
+                )
+            except Exception as e:
+                logger.error(f"Error generating vector for consumer {consumer_id}: {e}")
+                continue
+            ids.append(consumer_id)
+            for column, value in zip((demand, industry, has_location, lat, lon), row):
+                column.append(value)
+        
+        return {
+            'ids': ids,
+            'demand': np.array(demand, dtype=np.float64),
+            'industry': np.array(industry, dtype=np.int64),
+            'has_location': np.array(has_location, dtype=bool),
+            'lat': np.array(lat, dtype=np.float64),
+            'lon': np.array(lon, dtype=np.float64)
+        }
+    
+    def get_geographic_regions(self, lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+        """Vectorized get_geographic_region"""
+        return np.select(
+            [lon < -100, lon > -80, lat < 35],
+            [self.regions['West'], self.regions['East'], self.regions['South']],
+            default=self.regions['Central']
+        )
+    
+    def _distances_to_major_center(self, lat: np.ndarray, lon: np.ndarray, center_type: str) -> np.ndarray:
+        """Vectorized _distance_to_major_center against the precomputed center array"""
+        centers = _center_array(center_type)
+        # float_power calls libm pow like Python's float ** does, which keeps
+        # results bit-identical to the scalar path (x * x can differ by 1 ULP)
+        distances = np.sqrt(
+            np.float_power(lat[:, None] - centers[:, 0], 2) + np.float_power(lon[:, None] - centers[:, 1], 2)
+        )
+        return np.minimum(1.0, distances.min(axis=1) / 50.0)
+    
+    def _location_embedding(self, lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+        """Vectorized 8-dimension location embedding"""
+        embedding = np.empty((len(lat), 8))
+        embedding[:, 0] = (lat + 90) / 180.0
+        embedding[:, 1] = (lon + 180) / 360.0
+        embedding[:, 2] = np.sin(np.radians(lat))
+        embedding[:, 3] = np.cos(np.radians(lat))
+        embedding[:, 4] = np.sin(np.radians(lon))
+        embedding[:, 5] = np.cos(np.radians(lon))
+        embedding[:, 6] = self._distances_to_major_center(lat, lon, 'industrial')
+        embedding[:, 7] = self._distances_to_major_center(lat, lon, 'transport')
+        return embedding
+    
+    def generate_producer_vectors_batch(self, columns: Dict[str, np.ndarray]) -> np.ndarray:
+        """Generate the producer feature matrix (one row per producer) from columns"""
+        n = len(columns['supply'])
+        matrix = np.zeros((n, self.PRODUCER_VECTOR_SIZE))
+        rows = np.arange(n)
+        
+        # 1. Capacity tier (4D one-hot)
+        tiers = np.searchsorted(self.producer_capacity_tiers, columns['supply'], side='right')
+        matrix[rows, tiers] = 1.0
+        
+        # 2. Industry type (8D one-hot)
+        matrix[rows, 4 + columns['industry']] = 1.0
+        
+        # 3. CO2 purity (1D)
+        matrix[:, 12] = np.maximum(0, np.minimum(1, columns['purity'] / 100.0))
+        
+        # 4. Geographic region (4D one-hot)
+        located = np.flatnonzero(columns['has_location'])
+        lat = columns['lat'][located]
+        lon = columns['lon'][located]
+        matrix[located, 13 + self.get_geographic_regions(lat, lon)] = 1.0
+        
+        # 5. Transportation methods (6D multi-hot)
+        bits = np.arange(len(self.transport_methods))
+        matrix[:, 17:23] = (columns['transport'][:, None] >> bits) & 1
+        
+        # 6. Supply consistency (1D)
+        supply = columns['supply']
+        producing = supply > 0
+        matrix[producing, 23] = np.minimum(1.0, columns['annual'][producing] / (supply[producing] * 52))
+        
+        # 7. Location embedding (8D)
+        matrix[located, 24:32] = self._location_embedding(lat, lon)
+        return matrix
+    
+    def generate_consumer_vectors_batch(self, columns: Dict[str, np.ndarray]) -> np.ndarray:
+        """Generate the consumer feature matrix (one row per consumer) from columns"""
+        n = len(columns['demand'])
+        matrix = np.zeros((n, self.CONSUMER_VECTOR_SIZE))
+        rows = np.arange(n)
+        
+        # 1. Demand tier (4D one-hot)
+        tiers = np.searchsorted(self.consumer_capacity_tiers, columns['demand'], side='right')
+        matrix[rows, tiers] = 1.0
+        
+        # 2. Industry type (8D one-hot)
+        matrix[rows, 4 + columns['industry']] = 1.0
+        
+        # 3. Geographic region (4D one-hot)
+        located = np.flatnonzero(columns['has_location'])
+        lat = columns['lat'][located]
+        lon = columns['lon'][located]
+        matrix[located, 12 + self.get_geographic_regions(lat, lon)] = 1.0
+        
+        # 4. Quality requirements (4D, by industry code)
+        matrix[:, 16:20] = self._quality_profile_table()[columns['industry']]
+        
+        # 5. Location embedding (8D)
+        matrix[located, 20:28] = self._location_embedding(lat, lon)
+        return matrix
+    
+    def _quality_profile_table(self) -> np.ndarray:
+        """Quality requirement profiles indexed by consumer industry code"""
+        table = np.array([self.default_quality_profile] * len(self.consumer_industries))
+        for industry, code in self.consumer_industries.items():
+            table[code] = self.quality_profiles.get(industry, self.default_quality_profile)
+        return table
+    
     def update_producer_vectors(self, producers: List[Dict]):
         """Update all producer vectors"""
         logger.info(f"Updating vectors for {len(producers)} producers")
-        self.producer_vectors = {}
+        metrics.VECTOR_REBUILDS.inc(kind='producer')
         
-        for producer in producers:
-            producer_id = producer.get('id')
-            if producer_id:
-                try:
-                    vector = self.generate_producer_vector(producer)
-                    self.producer_vectors[producer_id] = vector
-                except Exception as e:
-                    logger.error(f"Error generating vector for producer {producer_id}: {e}")
+        columns = self.producer_columns(producers)
+        matrix = self.generate_producer_vectors_batch(columns)
+        self.producer_vectors = dict(zip(columns['ids'], matrix))
+        self.producer_text = self._text_rows('producer', producers, columns['ids'], rebuild=True)
+        self.version += 1
         
         self.save_vectors()
         logger.info(f"Successfully updated {len(self.producer_vectors)} producer vectors")
@@ -283,20 +492,82 @@ class VectorEngine:
     def update_consumer_vectors(self, consumers: List[Dict]):
         """Update all consumer vectors"""
         logger.info(f"Updating vectors for {len(consumers)} consumers")
-        self.consumer_vectors = {}
+        metrics.VECTOR_REBUILDS.inc(kind='consumer')
         
-        for consumer in consumers:
-            consumer_id = consumer.get('id')
-            if consumer_id:
-                try:
-                    vector = self.generate_consumer_vector(consumer)
-                    self.consumer_vectors[consumer_id] = vector
-                except Exception as e:
-                    logger.error(f"Error generating vector for consumer {consumer_id}: {e}")
+        columns = self.consumer_columns(consumers)
+        matrix = self.generate_consumer_vectors_batch(columns)
+        self.consumer_vectors = dict(zip(columns['ids'], matrix))
+        self.consumer_text = self._text_rows('consumer', consumers, columns['ids'], rebuild=True)
+        self.version += 1
         
         self.save_vectors()
         logger.info(f"Successfully updated {len(self.consumer_vectors)} consumer vectors")
     
+    def update_all_vectors(self, producers: List[Dict], consumers: List[Dict]):
+        """Update all producer and consumer vectors
+        
+        Both sides' text document frequencies are counted before any row is
+        weighted, so producer and consumer rows share one idf table whatever
+        frequencies were held before.
+        """
+        logger.info(f"Updating vectors for {len(producers)} producers and {len(consumers)} consumers")
+        metrics.VECTOR_REBUILDS.inc(kind='producer')
+        metrics.VECTOR_REBUILDS.inc(kind='consumer')
+        
+        producer_columns = self.producer_columns(producers)
+        consumer_columns = self.consumer_columns(consumers)
+        self.text_features.reset()
+        self.text_features.count('producer', self._texts(producers, producer_columns['ids']))
+        self.text_features.count('consumer', self._texts(consumers, consumer_columns['ids']))
+        
+        self.producer_vectors = dict(zip(producer_columns['ids'], self.generate_producer_vectors_batch(producer_columns)))
+        self.consumer_vectors = dict(zip(consumer_columns['ids'], self.generate_consumer_vectors_batch(consumer_columns)))
+        self.producer_text = self._text_rows('producer', producers, producer_columns['ids'], count=False)
+        self.consumer_text = self._text_rows('consumer', consumers, consumer_columns['ids'], count=False)
+        self.version += 1
+        
+        self.save_vectors()
+        logger.info(f"Successfully updated {len(self.producer_vectors)} producer and "
+                    f"{len(self.consumer_vectors)} consumer vectors")
+    
+    def add_producer_vectors(self, producers: List[Dict], count_text: bool = True) -> List[str]:
+        """Generate vectors for just these producers, leaving the rest untouched
+        
+        Unlike update_producer_vectors this does not bump `version`; callers
+        holding gathered copies refresh the affected entities themselves.
+        With count_text=False the text is weighted by the current document
+        frequencies without being counted into them (already counted).
+        """
+        columns = self.producer_columns(producers)
+        self.producer_vectors.update(zip(columns['ids'], self.generate_producer_vectors_batch(columns)))
+        self.producer_text.update(self._text_rows('producer', producers, columns['ids'], count=count_text))
+        return columns['ids']
+    
+    def add_consumer_vectors(self, consumers: List[Dict], count_text: bool = True) -> List[str]:
+        """Generate vectors for just these consumers, leaving the rest untouched"""
+        columns = self.consumer_columns(consumers)
+        self.consumer_vectors.update(zip(columns['ids'], self.generate_consumer_vectors_batch(columns)))
+        self.consumer_text.update(self._text_rows('consumer', consumers, columns['ids'], count=count_text))
+        return columns['ids']
+    
+    def _text_rows(self, kind: str, records: List[Dict], ids: List[str], rebuild: bool = False,
+                   count: bool = True) -> Dict:
+        """TF-IDF rows of additional_info for the given ids, in one batch"""
+        texts = self._texts(records, ids)
+        if rebuild:
+            matrix = self.text_features.rebuild(kind, texts)
+        elif count:
+            matrix = self.text_features.add(kind, texts)
+        else:
+            matrix = self.text_features.transform(texts)
+        return {entity_id: row for entity_id, row in zip(ids, split_rows(matrix)) if row is not None}
+    
+    @staticmethod
+    def _texts(records: List[Dict], ids: List[str]) -> List[Optional[str]]:
+        """additional_info of the given ids, in order"""
+        info = {record.get('id'): record.get('additional_info') for record in records}
+        return [info.get(entity_id) for entity_id in ids]
+    
     def save_vectors(self):
         """Save vectors to disk"""
         try:
@@ -308,6 +579,11 @@ class VectorEngine:
             with open(self.vector_dir / "consumer_vectors.pkl", 'wb') as f:
                 pickle.dump(self.consumer_vectors, f)
             
+            # Save text features with the document frequencies new entities are weighted by
+            with open(self.vector_dir / "text_features.pkl", 'wb') as f:
+                pickle.dump({'producer': self.producer_text, 'consumer': self.consumer_text,
+                             'state': self.text_features.state()}, f)
+            
             logger.info("Vectors saved successfully")
         except Exception as e:
             logger.error(f"Error saving vectors: {e}")
@@ -325,16 +601,35 @@ class VectorEngine:
                 with open(self.vector_dir / "consumer_vectors.pkl", 'rb') as f:
                     self.consumer_vectors = pickle.load(f)
             
+            # Load text features
+            if (self.vector_dir / "text_features.pkl").exists():
+                with open(self.vector_dir / "text_features.pkl", 'rb') as f:
+                    text = pickle.load(f)
+                self.producer_text = text['producer']
+                self.consumer_text = text['consumer']
+                self.text_features.load_state(text['state'])
+            
             logger.info(f"Loaded {len(self.producer_vectors)} producer vectors and {len(self.consumer_vectors)} consumer vectors")
         except Exception as e:
             logger.error(f"Error loading vectors: {e}")
             self.producer_vectors = {}
             self.consumer_vectors = {}
+            self.producer_text = {}
+            self.consumer_text = {}
+        self.version += 1
     
     def get_vector_similarity(self, producer_id: str, consumer_id: str) -> float:
+        """Cosine similarity of producer and consumer vectors, blended with their text similarity"""
+        similarity = self._dense_similarity(producer_id, consumer_id)
+        text = row_cosine(self.producer_text.get(producer_id), self.consumer_text.get(consumer_id))
+        return similarity if text is None else blend(similarity, text)
+    
+    def _dense_similarity(self, producer_id: str, consumer_id: str) -> float:
         """Calculate cosine similarity between producer and consumer vectors"""
         if producer_id not in self.producer_vectors or consumer_id not in self.consumer_vectors:
+            metrics.cache_miss('vectors')
             return 0.0
+        metrics.cache_hit('vectors')
         
         producer_vector = self.producer_vectors[producer_id]
         consumer_vector = self.consumer_vectors[consumer_id]
@@ -363,8 +658,7 @@ class VectorEngine:
                 db = json.load(f)
             
             # Update vectors
-            self.update_producer_vectors(db.get('producers', []))
-            self.update_consumer_vectors(db.get('consumers', []))
+            self.update_all_vectors(db.get('producers', []), db.get('consumers', []))
             
             logger.info("All vectors rebuilt successfully")
         except Exception as e:
@@ -378,5 +672,10 @@ class VectorEngine:
             'vector_dimensions': {
                 'producer': self.PRODUCER_VECTOR_SIZE,
                 'consumer': self.CONSUMER_VECTOR_SIZE
+            },
+            'text_features': {
+                'producer': len(self.producer_text),
+                'consumer': len(self.consumer_text),
+                'hash_size': TEXT_HASH_FEATURES
             }
         } 
\ No newline at end of file
@@ -41,7 +41,7 @@ test_backend() {
     }
     
     # Test Flask app
-    python3 -c "from app import app; print('✅ Flask app test passed')" || {
+    python3 -c "from app import create_app; create_app(); print('✅ Flask app test passed')" || {
         echo -e "${RED}❌ Flask app test failed${NC}"
         return 1
     }
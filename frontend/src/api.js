@@ -1,5 +1,7 @@
 // frontend/src/api.js
 
+import { getAuthHeaders } from './utils/auth';
+
 // Use environment variable for API base URL, fallback to Railway URL for production
 const API_BASE_URL = import.meta.env.VITE_API_BASE_URL || 'https://carbonflow-production.up.railway.app';
 
@@ -40,11 +42,36 @@ const fetchWithTimeout = async (url, options = {}) => {
   }
 };
 
+// Heavy endpoints answer 202 with a background job; poll /api/jobs/<id> until it finishes
+export const awaitJob = async (response, { intervalMs = 1000, timeoutMs = 180000 } = {}) => {
+  if (response.status !== 202) {
+    return response.json();
+  }
+  const { job_id } = await response.json();
+  const deadline = Date.now() + timeoutMs;
+  while (Date.now() < deadline) {
+    await new Promise((resolve) => setTimeout(resolve, intervalMs));
+    const poll = await fetchWithTimeout(`${API_BASE_URL}/api/jobs/${job_id}`);
+    if (!poll.ok) {
+      throw new Error(`Failed to get job status: ${poll.status} ${poll.statusText}`);
+    }
+    const job = await poll.json();
+    if (job.status === 'succeeded') {
+      return job.result;
+    }
+    if (job.status === 'failed') {
+      throw new Error(job.error || 'Background job failed');
+    }
+  }
+  throw new Error('Timed out waiting for background job');
+};
+
 export const addProducer = async (producerData) => {
   try {
+    // Signed-in users own what they register and are notified when it gains matches
     const response = await fetchWithTimeout(`${API_BASE_URL}/api/producers`, {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
+      headers: getAuthHeaders(),
       body: JSON.stringify(producerData),
     });
     if (!response.ok) { 
@@ -61,7 +88,7 @@ export const addConsumer = async (consumerData) => {
   try {
     const response = await fetchWithTimeout(`${API_BASE_URL}/api/consumers`, {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
+      headers: getAuthHeaders(),
       body: JSON.stringify(consumerData),
     });
     if (!response.ok) { 
@@ -145,9 +172,11 @@ export const getMatches = async (producerId) => {
   }
 };
 
-export const getConsumerMatches = async (consumerId) => {
+// With `pools`, resolves to { matches, pools }: pools are producer groups that jointly cover the demand
+export const getConsumerMatches = async (consumerId, { pools } = {}) => {
   try {
-    const response = await fetchWithTimeout(`${API_BASE_URL}/api/consumers/${consumerId}/matches`);
+    const query = pools ? `?pools=${pools}` : '';
+    const response = await fetchWithTimeout(`${API_BASE_URL}/api/consumers/${consumerId}/matches${query}`);
     if (!response.ok) { 
       throw new Error(`Failed to fetch consumer matches: ${response.status} ${response.statusText}`); 
     }
@@ -155,7 +184,7 @@ export const getConsumerMatches = async (consumerId) => {
   } catch (error) {
     console.error('Error fetching consumer matches:', error);
     // Return mock data if API is down
-    return [
+    const matches = [
       {
         id: 'demo-producer-match-1',
         name: 'Demo Producer',
@@ -164,6 +193,7 @@ export const getConsumerMatches = async (consumerId) => {
         co2_supply_tonnes_per_week: 1000
       }
     ];
+    return pools ? { matches, pools: [] } : matches;
   }
 };
 
@@ -177,7 +207,7 @@ export const getAnalyzedMatches = async (producer, matches) => {
     if (!response.ok) { 
       throw new Error(`Failed to get AI analysis for matches: ${response.status} ${response.statusText}`); 
     }
-    return response.json();
+    return awaitJob(response);
   } catch (error) {
     console.error('Error analyzing matches:', error);
     // Return mock analysis if API is down
@@ -235,4 +265,53 @@ export const geocodeAddress = async (address) => {
     console.error('Error geocoding address:', error);
     throw new Error('Failed to geocode address. Please check if the address is valid.');
   }
-};
\ No newline at end of file
+};
+// Clustered producers and consumers for the visible map area (bounded payload at any marketplace size)
+export const getMapClusters = async ({ west, south, east, north }, zoom) => {
+  const bbox = [west, south, east, north].map((v) => v.toFixed(5)).join(',');
+  const response = await fetchWithTimeout(`${API_BASE_URL}/api/map/clusters?bbox=${bbox}&zoom=${zoom}`);
+  if (!response.ok) {
+    throw new Error(`Failed to fetch map clusters: ${response.status} ${response.statusText}`);
+  }
+  return response.json();
+};
+
+// Geocode many addresses at once; onResult receives each {index, address, lat, lon | error} as it streams in
+export const geocodeAddresses = async (addresses, onResult) => {
+  const response = await fetch(`${API_BASE_URL}/api/geocode/batch`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ addresses }),
+  });
+  if (!response.ok) {
+    throw new Error(`Failed to geocode addresses: ${response.status} ${response.statusText}`);
+  }
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  const results = new Array(addresses.length);
+  let buffered = '';
+  for (;;) {
+    const { done, value } = await reader.read();
+    buffered += decoder.decode(value || new Uint8Array(), { stream: !done });
+    const lines = buffered.split('\n');
+    buffered = lines.pop();
+    for (const line of lines.filter(Boolean)) {
+      const result = JSON.parse(line);
+      results[result.index] = result;
+      if (onResult) onResult(result);
+    }
+    if (done) return results;
+  }
+};
+
+// Search producers and consumers by name, industry or description; the last word autocompletes
+export const searchEntities = async (query, { role, industry, limit = 10 } = {}) => {
+  const params = new URLSearchParams({ q: query, limit: String(limit) });
+  if (role) params.set('role', role);
+  if (industry) params.set('industry', industry);
+  const response = await fetchWithTimeout(`${API_BASE_URL}/api/search?${params}`);
+  if (!response.ok) {
+    throw new Error(`Failed to search: ${response.status} ${response.statusText}`);
+  }
+  return (await response.json()).results;
+};
@@ -64,16 +64,8 @@ function MainLayout() {
     window.addEventListener('storage', updateCount);
     window.addEventListener('watchlistUpdated', updateCount);
 
-    // Mock notifications for demo
+    // Mock notifications for demo (match notifications come from the API once signed in)
     setNotifications([
-      {
-        id: 1,
-        type: 'match',
-        title: 'New Match Found',
-        message: 'A high-quality match for Industrial Solutions Ltd has been identified',
-        time: '2 minutes ago',
-        unread: true
-      },
       {
         id: 2,
         type: 'system',
@@ -114,6 +106,23 @@ function MainLayout() {
     };
   }, []);
 
+  useEffect(() => {
+    if (!user) return;
+    authAPI.getNotifications()
+      .then(({ notifications: items }) => {
+        const matches = items.reverse().map(item => ({
+          id: `match-${item.id}`,
+          type: 'match',
+          title: 'New Match Found',
+          message: `${item.match.name} is now #${item.match.rank} in ${item.entity.name}'s matches`,
+          time: new Date(`${item.created_at}Z`).toLocaleString(),
+          unread: true
+        }));
+        setNotifications(prev => [...matches, ...prev.filter(n => n.type !== 'match')]);
+      })
+      .catch(error => console.warn('Failed to load notifications:', error));
+  }, [user]);
+
   const handleLogin = async (email, password) => {
     try {
       const response = await authAPI.login(email, password);
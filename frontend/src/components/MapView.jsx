@@ -1,10 +1,11 @@
 // frontend/src/components/MapView.jsx
 
-import React, { useEffect } from 'react';
-import { MapContainer, TileLayer, Marker, Popup, useMap } from 'react-leaflet';
+import React, { useEffect, useState } from 'react';
+import { MapContainer, TileLayer, Marker, Popup, CircleMarker, useMap, useMapEvents } from 'react-leaflet';
 import L from 'leaflet';
 import { GeoSearchControl, OpenStreetMapProvider } from 'leaflet-geosearch';
 import 'leaflet-geosearch/dist/geosearch.css';
+import { getMapClusters } from '../api';
 
 // --- HELPER COMPONENT #1: To change the map's view ---
 function ChangeView({ focus }) {
@@ -47,6 +48,45 @@ const SearchField = ({ onLocationSelect }) => {
   return null;
 };
 
+// --- HELPER COMPONENT #3: Server-side clusters of the whole marketplace in view ---
+const MarketplaceClusters = () => {
+  const [clusters, setClusters] = useState([]);
+
+  const load = async (map) => {
+    const bounds = map.getBounds();
+    try {
+      const data = await getMapClusters({
+        west: bounds.getWest(), south: bounds.getSouth(), east: bounds.getEast(), north: bounds.getNorth()
+      }, map.getZoom());
+      setClusters(data.clusters);
+    } catch (error) {
+      console.warn('Map clusters unavailable:', error);
+    }
+  };
+
+  const map = useMapEvents({ moveend: () => load(map) });
+  useEffect(() => { load(map); }, [map]);
+
+  return clusters.map((cluster) => (
+    <CircleMarker
+      key={cluster.key}
+      center={[cluster.lat, cluster.lon]}
+      radius={Math.min(30, 6 + 4 * Math.log2(cluster.count))}
+      pathOptions={{ color: cluster.producers >= cluster.consumers ? '#2e7d32' : '#1565c0', fillOpacity: 0.4 }}
+    >
+      <Popup>
+        {cluster.entity ? (
+          <strong>{cluster.entity.kind === 'producer' ? 'Producer' : 'Consumer'}: {cluster.entity.name}</strong>
+        ) : (
+          <strong>{cluster.count} organizations</strong>
+        )}
+        <div>{cluster.producers} producers · {cluster.total_supply_tonnes_per_week} t/week supply</div>
+        <div>{cluster.consumers} consumers · {cluster.total_demand_tonnes_per_week} t/week demand</div>
+      </Popup>
+    </CircleMarker>
+  ));
+};
+
 // --- Icon Fix ---
 delete L.Icon.Default.prototype._getIconUrl;
 L.Icon.Default.mergeOptions({
@@ -67,7 +107,7 @@ const consumerIcon = new L.Icon({
 
 
 // --- Main MapView Component ---
-function MapView({ selectedConsumer, matches = [], onLocationSelect, mapFocus }) { // Changed prop name
+function MapView({ selectedConsumer, matches = [], onLocationSelect, mapFocus, showMarketplace = true }) { // Changed prop name
   const mapCenter = [39.8283, -98.5795];
   const zoomLevel = 4;
   const focusZoomLevel = 9;
@@ -92,6 +132,8 @@ function MapView({ selectedConsumer, matches = [], onLocationSelect, mapFocus })
         {/* onLocationSelect is now optional */}
         {onLocationSelect && <SearchField onLocationSelect={onLocationSelect} />}
 
+        {showMarketplace && <MarketplaceClusters />}
+
         {/* Conditionally render markers only if they exist */}
         {selectedConsumer && (
           <Marker position={[selectedConsumer.location.lat, selectedConsumer.location.lon]} icon={consumerIcon}> {/* Changed to selectedConsumer and added custom icon */}
@@ -1,7 +1,7 @@
 import React, { useState, useEffect } from 'react';
 import { FiTrendingUp, FiActivity, FiBarChart, FiUsers, FiMap, FiCalendar, FiDownload, FiRefreshCw, FiDollarSign, FiTarget } from 'react-icons/fi';
 import { FaLeaf, FaIndustry, FaGlobeAmericas, FaTruck, FaChartLine, FaRobot, FaMicrochip, FaNetworkWired } from 'react-icons/fa';
-import { getProducers, getConsumers } from '../api';
+import { getProducers, getConsumers, awaitJob } from '../api';
 
 function AnalyticsPage() {
   const [activeTab, setActiveTab] = useState(() => {
@@ -94,7 +94,7 @@ function AnalyticsPage() {
       const API_BASE_URL = import.meta.env.VITE_API_BASE_URL || 'https://carbonflow-production.up.railway.app';
       const response = await fetch(`${API_BASE_URL}/api/matching-stats`);
       if (response.ok) {
-        const stats = await response.json();
+        const stats = await awaitJob(response);
         setVectorStats(stats);
         console.log('🧠 Vector system stats loaded:', stats);
       }
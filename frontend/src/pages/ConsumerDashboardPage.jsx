@@ -35,13 +35,15 @@ function ConsumerDashboardPage() {
     setImpactReport(null);
     
     try {
-      const matches = await getConsumerMatches(consumer.id);
-      if (matches.length === 0) {
+      const { matches, pools } = await getConsumerMatches(consumer.id, { pools: 3 });
+      if (matches.length === 0 && pools.length === 0) {
         alert(`No potential producer matches found for ${consumer.name}.`);
         setIsLoading(false);
         return;
       }
-      setProducerMatchesForConsumer({ ranked_matches: matches }); // Wrap in ranked_matches for compatibility
+      // No single producer can cover the demand: show the best pool's producers instead
+      const rankedMatches = matches.length > 0 ? matches : pools[0].producers;
+      setProducerMatchesForConsumer({ ranked_matches: rankedMatches, pools }); // Wrap in ranked_matches for compatibility
     } catch (error) {
       alert(error.message);
     } finally {
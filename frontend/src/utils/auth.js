@@ -67,6 +67,20 @@ export const authAPI = {
     return response.json();
   },
 
+  // Notifications after the given id (the latest ones without it), with the cursor for the next call
+  async getNotifications(after) {
+    const params = after === undefined || after === null ? '' : `?after=${after}`;
+    const response = await fetch(`${API_BASE_URL}/api/notifications${params}`, {
+      headers: getAuthHeaders(),
+    });
+
+    if (!response.ok) {
+      throw new Error('Failed to get notifications');
+    }
+
+    return response.json();
+  },
+
   logout() {
     localStorage.removeItem(TOKEN_KEY);
     localStorage.removeItem(USER_KEY);